@@ -1,28 +1,33 @@
 from datetime import datetime, timedelta
 from typing import Optional
-from jose import JWTError, jwt
-from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from sqlalchemy.orm import Session
+from sqlalchemy import inspect as sa_inspect
+from sqlalchemy.orm import Session, make_transient_to_detached
 from app.db.session import get_db
 from app.models.user import User
 import os
+import uuid
+from app.core.cache import TTLCache
 from app.core.config import settings
-
-# Password hashing
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+from app.core.invalidation import publish_invalidation
+from app.core.security import hash_password_sync, verify_password_and_rehash, verify_password_sync
+from app.core.tokens import TokenError, encode_token, verify_token
 
 # Security scheme
 security = HTTPBearer()
 
+# Column values of recently authenticated users, keyed by user id; dropped on every
+# worker by invalidate_user_cache
+user_cache = TTLCache("auth_user", maxsize=settings.AUTH_USER_CACHE_SIZE, ttl=settings.AUTH_USER_CACHE_TTL)
+
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    """Verify a password against its hash."""
-    return pwd_context.verify(plain_password, hashed_password)
+    """Verify a password against its hash on the calling thread (not for the event loop)."""
+    return verify_password_sync(plain_password, hashed_password)
 
 def get_password_hash(password: str) -> str:
-    """Hash a password."""
-    return pwd_context.hash(password[:72])
+    """Hash a password on the calling thread (not for the event loop; see app.core.security.hash_password)."""
+    return hash_password_sync(password)
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     """Create a JWT access token."""
@@ -32,9 +37,8 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     else:
         expire = datetime.utcnow() + timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
     
-    to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
-    return encoded_jwt
+    to_encode.update({"exp": expire, "type": "access"})
+    return encode_token(to_encode)
 
 def create_refresh_token(data: dict, expires_delta: Optional[timedelta] = None):
     """Create a JWT refresh token."""
@@ -43,19 +47,50 @@ def create_refresh_token(data: dict, expires_delta: Optional[timedelta] = None):
         expire = datetime.utcnow() + expires_delta
     else:
         expire = datetime.utcnow() + timedelta(minutes=settings.REFRESH_TOKEN_EXPIRE_MINUTES)
-    to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
-    return encoded_jwt
+    to_encode.update({"exp": expire, "type": "refresh"})
+    return encode_token(to_encode)
+
+async def authenticate_user(db: Session, email: str, password: str):
+    """
+    Authenticate a user with email and password, verifying off the event loop.
+    Stores a fresh hash when the stored one was made with old parameters.
 
-def authenticate_user(db: Session, email: str, password: str):
-    """Authenticate a user with email and password."""
+    Raises:
+        PasswordHashBusyError: If the password pool is saturated
+    """
     user = db.query(User).filter(User.email == email).first()
     if not user:
         return False
     if not user.password_hash:
         return False
-    if not verify_password(password, user.password_hash):
+    valid, new_hash = await verify_password_and_rehash(password, user.password_hash)
+    if not valid:
         return False
+    if new_hash:
+        user.password_hash = new_hash
+        db.commit()
+        invalidate_user_cache(user.id)
+    return user
+
+def invalidate_user_cache(user_id) -> None:
+    """Drop a user's cached record on every worker; call after any committed change to the users row."""
+    if isinstance(user_id, str):
+        try:
+            user_id = uuid.UUID(user_id)
+        except ValueError:
+            return
+    user_cache.pop(user_id)
+    publish_invalidation(user_cache.name, [user_id])
+
+def auth_cache_stats() -> dict:
+    """Hit rate of the authenticated-user cache; each hit is a users query saved."""
+    return user_cache.stats()
+
+def _user_from_cache(db: Session, values: dict) -> User:
+    """Rebuild a cached user as a persistent instance of this session without querying."""
+    user = User(**values)
+    make_transient_to_detached(user)
+    db.add(user)
     return user
 
 async def get_current_user(
@@ -70,14 +105,22 @@ async def get_current_user(
     )
     
     try:
-        payload = jwt.decode(credentials.credentials, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
+        # Cached per token until it expires, revocation checked in memory
+        payload = verify_token(credentials.credentials, expected_type="access")
         user_id: str = payload.get("sub")
         if user_id is None:
             raise credentials_exception
-    except JWTError:
+        user_uuid = uuid.UUID(user_id)
+    except (TokenError, ValueError):
         raise credentials_exception
     
-    user = db.query(User).filter(User.id == user_id).first()
-    if user is None:
-        raise credentials_exception
+    cached_values = user_cache.get(user_uuid)
+    if cached_values is not None:
+        user = _user_from_cache(db, cached_values)
+    else:
+        user = db.query(User).filter(User.id == user_uuid).first()
+        if user is None:
+            raise credentials_exception
+        user_cache.set(user_uuid, {attr.key: getattr(user, attr.key) for attr in sa_inspect(User).column_attrs})
+    
     return user
\ No newline at end of file
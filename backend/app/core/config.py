@@ -1,5 +1,6 @@
 from pydantic_settings import BaseSettings, SettingsConfigDict
 from pydantic import Field
+from typing import Dict, Optional
 
 class Settings(BaseSettings):
     DATABASE_URL: str = Field(..., description="Database connection string")
@@ -7,6 +8,55 @@ class Settings(BaseSettings):
     ALGORITHM: str = Field(default="HS256", description="Algorithm for JWT (e.g., HS256)")
     ACCESS_TOKEN_EXPIRE_MINUTES: int = Field(default=60, description="How long (in minutes) an access token is valid (for chat apps: 60 recommended)")
     REFRESH_TOKEN_EXPIRE_MINUTES: int = Field(default=43200, description="How long (in minutes) a refresh token is valid (default 30 days)")
+    JWT_SIGNING_KEYS: Optional[str] = Field(default=None, description="Rotating JWT keys as comma separated kid:secret pairs; the first signs new tokens, all verify (tokens without a kid use SECRET_KEY)")
+    TOKEN_CACHE_SIZE: int = Field(default=50000, description="Maximum number of verified tokens whose claims are cached per worker until they expire")
+    WS_TICKET_TTL_SECONDS: int = Field(default=30, description="How long (in seconds) a WebSocket connect ticket from POST /api/auth/ws-ticket can be used")
+    TOKEN_REVOCATION_SYNC_INTERVAL: float = Field(default=5.0, description="Seconds between pulls of newly revoked tokens from the database (0 disables syncing)")
+    USER_SEARCH_CACHE_TTL: float = Field(default=15.0, description="How long (in seconds) user search results are cached per searcher and query")
+    AUTH_USER_CACHE_TTL: float = Field(default=60.0, description="How long (in seconds) an authenticated user's record is cached per worker; changes drop it on every worker")
+    AUTH_USER_CACHE_SIZE: int = Field(default=50000, description="Maximum number of authenticated user records cached per worker")
+    MEMBERSHIP_CACHE_TTL: float = Field(default=300.0, description="How long (in seconds) conversation membership and mute state is cached per worker; changes reach other workers through CACHE_INVALIDATION_LISTEN, and only bound staleness when it is off")
+    MEMBERSHIP_CACHE_SIZE: int = Field(default=100000, description="Maximum number of conversations whose membership is cached per worker")
+    CACHE_INVALIDATION_LISTEN: bool = Field(default=True, description="Share cache invalidations between workers over Postgres LISTEN/NOTIFY; membership and block caches are bypassed while the listener is disconnected")
+    SOCIAL_GRAPH_CACHE_TTL: float = Field(default=300.0, description="How long (in seconds) a user's friends, friend requests and blocks are cached per worker; changes reach other workers through CACHE_INVALIDATION_LISTEN, and only bound staleness when it is off")
+    SOCIAL_GRAPH_CACHE_SIZE: int = Field(default=20000, description="Maximum number of users whose social graph is cached per worker")
+    INTERNAL_API_TOKEN: Optional[str] = Field(default=None, description="Token required in X-Internal-Token for /api/internal endpoints (all refused when unset)")
+    CONTACT_DISCOVERY_MAX_BATCH: int = Field(default=5000, description="Maximum number of phone numbers accepted in one contact discovery request")
+    CONTACT_SYNC_TOKEN_EXPIRE_MINUTES: int = Field(default=43200, description="How long (in minutes) a contact sync token can be used for incremental re-sync (default 30 days)")
+    USER_SEARCH_CACHE_SIZE: int = Field(default=10000, description="Maximum number of cached user search result pages per worker")
+    STORAGE_BACKEND: str = Field(default="local", description="Where uploads are stored: 'local' (UPLOADS_DIR) or 's3' (any S3-compatible store)")
+    S3_BUCKET: Optional[str] = Field(default=None, description="Bucket for STORAGE_BACKEND=s3")
+    S3_ENDPOINT_URL: Optional[str] = Field(default=None, description="Custom S3 endpoint, e.g. http://127.0.0.1:9000 for MinIO (unset for AWS)")
+    S3_REGION: Optional[str] = Field(default=None, description="S3 region")
+    S3_ACCESS_KEY_ID: Optional[str] = Field(default=None, description="S3 access key (falls back to the default AWS credential chain)")
+    S3_SECRET_ACCESS_KEY: Optional[str] = Field(default=None, description="S3 secret key")
+    S3_PUBLIC_URL: Optional[str] = Field(default=None, description="Public base URL of the bucket or its CDN; downloads use presigned URLs when unset")
+    PRESIGN_EXPIRE_SECONDS: int = Field(default=900, description="How long (in seconds) presigned upload and download URLs are valid")
+    UPLOAD_SESSION_MAX_OPEN: int = Field(default=10, description="Resumable upload sessions a user may have open at once")
+    UPLOAD_SESSION_MAX_BYTES: int = Field(default=1024 * 1024 * 1024, description="Total declared size (bytes) of a user's open resumable upload sessions, which are preallocated on disk")
+    THUMBNAIL_WORKERS: int = Field(default=2, description="Processes per API worker that generate image thumbnails (0 disables thumbnails)")
+    FILE_ETAG_CACHE_TTL: float = Field(default=86400.0, description="How long (in seconds) the content hash of a served file not named by its hash is cached")
+    FILE_ETAG_CACHE_SIZE: int = Field(default=20000, description="Maximum number of served-file content hashes cached per worker")
+    THUMBNAIL_WAIT_SECONDS: float = Field(default=2.0, description="How long an upload waits for its thumbnails before returning without them")
+    ORPHAN_SWEEP_INTERVAL: float = Field(default=60.0, description="Seconds between batches of the orphaned upload sweeper (0 disables it)")
+    ORPHAN_SWEEP_BATCH_SIZE: int = Field(default=500, description="Stored files checked per sweeper batch")
+    ORPHAN_SWEEP_GRACE_HOURS: float = Field(default=24.0, description="Files younger than this are never deleted by the sweeper, so pending uploads survive")
+    ORPHAN_SWEEP_DRY_RUN: bool = Field(default=False, description="Only report orphaned files instead of deleting them")
+    BCRYPT_ROUNDS: int = Field(default=12, description="bcrypt cost for new password hashes; stored hashes with another cost are replaced on the next login")
+    PASSWORD_HASH_WORKERS: int = Field(default=2, description="Threads per API worker that hash and verify passwords")
+    PASSWORD_HASH_MAX_PENDING: int = Field(default=64, description="Password hashes allowed running or queued per worker before register/login answer 503")
+    LOG_LEVEL: str = Field(default="INFO", description="Minimum level of app log records (DEBUG, INFO, WARNING, ERROR)")
+    LOG_FORMAT: str = Field(default="json", description="Log output format: json (one object per line) or text")
+    LOG_REQUEST_SAMPLE_RATE: float = Field(default=1.0, description="Fraction of successful, fast requests that get an access log record")
+    LOG_ROUTE_SAMPLE_RATES: Dict[str, float] = Field(default={}, description="Access log sample rate per route template, e.g. {\"/api/messages/{conversation_id}\": 0.05}")
+    LOG_SLOW_REQUEST_MS: float = Field(default=1000.0, description="Requests slower than this (ms) are always logged, at WARNING")
+    SQL_TRACE_HEADERS: bool = Field(default=False, description="Add X-SQL-Count/-Time-Ms/-Slowest-Ms/-N-Plus-One headers to responses (development only)")
+    PROFILER_SAMPLE_HZ: float = Field(default=0.0, description="Rate of the always-on sampling profiler (0 disables it; a few Hz is enough over hours)")
+    PROFILER_OVERHEAD_BUDGET: float = Field(default=0.01, description="Fraction of wall time the always-on profiler may spend sampling before it halves its rate")
+    PROFILER_MAX_SECONDS: float = Field(default=60.0, description="Longest on-demand profile accepted by POST /api/internal/profile")
+    LOOP_MONITOR_INTERVAL: float = Field(default=0.1, description="Seconds between event loop lag measurements (0 disables the loop monitor)")
+    LOOP_BLOCK_THRESHOLD_MS: float = Field(default=100.0, description="Event loop stalls longer than this (ms) have the blocking stack captured and attributed to a handler")
+    SQL_N_PLUS_ONE_THRESHOLD: int = Field(default=5, description="A statement run this many times in one request or WebSocket event is reported as a probable N+1")
 
     model_config = SettingsConfigDict(env_file=".env")
 
@@ -0,0 +1,162 @@
+"""
+Cross-worker invalidation for the in-process caches.
+
+A TTLCache lives in one worker, so dropping an entry after a write only helps
+the worker that made the write. ``publish_invalidation`` also sends the cache
+name and keys on a Postgres NOTIFY channel, and every worker runs an
+``InvalidationListener`` thread that LISTENs on it and pops the same keys from
+its own copy of the cache, typically within milliseconds of the commit.
+
+Caches whose staleness matters for authorization (conversation membership,
+blocks) check ``shared_invalidation_active`` and bypass themselves whenever
+the listener is enabled but not connected: a worker that may have missed
+notifications reads the database until it is listening again, and drops its
+cached entries on reconnect. With CACHE_INVALIDATION_LISTEN off (one worker,
+or no Postgres) invalidation is local only and entries live for their TTL.
+"""
+import json
+import select
+import threading
+import uuid
+from typing import Hashable, Iterable, Optional
+
+from sqlalchemy import text
+
+from app.core.cache import CACHES
+from app.core.config import settings
+from app.db.session import engine, is_postgres
+from app.utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+CHANNEL = "cache_invalidation"
+
+# NOTIFY payloads are limited to 8000 bytes; larger batches are split
+_MAX_KEYS_PER_NOTIFY = 100
+
+# Identifies this worker's own notifications, which it has already applied
+_ORIGIN = uuid.uuid4().hex
+
+
+def _enabled() -> bool:
+    return settings.CACHE_INVALIDATION_LISTEN and is_postgres
+
+
+def _parse_key(key: str) -> Hashable:
+    try:
+        return uuid.UUID(key)
+    except ValueError:
+        return key
+
+
+def publish_invalidation(cache_name: str, keys: Iterable[Hashable]) -> None:
+    """
+    Tell every other worker to drop keys from the named cache; the caller updates or
+    drops its own entries. Call after the write committed.
+    """
+    keys = [str(key) for key in keys]
+    if not keys or not _enabled():
+        return
+    try:
+        with engine.connect() as conn:
+            for start in range(0, len(keys), _MAX_KEYS_PER_NOTIFY):
+                payload = json.dumps({
+                    "cache": cache_name, "origin": _ORIGIN, "keys": keys[start:start + _MAX_KEYS_PER_NOTIFY]
+                })
+                conn.execute(text("SELECT pg_notify(:channel, :payload)"), {"channel": CHANNEL, "payload": payload})
+            conn.commit()
+    except Exception:
+        # Other workers serve the old entry until their TTL runs out
+        logger.exception("Failed to publish invalidation of %s", cache_name)
+
+
+class InvalidationListener:
+    """Thread holding a LISTEN connection and applying invalidations to the local caches."""
+
+    def __init__(self):
+        self.connected = False
+        self.received = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="cache-invalidation", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _apply(self, payload: str) -> None:
+        try:
+            message = json.loads(payload)
+            cache = CACHES.get(message["cache"])
+            keys = message["keys"]
+        except (ValueError, KeyError, TypeError):
+            logger.warning("Ignoring malformed cache invalidation %r", payload)
+            return
+        self.received += 1
+        if cache is not None and message.get("origin") != _ORIGIN:
+            for key in keys:
+                cache.pop(_parse_key(key))
+
+    def _listen(self) -> None:
+        raw = engine.raw_connection()
+        try:
+            connection = raw.driver_connection
+            connection.autocommit = True
+            with connection.cursor() as cursor:
+                cursor.execute(f"LISTEN {CHANNEL}")
+            # Anything cached before this point may have missed a notification
+            for cache in CACHES.values():
+                cache.clear()
+            self.connected = True
+            while not self._stop.is_set():
+                if select.select([connection], [], [], 1.0)[0]:
+                    connection.poll()
+                    while connection.notifies:
+                        self._apply(connection.notifies.pop(0).payload)
+        finally:
+            self.connected = False
+            # Never hand a LISTENing autocommit connection back to the pool
+            raw.invalidate()
+            raw.close()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self._listen()
+            except Exception:
+                logger.exception("Cache invalidation listener lost its connection")
+            self._stop.wait(1.0)
+
+
+invalidation_listener: Optional[InvalidationListener] = None
+
+
+def invalidation_status() -> dict:
+    return {
+        "enabled": _enabled(),
+        "connected": invalidation_listener is not None and invalidation_listener.connected,
+        "received": invalidation_listener.received if invalidation_listener is not None else 0,
+    }
+
+
+def shared_invalidation_active() -> bool:
+    """False while invalidations from other workers may be missed, so shared-state caches should be bypassed."""
+    if not _enabled():
+        return True
+    return invalidation_listener is not None and invalidation_listener.connected
+
+
+def start_invalidation_listener() -> Optional[InvalidationListener]:
+    """Start listening for invalidations from other workers, if enabled."""
+    global invalidation_listener
+    if invalidation_listener is None and _enabled():
+        invalidation_listener = InvalidationListener()
+        invalidation_listener.start()
+    return invalidation_listener
+
+
+def stop_invalidation_listener() -> None:
+    if invalidation_listener is not None:
+        invalidation_listener.stop()
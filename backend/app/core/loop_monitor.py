@@ -0,0 +1,223 @@
+"""
+Event-loop lag monitor.
+
+A task on the loop sleeps LOOP_MONITOR_INTERVAL at a time and records how late
+it wakes up; that scheduling delay is what every other coroutine waiting on the
+loop experienced too. Each wake-up is also a heartbeat for a watchdog thread:
+when a heartbeat is more than LOOP_BLOCK_THRESHOLD_MS late, the loop is stuck
+in a blocking call, so the watchdog grabs the loop thread's stack while it is
+still blocked.
+
+Each stall is attributed to the route or WebSocket handler on that stack (the
+outermost app.routes frame), the app line that made the blocking call and the
+library function it was in, and ranked by total blocked time.
+"""
+import asyncio
+import os
+import sys
+import threading
+import time
+from collections import deque
+from pathlib import Path
+from typing import Deque, Dict, List, Optional, Tuple
+
+from app.core.config import settings
+from app.core.metrics import Counter, Histogram
+from app.utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+_BACKEND_DIR = str(Path(__file__).resolve().parent.parent.parent) + os.sep
+_ROUTES_DIR = os.path.join(_BACKEND_DIR, "app", "routes") + os.sep
+
+# Lag samples kept for percentiles (five minutes at the default interval)
+_LAG_WINDOW = 3000
+
+# Blocking call sites kept in the ranking; the least blocked are dropped first
+_MAX_SITES = 500
+
+loop_lag = Histogram(
+    "event_loop_lag_seconds", "How late the event loop ran a task scheduled to wake up",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+)
+loop_blocks = Counter(
+    "event_loop_blocks_total", "Event loop stalls longer than LOOP_BLOCK_THRESHOLD_MS by handler",
+    labels=("handler",)
+)
+
+
+def _short_path(filename: str) -> str:
+    if filename.startswith(_BACKEND_DIR):
+        return filename[len(_BACKEND_DIR):]
+    for marker in ("site-packages" + os.sep, "lib" + os.sep):
+        index = filename.rfind(marker)
+        if index != -1:
+            return filename[index + len(marker):]
+    return filename
+
+
+def _frame_site(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({_short_path(code.co_filename)}:{frame.f_lineno})"
+
+
+def attribute_stack(frame) -> Tuple[str, str, str]:
+    """
+    Attribute a blocked stack (innermost frame first) to its handler.
+
+    Returns:
+        Tuple of (handler, call_site, leaf): the outermost route function, the
+        innermost app line, and the innermost frame of all
+    """
+    handler = call_site = None
+    leaf = _frame_site(frame)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if filename.startswith(_BACKEND_DIR) and call_site is None:
+            call_site = _frame_site(frame)
+        if filename.startswith(_ROUTES_DIR):
+            # Keep walking: the outermost routes frame is the endpoint itself
+            handler = f"{_short_path(filename)}:{frame.f_code.co_name}"
+        frame = frame.f_back
+    return handler or "(no handler)", call_site or leaf, leaf
+
+
+class LoopMonitor:
+    """Lag sampler task plus the watchdog thread that catches the loop while it's blocked."""
+
+    def __init__(self, interval: float, threshold: float):
+        self.interval = interval
+        self.threshold = threshold
+        self.lags: Deque[float] = deque(maxlen=_LAG_WINDOW)
+        self.sites: Dict[Tuple[str, str], dict] = {}
+        self.stalls = 0
+        self._beat = time.monotonic()
+        self._loop_thread: Optional[int] = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self._loop_thread = threading.get_ident()
+        self._beat = time.monotonic()
+        self._task = asyncio.get_running_loop().create_task(self._measure())
+        self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._watchdog.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _measure(self) -> None:
+        while True:
+            scheduled = time.monotonic()
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = max(now - scheduled - self.interval, 0.0)
+            self._beat = now
+            self.lags.append(lag)
+            loop_lag.observe(lag)
+
+    def _watch(self) -> None:
+        check_every = max(self.threshold / 4, 0.005)
+        stalled_beat = None
+        stalled_at = None
+        captured = None
+        while not self._stop.wait(check_every):
+            beat = self._beat
+            if captured is not None and beat != stalled_beat:
+                # The loop is running again: the stall lasted until this heartbeat
+                self._record(captured, beat - stalled_at)
+                captured = None
+            late = time.monotonic() - beat - self.interval
+            if captured is None and late > self.threshold and beat != stalled_beat:
+                frame = sys._current_frames().get(self._loop_thread)
+                if frame is not None:
+                    captured = attribute_stack(frame)
+                    stalled_beat = beat
+                    stalled_at = beat + self.interval
+                del frame
+
+    def _record(self, attribution: Tuple[str, str, str], duration: float) -> None:
+        handler, call_site, leaf = attribution
+        loop_blocks.inc(handler)
+        with self._lock:
+            self.stalls += 1
+            site = self.sites.get((handler, call_site))
+            if site is None:
+                if len(self.sites) >= _MAX_SITES:
+                    least = min(self.sites, key=lambda key: self.sites[key]["total_ms"])
+                    del self.sites[least]
+                site = self.sites[(handler, call_site)] = {
+                    "handler": handler, "call_site": call_site, "leaf": leaf,
+                    "count": 0, "total_ms": 0.0, "max_ms": 0.0,
+                }
+            duration_ms = duration * 1000
+            site["count"] += 1
+            site["total_ms"] += duration_ms
+            site["max_ms"] = max(site["max_ms"], duration_ms)
+            site["leaf"] = leaf
+        if duration_ms >= settings.LOG_SLOW_REQUEST_MS:
+            logger.warning(
+                "Event loop blocked for %.0f ms in %s at %s", duration_ms, handler, call_site,
+                extra={"handler": handler, "call_site": call_site, "leaf": leaf, "blocked_ms": round(duration_ms, 1)}
+            )
+
+    def lag_percentiles(self) -> dict:
+        lags = sorted(self.lags)
+        if not lags:
+            return {"samples": 0}
+
+        def percentile(fraction: float) -> float:
+            return round(lags[min(int(fraction * len(lags)), len(lags) - 1)] * 1000, 3)
+
+        return {
+            "samples": len(lags),
+            "p50_ms": percentile(0.50),
+            "p90_ms": percentile(0.90),
+            "p99_ms": percentile(0.99),
+            "max_ms": round(lags[-1] * 1000, 3),
+        }
+
+    def blocking_sites(self, limit: int = 50) -> List[dict]:
+        """Blocking call sites, most total blocked time first."""
+        with self._lock:
+            sites = [dict(site) for site in self.sites.values()]
+        for site in sites:
+            site["total_ms"] = round(site["total_ms"], 1)
+            site["max_ms"] = round(site["max_ms"], 1)
+        return sorted(sites, key=lambda site: site["total_ms"], reverse=True)[:limit]
+
+    def reset(self) -> None:
+        with self._lock:
+            self.sites.clear()
+            self.stalls = 0
+        self.lags.clear()
+
+    def status(self, limit: int = 50) -> dict:
+        return {
+            "interval_ms": self.interval * 1000,
+            "threshold_ms": self.threshold * 1000,
+            "lag": self.lag_percentiles(),
+            "stalls": self.stalls,
+            "blocking_sites": self.blocking_sites(limit),
+        }
+
+
+loop_monitor: Optional[LoopMonitor] = None
+
+
+def start_loop_monitor() -> Optional[LoopMonitor]:
+    """Start monitoring the running loop, if LOOP_MONITOR_INTERVAL is set. Call from the loop."""
+    global loop_monitor
+    if loop_monitor is None and settings.LOOP_MONITOR_INTERVAL > 0:
+        loop_monitor = LoopMonitor(settings.LOOP_MONITOR_INTERVAL, settings.LOOP_BLOCK_THRESHOLD_MS / 1000)
+        loop_monitor.start()
+    return loop_monitor
+
+
+def stop_loop_monitor() -> None:
+    if loop_monitor is not None:
+        loop_monitor.stop()
@@ -0,0 +1,89 @@
+"""
+Conversation membership cache used to authorize and fan out messages.
+
+Entries are dropped on every worker when a conversation's members or muted_by
+change (``invalidate_membership`` publishes through app.core.invalidation), and
+the cache is bypassed while this worker may be missing those invalidations.
+"""
+import uuid
+from typing import FrozenSet, NamedTuple, Optional, Union
+from sqlalchemy.orm import Session
+from app.core.cache import TTLCache
+from app.core.config import settings
+from app.core.invalidation import publish_invalidation, shared_invalidation_active
+from app.models.conversation import Conversation
+
+
+class ConversationMembership(NamedTuple):
+    """Immutable snapshot of who is in a conversation and who muted it."""
+    conversation_id: uuid.UUID
+    type: Optional[str]
+    members: FrozenSet[uuid.UUID]
+    muted_by: FrozenSet[uuid.UUID]
+    # String form of members, matching the user ids used by the WebSocket manager
+    member_keys: FrozenSet[str]
+
+    def is_member(self, user_id: uuid.UUID) -> bool:
+        return user_id in self.members
+
+    def is_muted_for(self, user_id: uuid.UUID) -> bool:
+        return user_id in self.muted_by
+
+
+# conversation_id -> ConversationMembership. Conversations that don't exist are not cached,
+# so creating a conversation needs no invalidation; every write to members or muted_by
+# must call invalidate_membership after committing.
+membership_cache = TTLCache("conversation_membership", maxsize=settings.MEMBERSHIP_CACHE_SIZE, ttl=settings.MEMBERSHIP_CACHE_TTL)
+
+
+def _as_uuid(conversation_id: Union[uuid.UUID, str]) -> Optional[uuid.UUID]:
+    if isinstance(conversation_id, uuid.UUID):
+        return conversation_id
+    try:
+        return uuid.UUID(str(conversation_id))
+    except ValueError:
+        return None
+
+
+def get_membership(db: Session, conversation_id: Union[uuid.UUID, str]) -> Optional[ConversationMembership]:
+    """
+    Get the membership of a conversation, querying only on a cache miss.
+    
+    Returns:
+        ConversationMembership, or None if the conversation doesn't exist
+    """
+    conversation_uuid = _as_uuid(conversation_id)
+    if conversation_uuid is None:
+        return None
+    
+    use_cache = shared_invalidation_active()
+    if use_cache:
+        membership = membership_cache.get(conversation_uuid)
+        if membership is not None:
+            return membership
+    
+    row = db.query(Conversation.type, Conversation.members, Conversation.muted_by).filter(
+        Conversation.id == conversation_uuid
+    ).first()
+    if row is None:
+        return None
+    
+    members = frozenset(row.members or ())
+    membership = ConversationMembership(
+        conversation_id=conversation_uuid,
+        type=row.type,
+        members=members,
+        muted_by=frozenset(row.muted_by or ()),
+        member_keys=frozenset(str(member_id) for member_id in members)
+    )
+    if use_cache:
+        membership_cache.set(conversation_uuid, membership)
+    return membership
+
+
+def invalidate_membership(conversation_id: Union[uuid.UUID, str]) -> None:
+    """Drop a cached membership on every worker; call after changing a conversation's members or muted_by."""
+    conversation_uuid = _as_uuid(conversation_id)
+    if conversation_uuid is not None:
+        membership_cache.pop(conversation_uuid)
+        publish_invalidation(membership_cache.name, [conversation_uuid])
@@ -0,0 +1,189 @@
+"""
+In-process metrics rendered in the Prometheus text format.
+
+Counters and histograms are pre-aggregated per label combination as they are
+recorded, so an observation is a dictionary lookup, a bisect and two additions;
+rendering (GET /api/internal/metrics) does the cumulative bucket sums. Gauges
+are read from a callback at render time instead of being kept up to date.
+
+Metrics are per worker process, like the caches in app.core.cache; Prometheus
+sums them across workers when each is scraped.
+"""
+import bisect
+import math
+import threading
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, List, Sequence, Tuple, Union
+
+# Registry of every metric, in registration order, for rendering
+METRICS: Dict[str, "_Metric"] = {}
+
+# Seconds; spans fast cache hits to slow uploads
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Recipients per broadcast
+FAN_OUT_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+GaugeValue = Union[float, Dict[Tuple[str, ...], float]]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric(ABC):
+    """Registered metric; subclasses render their own samples."""
+
+    kind = ""
+
+    def __init__(self, name: str, description: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        METRICS[name] = self
+
+    def _header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.kind}"]
+
+    @abstractmethod
+    def render(self) -> List[str]:
+        """HELP and TYPE lines followed by the samples."""
+
+
+class Counter(_Metric):
+    """Monotonic count per label combination."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, description: str, labels: Sequence[str] = ()):
+        super().__init__(name, description, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *label_values: str, amount: float = 1) -> None:
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = list(self._values.items())
+        lines = self._header()
+        for label_values, value in values:
+            lines.append(f"{self.name}{_format_labels(self.labels, label_values)} {_format_value(value)}")
+        return lines
+
+
+class Histogram(_Metric):
+    """Bucketed distribution per label combination, with its sum and count."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, description: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, description, labels)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [per-bucket counts (last one is +Inf), sum]
+        self._series: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, *label_values: str) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self) -> List[str]:
+        with self._lock:
+            series = [(label_values, list(counts), total) for label_values, (counts, total) in self._series.items()]
+        lines = self._header()
+        for label_values, counts, total in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                labels = _format_labels(self.labels, label_values, f'le="{_format_value(bound)}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labels, label_values)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Gauge(_Metric):
+    """
+    Current value read from a callback when metrics are rendered. The callback returns
+    a number, or a dict of label values -> number for a gauge with labels.
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name: str, description: str, read: Callable[[], GaugeValue], labels: Sequence[str] = ()):
+        super().__init__(name, description, labels)
+        self.read = read
+
+    def render(self) -> List[str]:
+        lines = self._header()
+        try:
+            value = self.read()
+        except Exception:
+            return lines
+        values = value.items() if isinstance(value, dict) else [((), value)]
+        for label_values, number in values:
+            lines.append(f"{self.name}{_format_labels(self.labels, label_values)} {_format_value(number)}")
+        return lines
+
+
+def render_metrics() -> str:
+    """Every registered metric in the Prometheus text exposition format."""
+    lines = []
+    for metric in list(METRICS.values()):
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# HTTP requests, labelled by route template (not the raw URL) so IDs don't multiply series
+http_request_duration = Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route template",
+    labels=("method", "route", "status")
+)
+
+# WebSocket events handled in websocket_endpoint; unknown types share one label
+WS_MESSAGE_TYPES = frozenset({
+    "join_room", "set_active_conversation", "leave_room", "message",
+    "typing", "read_receipt", "delivery_receipt",
+})
+ws_message_duration = Histogram(
+    "ws_message_duration_seconds", "Time to handle an incoming WebSocket message by type",
+    labels=("type",)
+)
+ws_broadcast_duration = Histogram(
+    "ws_broadcast_duration_seconds", "Time spent in ConnectionManager.broadcast_to_room"
+)
+ws_broadcast_recipients = Histogram(
+    "ws_broadcast_recipients", "Recipients per room broadcast (fan-out size)", buckets=FAN_OUT_BUCKETS
+)
+ws_send_failures = Counter(
+    "ws_send_failures_total", "Room broadcast deliveries that raised"
+)
+
+
+def ws_message_type_label(message_type) -> str:
+    return message_type if isinstance(message_type, str) and message_type in WS_MESSAGE_TYPES else "other"
@@ -0,0 +1,196 @@
+"""
+Sampling profiler for a live worker.
+
+A sampler thread periodically reads the stack of every thread in the process
+(``sys._current_frames``), which covers the event loop, threadpool workers and
+background threads without instrumenting them, and counts each stack in the
+collapsed format flamegraph.pl and speedscope read: ``thread;outer;...;inner count``.
+
+Two modes:
+
+- ``profile(seconds, hz)``: sample for a fixed time and return the result
+  (POST /api/internal/profile).
+- ``ContinuousSampler``: an optional always-on, low-frequency sampler
+  (PROFILER_SAMPLE_HZ) aggregating hot stacks for the life of the worker.
+
+Overhead budget: a sample walks every thread's stack while holding the GIL,
+typically 20-100 microseconds per sample in this app. The continuous sampler
+measures the time it spends sampling and halves its rate whenever that exceeds
+PROFILER_OVERHEAD_BUDGET of wall time (1% by default), so at the default 5 Hz
+it costs well under 0.1% of one core. On-demand profiles are capped at
+PROFILER_MAX_SECONDS and 1000 Hz, and only one runs at a time.
+"""
+import os
+import sys
+import threading
+import time
+from collections import Counter as Tally
+from functools import lru_cache
+from typing import Dict, Optional
+
+from app.core.config import settings
+from app.utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+# Distinct stacks kept by the continuous sampler; rarer new ones are folded into one entry
+MAX_STACKS = 20000
+_OVERFLOW_STACK = "[other stacks]"
+
+_profile_lock = threading.Lock()
+
+_SOURCE_ROOTS = sorted({os.path.dirname(os.path.abspath(path)) for path in sys.path if path}, key=len, reverse=True)
+
+
+class ProfilerBusyError(RuntimeError):
+    """Raised when an on-demand profile is requested while another one is running."""
+
+
+@lru_cache(maxsize=16384)
+def _frame_label(code) -> str:
+    filename = code.co_filename
+    for root in _SOURCE_ROOTS:
+        if filename.startswith(root + os.sep):
+            filename = filename[len(root) + 1:]
+            break
+    return f"{code.co_name} ({filename}:{code.co_firstlineno})".replace(";", ":")
+
+
+def sample_stacks(skip_thread: Optional[int] = None) -> Dict[int, str]:
+    """Collapsed stack of every thread (except skip_thread), keyed by thread ident."""
+    names = {thread.ident: thread.name for thread in threading.enumerate()}
+    stacks = {}
+    for ident, frame in sys._current_frames().items():
+        if ident == skip_thread:
+            continue
+        labels = []
+        while frame is not None:
+            labels.append(_frame_label(frame.f_code))
+            frame = frame.f_back
+        labels.append(names.get(ident, f"thread-{ident}").replace(";", ":"))
+        labels.reverse()
+        stacks[ident] = ";".join(labels)
+    return stacks
+
+
+def format_collapsed(counts: Dict[str, int]) -> str:
+    """Collapsed-stack text, one ``stack count`` line per stack, hottest first."""
+    return "".join(f"{stack} {count}\n" for stack, count in sorted(counts.items(), key=lambda item: -item[1]))
+
+
+def profile(seconds: float, hz: float) -> str:
+    """
+    Sample every thread for seconds at hz and return collapsed stacks.
+    Blocks the calling thread for the duration; call it from a threadpool.
+
+    Raises:
+        ProfilerBusyError: If another on-demand profile is running
+    """
+    seconds = min(max(seconds, 0.1), settings.PROFILER_MAX_SECONDS)
+    interval = 1 / min(max(hz, 1), 1000)
+    if not _profile_lock.acquire(blocking=False):
+        raise ProfilerBusyError("A profile is already running")
+    try:
+        me = threading.get_ident()
+        counts: Tally = Tally()
+        deadline = time.monotonic() + seconds
+        next_sample = time.monotonic()
+        while next_sample < deadline:
+            counts.update(sample_stacks(skip_thread=me).values())
+            next_sample += interval
+            time.sleep(max(next_sample - time.monotonic(), 0))
+        return format_collapsed(counts)
+    finally:
+        _profile_lock.release()
+
+
+class ContinuousSampler:
+    """Low-frequency background sampler aggregating hot stacks since start (or the last reset)."""
+
+    def __init__(self, hz: float, overhead_budget: float):
+        self.hz = hz
+        self.overhead_budget = overhead_budget
+        self.counts: Tally = Tally()
+        self.samples = 0
+        self.sampling_time = 0.0
+        self.started_at = time.time()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="profiler-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _record(self, stacks) -> None:
+        with self._lock:
+            for stack in stacks:
+                if stack in self.counts or len(self.counts) < MAX_STACKS:
+                    self.counts[stack] += 1
+                else:
+                    self.counts[_OVERFLOW_STACK] += 1
+            self.samples += 1
+
+    def _run(self) -> None:
+        me = threading.get_ident()
+        window_start = time.monotonic()
+        window_cost = 0.0
+        while not self._stop.wait(1 / self.hz):
+            started = time.perf_counter()
+            self._record(sample_stacks(skip_thread=me).values())
+            cost = time.perf_counter() - started
+            self.sampling_time += cost
+            window_cost += cost
+
+            elapsed = time.monotonic() - window_start
+            if elapsed >= 10:
+                if window_cost / elapsed > self.overhead_budget and self.hz > 0.1:
+                    self.hz /= 2
+                    logger.warning("Profiler over its overhead budget; sampling at %.2f Hz", self.hz)
+                window_start = time.monotonic()
+                window_cost = 0.0
+
+    def collapsed(self) -> str:
+        with self._lock:
+            counts = dict(self.counts)
+        return format_collapsed(counts)
+
+    def reset(self) -> None:
+        with self._lock:
+            self.counts.clear()
+            self.samples = 0
+            self.sampling_time = 0.0
+            self.started_at = time.time()
+
+    def status(self) -> dict:
+        running_for = max(time.time() - self.started_at, 1e-9)
+        return {
+            "hz": self.hz,
+            "samples": self.samples,
+            "stacks": len(self.counts),
+            "running_seconds": round(running_for, 1),
+            "overhead": round(self.sampling_time / running_for, 6),
+            "overhead_budget": self.overhead_budget,
+        }
+
+
+continuous_sampler: Optional[ContinuousSampler] = None
+
+
+def start_continuous_sampler() -> Optional[ContinuousSampler]:
+    """Start the always-on sampler if PROFILER_SAMPLE_HZ is set."""
+    global continuous_sampler
+    if continuous_sampler is None and settings.PROFILER_SAMPLE_HZ > 0:
+        continuous_sampler = ContinuousSampler(settings.PROFILER_SAMPLE_HZ, settings.PROFILER_OVERHEAD_BUDGET)
+        continuous_sampler.start()
+    return continuous_sampler
+
+
+def stop_continuous_sampler() -> None:
+    if continuous_sampler is not None:
+        continuous_sampler.stop()
@@ -0,0 +1,13 @@
+import json
+from fastapi.responses import JSONResponse
+
+# Custom JSON encoder that preserves Unicode characters (emojis)
+class UnicodeJSONResponse(JSONResponse):
+    def render(self, content) -> bytes:
+        return json.dumps(
+            content,
+            ensure_ascii=False,
+            allow_nan=False,
+            indent=None,
+            separators=(",", ":"),
+        ).encode("utf-8")
@@ -0,0 +1,141 @@
+"""
+Password hashing off the event loop.
+
+bcrypt costs 100-300 ms of CPU per call by design, so register and login hand it
+to a small dedicated thread pool (bcrypt releases the GIL while hashing) instead
+of running it on the loop, where it would stall every WebSocket on the worker.
+The pool is bounded twice: PASSWORD_HASH_WORKERS threads hash at once, and at
+most PASSWORD_HASH_MAX_PENDING calls may be running or queued; beyond that calls
+fail fast with PasswordHashBusyError (a 503), so a login storm after an outage
+queues a bounded amount of work rather than minutes of it.
+
+Hashes are created with BCRYPT_ROUNDS. A successful login whose stored hash uses
+other parameters (or a deprecated scheme) gets a fresh hash to store.
+"""
+import asyncio
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
+
+from passlib.context import CryptContext
+
+from app.core.config import settings
+from app.core.metrics import Counter, Gauge, Histogram
+
+# Password hashing
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=settings.BCRYPT_ROUNDS)
+
+_BCRYPT_COST = re.compile(r"^\$2[abxy]?\$(\d{2})\$")
+
+_pool: Optional[ThreadPoolExecutor] = None
+# Calls running or queued in the pool; released by the pool future's done callback,
+# which runs on a hashing thread, so only when the work has really finished
+_pending = 0
+_pending_lock = threading.Lock()
+
+password_hash_duration = Histogram(
+    "password_hash_seconds", "Time from submitting a password hash or verify to its result, queueing included",
+    labels=("op",)
+)
+password_hash_rejected = Counter(
+    "password_hash_rejected_total", "Password hash or verify calls refused because the pool queue was full",
+    labels=("op",)
+)
+Gauge("password_hash_pending", "Password hash or verify calls running or queued", lambda: _pending)
+
+
+class PasswordHashBusyError(RuntimeError):
+    """Raised when too many password hashes are already running or queued."""
+
+
+def hash_password_sync(password: str) -> str:
+    """Hash a password on the calling thread (scripts and the pool)."""
+    return pwd_context.hash(password[:72])
+
+
+def verify_password_sync(password: str, hashed_password: str) -> bool:
+    """Verify a password on the calling thread (scripts and the pool)."""
+    return pwd_context.verify(password, hashed_password)
+
+
+def needs_rehash(hashed_password: str) -> bool:
+    """Whether a stored hash was made with other parameters than the current ones."""
+    match = _BCRYPT_COST.match(hashed_password)
+    if match and int(match.group(1)) != settings.BCRYPT_ROUNDS:
+        return True
+    return pwd_context.needs_update(hashed_password)
+
+
+def _verify_and_update(password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    if not verify_password_sync(password, hashed_password):
+        return False, None
+    return True, hash_password_sync(password) if needs_rehash(hashed_password) else None
+
+
+def _get_pool() -> ThreadPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ThreadPoolExecutor(max_workers=settings.PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+    return _pool
+
+
+def shutdown_password_pool() -> None:
+    """Stop the hashing threads; call on application shutdown."""
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def _release(op: str, started: float) -> None:
+    global _pending
+    with _pending_lock:
+        _pending -= 1
+    password_hash_duration.observe(time.perf_counter() - started, op)
+
+
+async def _run_in_pool(op: str, func, *args):
+    global _pending
+    with _pending_lock:
+        busy = _pending >= settings.PASSWORD_HASH_MAX_PENDING
+        if not busy:
+            _pending += 1
+    if busy:
+        password_hash_rejected.inc(op)
+        raise PasswordHashBusyError("Too many logins in progress, try again shortly")
+    started = time.perf_counter()
+    try:
+        future = _get_pool().submit(func, *args)
+    except BaseException:
+        _release(op, started)
+        raise
+    # A cancelled caller (client gone) doesn't stop a hash already running, so the slot
+    # is held until the future is done: finished, failed, or cancelled while queued
+    future.add_done_callback(lambda _: _release(op, started))
+    return await asyncio.wrap_future(future)
+
+
+async def hash_password(password: str) -> str:
+    """
+    Hash a password in the pool.
+
+    Raises:
+        PasswordHashBusyError: If PASSWORD_HASH_MAX_PENDING calls are already pending
+    """
+    return await _run_in_pool("hash", hash_password_sync, password)
+
+
+async def verify_password_and_rehash(password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """
+    Verify a password in the pool.
+
+    Returns:
+        Tuple of (valid, new_hash): new_hash is set when the password is valid but the
+        stored hash should be replaced because the hashing parameters changed
+
+    Raises:
+        PasswordHashBusyError: If PASSWORD_HASH_MAX_PENDING calls are already pending
+    """
+    return await _run_in_pool("verify", _verify_and_update, password, hashed_password)
@@ -0,0 +1,164 @@
+"""
+Per-user social graph cache: contacts, friend requests and blocks.
+
+Changes are published to every worker through app.core.invalidation, and the
+cache is bypassed while this worker may be missing those invalidations, so a
+block takes effect on every worker as soon as it is committed.
+"""
+import uuid
+from datetime import datetime
+from typing import Dict, FrozenSet, Iterable, Optional, Tuple
+from sqlalchemy import or_
+from sqlalchemy.orm import Session
+from app.core.cache import TTLCache
+from app.core.config import settings
+from app.core.invalidation import publish_invalidation, shared_invalidation_active
+from app.models.blocked_user import BlockedUser
+from app.models.contact import Contact
+from app.models.friend_request import FriendRequest
+
+
+class SocialGraph:
+    """
+    Immutable snapshot of one user's relationships.
+
+    Every route that writes contacts, friend_requests or blocked_users must call
+    ``invalidate_social_graph`` (or ``record_friend_request``) for both users
+    involved after committing.
+    """
+    __slots__ = ("user_id", "contacts", "sent_requests", "received_requests", "blocked", "blocked_by", "friends")
+
+    def __init__(
+        self,
+        user_id: uuid.UUID,
+        contacts: Dict[uuid.UUID, Tuple[str, Optional[datetime]]],
+        sent_requests: Dict[uuid.UUID, Tuple[uuid.UUID, str]],
+        received_requests: Dict[uuid.UUID, Tuple[uuid.UUID, str]],
+        blocked: FrozenSet[uuid.UUID],
+        blocked_by: FrozenSet[uuid.UUID]
+    ):
+        self.user_id = user_id
+        # peer_id -> (status, created_at) of contacts owned by this user
+        self.contacts = contacts
+        # receiver_id -> (request_id, status) of requests sent by this user
+        self.sent_requests = sent_requests
+        # sender_id -> (request_id, status) of requests received by this user
+        self.received_requests = received_requests
+        # Users this user blocked / users who blocked this user
+        self.blocked = blocked
+        self.blocked_by = blocked_by
+        self.friends: FrozenSet[uuid.UUID] = frozenset(
+            peer_id for peer_id, (status, _) in contacts.items() if status == "accepted"
+        )
+
+    def is_friend(self, user_id: uuid.UUID) -> bool:
+        return user_id in self.friends
+
+    def is_blocked_with(self, user_id: uuid.UUID) -> bool:
+        """True if either user blocked the other."""
+        return user_id in self.blocked or user_id in self.blocked_by
+
+    @property
+    def blocked_either_way(self) -> FrozenSet[uuid.UUID]:
+        return self.blocked | self.blocked_by
+
+    @property
+    def pending_outgoing(self) -> FrozenSet[uuid.UUID]:
+        return frozenset(peer for peer, (_, status) in self.sent_requests.items() if status == "pending")
+
+    @property
+    def pending_incoming(self) -> FrozenSet[uuid.UUID]:
+        return frozenset(peer for peer, (_, status) in self.received_requests.items() if status == "pending")
+
+
+social_graph_cache = TTLCache("social_graph", maxsize=settings.SOCIAL_GRAPH_CACHE_SIZE, ttl=settings.SOCIAL_GRAPH_CACHE_TTL)
+
+
+def load_social_graph(db: Session, user_id: uuid.UUID) -> SocialGraph:
+    """Load a user's social graph with one query per table."""
+    contacts = {
+        row.peer_id: (row.status, row.created_at)
+        for row in db.query(Contact.peer_id, Contact.status, Contact.created_at).filter(Contact.owner_id == user_id)
+    }
+
+    sent_requests = {}
+    received_requests = {}
+    request_rows = db.query(
+        FriendRequest.id, FriendRequest.sender_id, FriendRequest.receiver_id, FriendRequest.status
+    ).filter(
+        or_(FriendRequest.sender_id == user_id, FriendRequest.receiver_id == user_id)
+    ).order_by(FriendRequest.created_at)
+    for row in request_rows:
+        # Ordered by creation so the latest request between two users wins
+        if row.sender_id == user_id:
+            sent_requests[row.receiver_id] = (row.id, row.status)
+        else:
+            received_requests[row.sender_id] = (row.id, row.status)
+
+    blocked = set()
+    blocked_by = set()
+    block_rows = db.query(BlockedUser.blocker_id, BlockedUser.blocked_user_id).filter(
+        or_(BlockedUser.blocker_id == user_id, BlockedUser.blocked_user_id == user_id)
+    )
+    for row in block_rows:
+        if row.blocker_id == user_id:
+            blocked.add(row.blocked_user_id)
+        else:
+            blocked_by.add(row.blocker_id)
+
+    return SocialGraph(user_id, contacts, sent_requests, received_requests, frozenset(blocked), frozenset(blocked_by))
+
+
+def get_social_graph(db: Session, user_id: uuid.UUID) -> SocialGraph:
+    """Get a user's social graph, querying only on a cache miss."""
+    if not shared_invalidation_active():
+        return load_social_graph(db, user_id)
+    graph = social_graph_cache.get(user_id)
+    if graph is None:
+        graph = load_social_graph(db, user_id)
+        social_graph_cache.set(user_id, graph)
+    return graph
+
+
+def record_friend_request(
+    request_id: uuid.UUID,
+    sender_id: uuid.UUID,
+    receiver_id: uuid.UUID,
+    status: str,
+    contact_rows: Iterable
+) -> None:
+    """
+    Apply a newly created friend request to the cached graphs of both users.
+
+    Copies the cached snapshot instead of dropping it, so the next request of a user
+    with thousands of contacts doesn't reload the whole graph.
+    contact_rows are the (owner_id, peer_id, status, created_at) rows written alongside.
+    Other workers drop their copies.
+    """
+    contact_rows = list(contact_rows)
+    publish_invalidation(social_graph_cache.name, [sender_id, receiver_id])
+    for user_id in (sender_id, receiver_id):
+        graph = social_graph_cache.get(user_id)
+        if graph is None:
+            continue
+        contacts = dict(graph.contacts)
+        for row in contact_rows:
+            if row.owner_id == user_id:
+                contacts[row.peer_id] = (row.status, row.created_at)
+        sent_requests = dict(graph.sent_requests)
+        received_requests = dict(graph.received_requests)
+        if user_id == sender_id:
+            sent_requests[receiver_id] = (request_id, status)
+        else:
+            received_requests[sender_id] = (request_id, status)
+        social_graph_cache.set(
+            user_id,
+            SocialGraph(user_id, contacts, sent_requests, received_requests, graph.blocked, graph.blocked_by)
+        )
+
+
+def invalidate_social_graph(*user_ids: uuid.UUID) -> None:
+    """Drop cached graphs on every worker; call with both users after any relationship change."""
+    for user_id in user_ids:
+        social_graph_cache.pop(user_id)
+    publish_invalidation(social_graph_cache.name, user_ids)
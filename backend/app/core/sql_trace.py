@@ -0,0 +1,155 @@
+"""
+Per-request SQL tracing.
+
+Engine events attribute every statement to the HTTP request or WebSocket event
+that is running (held in a context variable, which follows the handler into
+threadpool calls), counting queries, their total time and the slowest one.
+A parameterised statement executed SQL_N_PLUS_ONE_THRESHOLD times or more in
+one request is reported as a probable N+1 pattern.
+
+With SQL_TRACE_HEADERS on (development), responses carry X-SQL-* headers;
+otherwise the totals only go to the metrics and the N+1 report.
+"""
+import threading
+import time
+from collections import Counter as Tally
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app.core.config import settings
+from app.core.metrics import LATENCY_BUCKETS, Counter, Histogram
+from app.utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+# Statements per request
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 250, 1000)
+
+_current: ContextVar[Optional["SqlTrace"]] = ContextVar("sql_trace", default=None)
+
+# Statements kept in the N+1 report; the least recently seen are dropped first
+_REPORT_SIZE = 200
+_n_plus_one: Dict[Tuple[str, str], dict] = {}
+_report_lock = threading.Lock()
+
+sql_queries = Histogram(
+    "sql_queries_per_request", "SQL statements executed per request or WebSocket event",
+    labels=("handler",), buckets=QUERY_COUNT_BUCKETS
+)
+sql_time = Histogram(
+    "sql_time_per_request_seconds", "Time spent executing SQL per request or WebSocket event",
+    labels=("handler",), buckets=LATENCY_BUCKETS
+)
+sql_n_plus_one = Counter(
+    "sql_n_plus_one_total", "Requests that repeated one statement SQL_N_PLUS_ONE_THRESHOLD times or more",
+    labels=("handler",)
+)
+
+
+class SqlTrace:
+    """Queries run on behalf of one request or WebSocket event."""
+
+    __slots__ = ("handler", "count", "total", "slowest", "slowest_statement", "statements")
+
+    def __init__(self, handler: str):
+        self.handler = handler
+        self.count = 0
+        self.total = 0.0
+        self.slowest = 0.0
+        self.slowest_statement = ""
+        self.statements: Tally = Tally()
+
+    def record(self, statement: str, elapsed: float) -> None:
+        self.count += 1
+        self.total += elapsed
+        self.statements[statement] += 1
+        if elapsed > self.slowest:
+            self.slowest = elapsed
+            self.slowest_statement = statement
+
+    def repeated(self) -> List[Tuple[str, int]]:
+        """Statements run at least SQL_N_PLUS_ONE_THRESHOLD times, most repeated first."""
+        threshold = settings.SQL_N_PLUS_ONE_THRESHOLD
+        return [(statement, count) for statement, count in self.statements.most_common() if count >= threshold]
+
+    def headers(self) -> Dict[str, str]:
+        headers = {
+            "X-SQL-Count": str(self.count),
+            "X-SQL-Time-Ms": f"{self.total * 1000:.2f}",
+            "X-SQL-Slowest-Ms": f"{self.slowest * 1000:.2f}",
+        }
+        repeated = self.repeated()
+        if repeated:
+            headers["X-SQL-N-Plus-One"] = str(len(repeated))
+        return headers
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None and _current.get() is not None:
+        context._sql_trace_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    trace = _current.get()
+    started = getattr(context, "_sql_trace_started", None)
+    if trace is None or started is None:
+        return
+    trace.record(statement, time.perf_counter() - started)
+
+
+def install_sql_tracing(engine: Engine) -> None:
+    """Attach the tracing listeners to engine. Idempotent."""
+    if not event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+def start_trace(handler: str) -> SqlTrace:
+    """Attribute the queries run from here on in the current context (and tasks it starts) to a new trace."""
+    trace = SqlTrace(handler)
+    _current.set(trace)
+    return trace
+
+
+def finish_trace(trace: SqlTrace, handler: Optional[str] = None) -> None:
+    """
+    Record a finished trace in the metrics and the N+1 report.
+
+    Args:
+        handler: Label to record under, if it's only known once the request has
+                 been routed (defaults to the label the trace was started with)
+    """
+    if handler:
+        trace.handler = handler
+    sql_queries.observe(trace.count, trace.handler)
+    sql_time.observe(trace.total, trace.handler)
+    repeated = trace.repeated()
+    if not repeated:
+        return
+    sql_n_plus_one.inc(trace.handler)
+    with _report_lock:
+        for statement, count in repeated:
+            key = (trace.handler, statement)
+            entry = _n_plus_one.pop(key, None)
+            if entry is None:
+                logger.warning(
+                    "Probable N+1 in %s: statement ran %d times in one request", trace.handler, count,
+                    extra={"handler": trace.handler, "statement": statement, "repeats": count}
+                )
+                entry = {"handler": trace.handler, "statement": statement, "occurrences": 0, "max_repeats": 0}
+            entry["occurrences"] += 1
+            entry["max_repeats"] = max(entry["max_repeats"], count)
+            entry["last_seen"] = time.time()
+            _n_plus_one[key] = entry
+        while len(_n_plus_one) > _REPORT_SIZE:
+            del _n_plus_one[next(iter(_n_plus_one))]
+
+
+def n_plus_one_report() -> List[dict]:
+    """Probable N+1 statements seen recently, most frequent first."""
+    with _report_lock:
+        entries = [dict(entry) for entry in _n_plus_one.values()]
+    return sorted(entries, key=lambda entry: (entry["occurrences"], entry["max_repeats"]), reverse=True)
@@ -0,0 +1,290 @@
+"""
+JWT signing and verification fast path.
+
+Signing keys: JWT_SIGNING_KEYS lists ``kid:secret`` pairs. The first signs new
+tokens, with its ``kid`` in the token header, and every listed key verifies, so
+a key is rotated by putting a new one first and dropping the old one once its
+tokens have expired. Tokens without a ``kid`` (or every token when the setting
+is unset) use SECRET_KEY.
+
+Verified claims are cached per worker, keyed by the SHA-256 of the token, until
+the token's ``exp``: a client sending the same bearer token on every request
+pays for one signature check, not one per request.
+
+Every accepted token must carry a ``jti`` and a ``type`` claim ("access" or
+"refresh"), and callers say which type they expect, so a refresh token can't
+be used as a bearer token or the other way round.
+
+Revocation: revoking a token stores its ``jti`` in revoked_tokens.
+Each worker keeps the unexpired revoked jtis in memory, a Bloom filter in
+front of an exact set, and pulls new rows every TOKEN_REVOCATION_SYNC_INTERVAL
+seconds, so the check on every request never touches the database. Nearly all
+tokens miss the filter; a filter hit is confirmed against the exact set. The
+list is loaded once at startup, before the worker serves requests, and
+revocations made on another worker take effect here within one sync interval.
+"""
+import asyncio
+import hashlib
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Optional, Tuple
+
+from jose import JWTError, jwt
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from app.core.cache import TTLCache
+from app.core.config import settings
+from app.core.metrics import Counter
+from app.db.session import SessionLocal
+from app.models.revoked_token import RevokedToken
+from app.utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+# Revocations re-read on each incremental sync, in case a writer's clock or commit lagged
+_SYNC_OVERLAP = timedelta(seconds=30)
+
+# Full reloads drop expired revocations and resize the filter
+_FULL_SYNC_EVERY = 600.0
+
+token_verifications = Counter(
+    "token_verifications_total", "Bearer token checks by outcome (cached, verified, revoked, invalid)",
+    labels=("result",)
+)
+
+# Verified claims by token digest, each expiring with its token
+claims_cache = TTLCache("token_claims", maxsize=settings.TOKEN_CACHE_SIZE, ttl=settings.ACCESS_TOKEN_EXPIRE_MINUTES * 60)
+
+
+class TokenError(Exception):
+    """Raised for a token that is malformed, badly signed, expired or revoked."""
+
+
+class KeyRing:
+    """Signing key (first) and verification keys by kid."""
+
+    def __init__(self, keys: Dict[str, str], fallback: str):
+        self.keys = keys
+        self.fallback = fallback
+        self.signing_kid = next(iter(keys), None)
+
+    @classmethod
+    def parse(cls, spec: Optional[str], fallback: str) -> "KeyRing":
+        keys = {}
+        for pair in (spec or "").split(","):
+            kid, sep, secret = pair.strip().partition(":")
+            if pair.strip():
+                if not sep or not kid or not secret:
+                    raise ValueError("JWT_SIGNING_KEYS entries must look like kid:secret")
+                keys[kid] = secret
+        return cls(keys, fallback)
+
+    def signing_key(self) -> Tuple[Optional[str], str]:
+        if self.signing_kid is None:
+            return None, self.fallback
+        return self.signing_kid, self.keys[self.signing_kid]
+
+    def verification_key(self, kid: Optional[str]) -> Optional[str]:
+        if kid is None:
+            return self.fallback
+        return self.keys.get(kid)
+
+
+keyring = KeyRing.parse(settings.JWT_SIGNING_KEYS, settings.SECRET_KEY)
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter of strings (about 1% false positives at capacity)."""
+
+    def __init__(self, capacity: int, bits_per_item: int = 10, hashes: int = 7):
+        self.size = max(capacity, 1024) * bits_per_item
+        self.hashes = hashes
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item: str):
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        step = int.from_bytes(digest[8:], "little") | 1
+        return [(first + i * step) % self.size for i in range(self.hashes)]
+
+    def add(self, item: str) -> None:
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+
+class RevocationList:
+    """In-memory copy of the unexpired rows of revoked_tokens."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._filter = BloomFilter(0)
+        self._revoked: Dict[str, datetime] = {}
+        self._synced_at: Optional[datetime] = None
+        self._full_sync_at = 0.0
+        self.filter_hits = 0
+        self.false_positives = 0
+
+    def is_revoked(self, jti: str) -> bool:
+        if jti not in self._filter:
+            return False
+        self.filter_hits += 1
+        if jti in self._revoked:
+            return True
+        self.false_positives += 1
+        return False
+
+    def add(self, entries: Iterable[Tuple[str, datetime]]) -> None:
+        with self._lock:
+            for jti, expires_at in entries:
+                self._revoked[jti] = expires_at
+                self._filter.add(jti)
+
+    def sync(self, db: Session) -> int:
+        """Pull revocations from the database (all of them on a full sync); returns rows read."""
+        now = datetime.utcnow()
+        full = self._synced_at is None or time.monotonic() - self._full_sync_at >= _FULL_SYNC_EVERY
+        query = db.query(RevokedToken.jti, RevokedToken.expires_at).filter(RevokedToken.expires_at > now)
+        if not full:
+            query = query.filter(RevokedToken.revoked_at >= self._synced_at - _SYNC_OVERLAP)
+        rows = query.all()
+        if full:
+            revoked = {jti: expires_at for jti, expires_at in rows}
+            bloom = BloomFilter(2 * len(revoked))
+            for jti in revoked:
+                bloom.add(jti)
+            with self._lock:
+                # Keep revocations added locally while the query ran
+                for jti, expires_at in self._revoked.items():
+                    if jti not in revoked and expires_at > now:
+                        revoked[jti] = expires_at
+                        bloom.add(jti)
+                self._revoked, self._filter = revoked, bloom
+            self._full_sync_at = time.monotonic()
+        else:
+            self.add(rows)
+        self._synced_at = now
+        return len(rows)
+
+    def stats(self) -> dict:
+        return {
+            "revoked": len(self._revoked),
+            "filter_bits": self._filter.size,
+            "filter_hits": self.filter_hits,
+            "false_positives": self.false_positives,
+            "synced_at": self._synced_at.isoformat() if self._synced_at else None,
+        }
+
+
+revocations = RevocationList()
+
+
+def encode_token(claims: dict) -> str:
+    """Sign claims with the current key, adding a jti so the token can be revoked."""
+    to_encode = dict(claims)
+    to_encode.setdefault("jti", uuid.uuid4().hex)
+    kid, secret = keyring.signing_key()
+    headers = {"kid": kid} if kid else None
+    return jwt.encode(to_encode, secret, algorithm=settings.ALGORITHM, headers=headers)
+
+
+def decode_token(token: str) -> dict:
+    """
+    Check a token's signature and expiry with the key named by its kid, without the cache.
+
+    Raises:
+        TokenError: If the token is malformed, signed with an unknown key, badly signed or expired
+    """
+    try:
+        kid = jwt.get_unverified_header(token).get("kid")
+        secret = keyring.verification_key(kid)
+        if secret is None:
+            raise TokenError(f"Unknown signing key {kid!r}")
+        claims = jwt.decode(token, secret, algorithms=[settings.ALGORITHM])
+    except JWTError as e:
+        raise TokenError(str(e)) from e
+    if "exp" not in claims:
+        raise TokenError("Token has no expiry")
+    return claims
+
+
+def verify_token(token: str, expected_type: str = "access") -> dict:
+    """
+    Claims of a valid, unrevoked token of expected_type; the signature is checked once
+    per token per worker.
+
+    Raises:
+        TokenError: If the token is invalid, expired, revoked, of another type or has no jti
+    """
+    digest = hashlib.sha256(token.encode()).digest()
+    claims = claims_cache.get(digest)
+    result = "cached"
+    if claims is None:
+        try:
+            claims = decode_token(token)
+        except TokenError:
+            token_verifications.inc("invalid")
+            raise
+        claims_cache.set(digest, claims, ttl=claims["exp"] - time.time())
+        result = "verified"
+    jti = claims.get("jti")
+    if not jti or claims.get("type") != expected_type:
+        token_verifications.inc("invalid")
+        raise TokenError(f"Not a revocable {expected_type} token")
+    if revocations.is_revoked(jti):
+        token_verifications.inc("revoked")
+        raise TokenError("Token has been revoked")
+    token_verifications.inc(result)
+    return claims
+
+
+def revoke_token(db: Session, token: str, expected_type: str = "access", subject: Optional[str] = None) -> bool:
+    """
+    Revoke a valid token of expected_type until it expires; returns False for tokens
+    that can't be revoked (invalid, of another type, or not for subject when given).
+    """
+    try:
+        claims = verify_token(token, expected_type)
+    except TokenError:
+        return False
+    jti = claims["jti"]
+    if subject is not None and claims.get("sub") != subject:
+        return False
+    expires_at = datetime.utcfromtimestamp(claims["exp"])
+    try:
+        user_id = uuid.UUID(claims["sub"])
+    except (KeyError, TypeError, ValueError):
+        user_id = None
+    db.execute(
+        insert(RevokedToken)
+        .values(jti=jti, user_id=user_id, expires_at=expires_at, revoked_at=datetime.utcnow())
+        .on_conflict_do_nothing(index_elements=["jti"])
+    )
+    db.commit()
+    revocations.add([(jti, expires_at)])
+    return True
+
+
+def load_revocations() -> int:
+    """Pull revoked tokens from the database now; returns rows read. Raises if the database can't be read."""
+    db = SessionLocal()
+    try:
+        return revocations.sync(db)
+    finally:
+        db.close()
+
+
+async def run_revocation_sync() -> None:
+    """Background task: pull new revoked tokens every TOKEN_REVOCATION_SYNC_INTERVAL seconds, after the startup load."""
+    while True:
+        await asyncio.sleep(settings.TOKEN_REVOCATION_SYNC_INTERVAL)
+        try:
+            await run_in_threadpool(load_revocations)
+        except Exception:
+            logger.exception("Revoked token sync failed")
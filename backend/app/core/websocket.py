@@ -1,7 +1,12 @@
 import json
 import asyncio
-from typing import Dict, Set, Optional
+import time
+from typing import AbstractSet, Dict, Set, Optional
 from fastapi import WebSocket, WebSocketDisconnect
+from app.core.metrics import Gauge, ws_broadcast_duration, ws_broadcast_recipients, ws_send_failures
+from app.utils.logger import get_logger
+
+logger = get_logger(__name__)
 
 class ConnectionManager:
     def __init__(self):
@@ -24,7 +29,7 @@ class ConnectionManager:
         # Broadcast online status
         await self.broadcast_user_status(user_id, "online")
         
-        print(f"User {user_id} connected")
+        logger.debug("User %s connected", user_id)
     
     def disconnect(self, websocket: WebSocket, user_id: str):
         """Disconnect a user websocket"""
@@ -47,14 +52,14 @@ class ConnectionManager:
         for room_id in rooms_to_leave:
             del self.rooms[room_id]
         
-        print(f"User {user_id} disconnected")
+        logger.debug("User %s disconnected", user_id)
     
     async def join_room(self, user_id: str, room_id: str):
         """Join a conversation room"""
         if room_id not in self.rooms:
             self.rooms[room_id] = set()
         self.rooms[room_id].add(user_id)
-        print(f"User {user_id} joined room {room_id}")
+        logger.debug("User %s joined room %s", user_id, room_id)
     
     async def leave_room(self, user_id: str, room_id: str):
         """Leave a conversation room"""
@@ -62,7 +67,7 @@ class ConnectionManager:
             self.rooms[room_id].discard(user_id)
             if not self.rooms[room_id]:
                 del self.rooms[room_id]
-        print(f"User {user_id} left room {room_id}")
+        logger.debug("User %s left room %s", user_id, room_id)
     
     async def send_personal_message(self, message: str, user_id: str):
         """Send a message to a specific user"""
@@ -81,8 +86,15 @@ class ConnectionManager:
                 if not self.active_connections[user_id]:
                     del self.active_connections[user_id]
     
-    async def broadcast_to_room(self, message: str, room_id: str, exclude_user: Optional[str] = None):
-        """Broadcast a message to all users in a room"""
+    async def broadcast_to_room(
+        self,
+        message: str,
+        room_id: str,
+        exclude_user: Optional[str] = None,
+        allowed_users: Optional[AbstractSet[str]] = None
+    ):
+        """Broadcast a message to all users in a room (optionally only those in allowed_users, e.g. conversation members)"""
+        started = time.perf_counter()
         recipients_sent = []
         recipients_failed = []
         
@@ -90,27 +102,30 @@ class ConnectionManager:
             # Get all users in the room
             recipients = self.rooms[room_id].copy()
             
+            # Rooms are joined by clients, so only deliver to actual conversation members when known
+            if allowed_users is not None:
+                recipients &= allowed_users
+            
             # Remove excluded user if specified
             if exclude_user:
                 recipients.discard(exclude_user)
             
-            print(f"Broadcasting to {len(recipients)} users in room {room_id}: {recipients}")
+            logger.debug("Broadcasting to %d users in room %s", len(recipients), room_id)
             
             # Send message to each user
             for user_id in recipients:
                 try:
                     await self.send_personal_message(message, user_id)
                     recipients_sent.append(user_id)
-                    print(f"Successfully sent message to user {user_id}")
                 except Exception as e:
                     recipients_failed.append((user_id, str(e)))
-                    print(f"Failed to send message to user {user_id}: {e}")
+                    ws_send_failures.inc()
+                    logger.warning("Failed to send message to user %s: %s", user_id, e)
         else:
-            print(f"Warning: Room {room_id} not found in active rooms. Active rooms: {list(self.rooms.keys())}")
-        
-        if recipients_failed:
-            print(f"Failed to send to {len(recipients_failed)} users: {recipients_failed}")
+            logger.debug("Room %s not found in active rooms", room_id)
         
+        ws_broadcast_recipients.observe(len(recipients_sent) + len(recipients_failed))
+        ws_broadcast_duration.observe(time.perf_counter() - started)
         return {
             "sent": recipients_sent,
             "failed": recipients_failed
@@ -124,7 +139,7 @@ class ConnectionManager:
     def set_active_conversation(self, user_id: str, conversation_id: str):
         """Track which conversation a user is currently viewing"""
         self.active_conversations[user_id] = conversation_id
-        print(f"User {user_id} is viewing conversation {conversation_id}")
+        logger.debug("User %s is viewing conversation %s", user_id, conversation_id)
     
     def clear_active_conversation(self, user_id: str, conversation_id: str = None):
         """Clear active conversation for a user"""
@@ -157,4 +172,11 @@ class ConnectionManager:
                     pass  # Ignore errors for disconnected users
 
 # Global connection manager instance
-manager = ConnectionManager()
\ No newline at end of file
+manager = ConnectionManager()
+
+Gauge("ws_connections", "Open WebSocket connections",
+      lambda: sum(len(sockets) for sockets in list(manager.active_connections.values())))
+Gauge("ws_connected_users", "Users with at least one open WebSocket", lambda: len(manager.active_connections))
+Gauge("ws_rooms", "Conversation rooms with at least one member joined", lambda: len(manager.rooms))
+Gauge("ws_room_members", "Room memberships across all rooms",
+      lambda: sum(len(members) for members in list(manager.rooms.values())))
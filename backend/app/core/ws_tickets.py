@@ -0,0 +1,103 @@
+"""
+One-time WebSocket connect tickets.
+
+Browsers can't set an Authorization header on a WebSocket handshake, so a client
+first calls POST /api/auth/ws-ticket with its bearer token and then opens
+/api/ws/{user_id}?ticket=... within WS_TICKET_TTL_SECONDS.
+
+A ticket is the user id, its expiry and a random nonce, signed with an HMAC of
+SECRET_KEY, so any worker can check one without a lookup. Redeeming a ticket
+claims its nonce in used_connect_tickets with a single INSERT ... ON CONFLICT DO
+NOTHING, so it is accepted once across all workers; badly signed or expired
+tickets are refused before touching the database. The orphan sweeper drops
+claimed nonces once their tickets have expired.
+"""
+import base64
+import hashlib
+import hmac
+import os
+import struct
+import time
+import uuid
+from datetime import datetime
+
+from sqlalchemy import delete
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.core.metrics import Counter
+from app.models.used_connect_ticket import UsedConnectTicket
+
+# user id (16 bytes), expiry (unix seconds, 4 bytes), nonce (8 bytes)
+_PAYLOAD = struct.Struct(">16sI8s")
+_SIGNATURE_BYTES = 16
+
+_key = hmac.new(settings.SECRET_KEY.encode(), b"ws-connect-ticket", hashlib.sha256).digest()
+
+ws_tickets = Counter(
+    "ws_connect_tickets_total", "WebSocket connect tickets by outcome (issued, accepted, invalid, expired, reused)",
+    labels=("result",)
+)
+
+
+class TicketError(Exception):
+    """Raised for a connect ticket that is malformed, badly signed, expired or already used."""
+
+
+def _claim(db: Session, nonce: bytes, expires_at: int) -> bool:
+    """Record a nonce for all workers; False if it was already recorded."""
+    result = db.execute(
+        insert(UsedConnectTicket)
+        .values(nonce=nonce.hex(), expires_at=datetime.utcfromtimestamp(expires_at))
+        .on_conflict_do_nothing(index_elements=["nonce"])
+    )
+    db.commit()
+    return result.rowcount == 1
+
+
+def prune_used_tickets(db: Session) -> int:
+    """Drop the nonces of expired tickets, which can't be redeemed anyway; returns rows deleted."""
+    result = db.execute(delete(UsedConnectTicket).where(UsedConnectTicket.expires_at < datetime.utcnow()))
+    db.commit()
+    return result.rowcount
+
+
+def _sign(payload: bytes) -> bytes:
+    return hmac.new(_key, payload, hashlib.sha256).digest()[:_SIGNATURE_BYTES]
+
+
+def issue_ticket(user_id: uuid.UUID) -> str:
+    """Signed single-use ticket letting user_id open a WebSocket for WS_TICKET_TTL_SECONDS."""
+    payload = _PAYLOAD.pack(user_id.bytes, int(time.time()) + settings.WS_TICKET_TTL_SECONDS, os.urandom(8))
+    ws_tickets.inc("issued")
+    return base64.urlsafe_b64encode(payload + _sign(payload)).decode().rstrip("=")
+
+
+def redeem_ticket(db: Session, ticket: str) -> uuid.UUID:
+    """
+    User id of a valid ticket, which can't be redeemed again on any worker.
+
+    Raises:
+        TicketError: If the ticket is malformed, badly signed, expired or already used
+    """
+    try:
+        raw = base64.urlsafe_b64decode(ticket + "=" * (-len(ticket) % 4))
+    except (ValueError, TypeError):
+        raw = b""
+    if len(raw) != _PAYLOAD.size + _SIGNATURE_BYTES:
+        ws_tickets.inc("invalid")
+        raise TicketError("Invalid connect ticket")
+    payload, signature = raw[:_PAYLOAD.size], raw[_PAYLOAD.size:]
+    if not hmac.compare_digest(signature, _sign(payload)):
+        ws_tickets.inc("invalid")
+        raise TicketError("Invalid connect ticket")
+    user_bytes, expires_at, nonce = _PAYLOAD.unpack(payload)
+    if expires_at < time.time():
+        ws_tickets.inc("expired")
+        raise TicketError("Expired connect ticket")
+    if not _claim(db, nonce, expires_at):
+        ws_tickets.inc("reused")
+        raise TicketError("Connect ticket already used")
+    ws_tickets.inc("accepted")
+    return uuid.UUID(bytes=user_bytes)
@@ -7,6 +7,11 @@ from app.models.call import Call
 from app.models.invite import Invite
 from app.models.blocked_user import BlockedUser
 from app.models.notification import Notification
+from app.models.phone_book_entry import PhoneBookEntry
+from app.models.attachment_blob import AttachmentBlob
+from app.models.storage_usage import StorageUsage
+from app.models.revoked_token import RevokedToken
+from app.models.used_connect_ticket import UsedConnectTicket
 
 __all__ = [
     "User",
@@ -17,6 +22,11 @@ __all__ = [
     "Call",
     "Invite",
     "BlockedUser",
-    "Notification"
+    "Notification",
+    "PhoneBookEntry",
+    "AttachmentBlob",
+    "StorageUsage",
+    "RevokedToken",
+    "UsedConnectTicket"
 ]
 
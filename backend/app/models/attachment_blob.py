@@ -0,0 +1,25 @@
+from sqlalchemy import Column, String, DateTime, Integer, BigInteger, JSON
+from app.db.session import Base
+from datetime import datetime
+
+class AttachmentBlob(Base):
+    """Content-addressed attachment file, shared by every message whose media_url points at it."""
+    __tablename__ = "attachment_blobs"
+    
+    sha256 = Column(String(64), primary_key=True)
+    url = Column(String, unique=True, nullable=False)
+    size = Column(BigInteger, nullable=False)
+    # Number of messages whose media_url is this blob's url; 0 means unreferenced
+    ref_count = Column(Integer, nullable=False, default=0, server_default="0")
+    # Thumbnails of image blobs (size name -> url, width, height) and their blurhash
+    variants = Column(JSON, nullable=True)
+    placeholder = Column(String, nullable=True)
+    # Dimensions / duration parsed from the file's headers ({} when the format isn't recognised)
+    media_metadata = Column(JSON, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    # Last time the url was handed to a client (upload, hash check, presign); the orphan
+    # sweeper keeps an unreferenced blob for its grace period after that
+    last_claimed_at = Column(DateTime, nullable=True)
+    
+    def __repr__(self):
+        return f"<AttachmentBlob sha256={self.sha256} url={self.url} ref_count={self.ref_count}>"
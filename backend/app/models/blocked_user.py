@@ -1,4 +1,4 @@
-from sqlalchemy import Column, DateTime, UUID, ForeignKey, UniqueConstraint
+from sqlalchemy import Column, DateTime, UUID, ForeignKey, UniqueConstraint, Index
 from sqlalchemy.dialects.postgresql import UUID as PGUUID
 from app.db.session import Base
 from datetime import datetime
@@ -14,8 +14,9 @@ class BlockedUser(Base):
     
     __table_args__ = (
         UniqueConstraint('blocker_id', 'blocked_user_id', name='unique_blocker_blocked'),
+        # Reverse lookup ("who blocked me") used by user search and block checks
+        Index('ix_blocked_users_blocked_blocker', 'blocked_user_id', 'blocker_id'),
     )
     
     def __repr__(self):
         return f"<BlockedUser blocker_id={self.blocker_id} blocked_user_id={self.blocked_user_id}>"
-
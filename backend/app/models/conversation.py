@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, DateTime, ARRAY, UUID, Text, Enum, ForeignKey
+from sqlalchemy import Column, String, DateTime, ARRAY, UUID, Text, Enum, ForeignKey, Index
 from sqlalchemy.dialects.postgresql import UUID as PGUUID
 from app.db.session import Base
 from datetime import datetime
@@ -16,4 +16,9 @@ class Conversation(Base):
     last_message = Column(Text, nullable=True)
     last_message_at = Column(DateTime, nullable=True)
     muted_by = Column(ARRAY(PGUUID(as_uuid=True)), default=[])
-    created_at = Column(DateTime, default=datetime.utcnow)
\ No newline at end of file
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        # Exact lookups by URL (orphan sweeps)
+        Index("ix_conversations_avatar_url", "avatar_url", postgresql_using="hash"),
+    )
\ No newline at end of file
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, DateTime, UUID, Enum, ForeignKey
+from sqlalchemy import Column, String, DateTime, UUID, Enum, ForeignKey, Index
 from sqlalchemy.dialects.postgresql import UUID as PGUUID
 from app.db.session import Base   
 from datetime import datetime
@@ -11,4 +11,9 @@ class FriendRequest(Base):
     sender_id = Column(PGUUID(as_uuid=True), ForeignKey("users.id"))
     receiver_id = Column(PGUUID(as_uuid=True), ForeignKey("users.id"))
     status = Column(Enum("pending", "accepted", "rejected", "blocked", name="friend_request_status"), default="pending")
-    created_at = Column(DateTime, default=datetime.utcnow)
\ No newline at end of file
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index('ix_friend_requests_sender_receiver', 'sender_id', 'receiver_id'),
+        Index('ix_friend_requests_receiver_sender', 'receiver_id', 'sender_id'),
+    )
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, DateTime, ForeignKey, Boolean, Integer, Float
+from sqlalchemy import Column, String, DateTime, ForeignKey, Boolean, Integer, Float, JSON, Index
 from sqlalchemy import Enum as SAEnum
 from sqlalchemy.dialects.postgresql import ARRAY, UUID
 from sqlalchemy import Text
@@ -31,6 +31,9 @@ class Message(Base):
     emojis = Column(Text, nullable=True)  # Store extracted emojis (multiple emojis as string)
     media_url = Column(String, nullable=True)
     file_name = Column(String, nullable=True)
+    media_variants = Column(JSON, nullable=True)  # Thumbnails of media_url, copied from its attachment blob
+    media_placeholder = Column(String, nullable=True)  # Blurhash of media_url
+    media_metadata = Column(JSON, nullable=True)  # Width / height / duration of media_url, copied from its attachment blob
     delivered_to = Column(ARRAY(UUID(as_uuid=True)), nullable=False, default=list)
     read_by = Column(ARRAY(UUID(as_uuid=True)), nullable=False, default=list)
     deleted_for = Column(ARRAY(UUID(as_uuid=True)), nullable=False, default=list)
@@ -40,3 +43,9 @@ class Message(Base):
     longitude = Column(Float, nullable=True)  # Location longitude
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        # Exact lookups by URL (attachment reference counts, thumbnails, orphan sweeps); hash
+        # rather than btree, since old rows may hold URLs longer than a btree entry allows
+        Index("ix_messages_media_url", "media_url", postgresql_using="hash"),
+    )
@@ -0,0 +1,12 @@
+from sqlalchemy import Column, String, DateTime, ForeignKey
+from sqlalchemy.dialects.postgresql import UUID as PGUUID
+from app.db.session import Base
+from datetime import datetime
+
+class PhoneBookEntry(Base):
+    """Hashed phone number from a user's synced address book (used for incremental contact discovery)."""
+    __tablename__ = "phone_book_entries"
+    
+    owner_id = Column(PGUUID(as_uuid=True), ForeignKey("users.id"), primary_key=True)
+    phone_hash = Column(String, primary_key=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
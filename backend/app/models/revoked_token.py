@@ -0,0 +1,17 @@
+from sqlalchemy import Column, String, DateTime, ForeignKey
+from sqlalchemy.dialects.postgresql import UUID as PGUUID
+from app.db.session import Base
+from datetime import datetime
+
+class RevokedToken(Base):
+    """Access or refresh token (by jti) rejected before its expiry; rows past expires_at can be dropped."""
+    __tablename__ = "revoked_tokens"
+    
+    jti = Column(String(64), primary_key=True)
+    user_id = Column(PGUUID(as_uuid=True), ForeignKey("users.id"), nullable=True)
+    expires_at = Column(DateTime, nullable=False, index=True)
+    # Workers pull revocations newer than their last sync
+    revoked_at = Column(DateTime, nullable=False, default=datetime.utcnow, index=True)
+    
+    def __repr__(self):
+        return f"<RevokedToken jti={self.jti} user_id={self.user_id} expires_at={self.expires_at}>"
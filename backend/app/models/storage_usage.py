@@ -0,0 +1,17 @@
+from sqlalchemy import Column, DateTime, Integer, BigInteger, ForeignKey
+from sqlalchemy.dialects.postgresql import UUID as PGUUID
+from app.db.session import Base
+from datetime import datetime
+
+class StorageUsage(Base):
+    """Bytes of stored media charged to a user, kept up to date as media is added and removed."""
+    __tablename__ = "storage_usage"
+    
+    user_id = Column(PGUUID(as_uuid=True), ForeignKey("users.id"), primary_key=True)
+    # Attachments of the user's messages (not deleted for everyone) plus their avatar
+    bytes_used = Column(BigInteger, nullable=False, default=0, server_default="0")
+    file_count = Column(Integer, nullable=False, default=0, server_default="0")
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def __repr__(self):
+        return f"<StorageUsage user_id={self.user_id} bytes_used={self.bytes_used} file_count={self.file_count}>"
@@ -0,0 +1,12 @@
+from sqlalchemy import Column, String, DateTime
+from app.db.session import Base
+
+class UsedConnectTicket(Base):
+    """Nonce of a redeemed WebSocket connect ticket; rows past expires_at can be dropped."""
+    __tablename__ = "used_connect_tickets"
+    
+    nonce = Column(String(16), primary_key=True)
+    expires_at = Column(DateTime, nullable=False, index=True)
+    
+    def __repr__(self):
+        return f"<UsedConnectTicket nonce={self.nonce} expires_at={self.expires_at}>"
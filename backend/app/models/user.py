@@ -1,15 +1,17 @@
-from sqlalchemy import Column, String, DateTime, Boolean, ForeignKey, UUID as PGUUID
+from sqlalchemy import Column, String, DateTime, Boolean, ForeignKey, Index, event, func, UUID as PGUUID
 from sqlalchemy.dialects.postgresql import UUID
 from datetime import datetime
 import uuid
 from sqlalchemy.orm import relationship
 from app.db.session import Base
+from app.utils.phone import normalize_phone, hash_phone
 
 class User(Base):
     __tablename__ = "users"
     
     id = Column(PGUUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     phone = Column(String, unique=True, nullable=True)
+    phone_hash = Column(String, nullable=True, index=True)  # SHA-256 of the normalized phone, kept in sync with phone
     email = Column(String, unique=True, nullable=True)
     username = Column(String, unique=True, nullable=True)
     password_hash = Column(String, nullable=True)
@@ -17,4 +19,26 @@ class User(Base):
     avatar_url = Column(String, nullable=True)
     last_seen = Column(DateTime, default=datetime.utcnow)
     discoverable = Column(Boolean, default=True)
-    created_at = Column(DateTime, default=datetime.utcnow)
\ No newline at end of file
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        # Prefix search: lower(col) LIKE 'q%' (requires text_pattern_ops outside the C locale)
+        Index("ix_users_username_lower_prefix", func.lower(username).label("username_lower"),
+              postgresql_ops={"username_lower": "text_pattern_ops"}),
+        Index("ix_users_display_name_lower_prefix", func.lower(display_name).label("display_name_lower"),
+              postgresql_ops={"display_name_lower": "text_pattern_ops"}),
+        # Substring and fuzzy search: ILIKE '%q%' and the pg_trgm % operator (requires the pg_trgm extension)
+        Index("ix_users_username_trgm", "username",
+              postgresql_using="gin", postgresql_ops={"username": "gin_trgm_ops"}),
+        Index("ix_users_display_name_trgm", "display_name",
+              postgresql_using="gin", postgresql_ops={"display_name": "gin_trgm_ops"}),
+        # Exact lookups by URL (avatar sharing checks, orphan sweeps)
+        Index("ix_users_avatar_url", "avatar_url", postgresql_using="hash"),
+    )
+
+
+@event.listens_for(User.phone, "set")
+def sync_phone_hash(target, value, oldvalue, initiator):
+    """Keep phone_hash in sync whenever phone is assigned."""
+    normalized = normalize_phone(value) if value else None
+    target.phone_hash = hash_phone(normalized) if normalized else None
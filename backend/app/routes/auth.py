@@ -9,18 +9,28 @@ from app.core.auth import (
     authenticate_user,
     create_access_token,
     create_refresh_token,
-    get_password_hash,
     get_current_user,
+    invalidate_user_cache,
 )
 from app.core.config import settings
+from app.core.security import PasswordHashBusyError, hash_password
+from app.core.tokens import TokenError, revoke_token, verify_token
+from app.core.ws_tickets import issue_ticket
 from datetime import datetime
 import re
 import uuid
-from jose import JWTError, jwt
 from fastapi import Request
 
 router = APIRouter()
 
+def password_pool_busy() -> HTTPException:
+    """503 for register/login while the password hashing queue is full."""
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Too many sign-ins in progress, please retry shortly",
+        headers={"Retry-After": "1"},
+    )
+
 @router.post("/register", response_model=None)
 async def register(credentials: UserCreate, db: Session = Depends(get_db)):
     """Register a new user and return access token."""
@@ -40,7 +50,10 @@ async def register(credentials: UserCreate, db: Session = Depends(get_db)):
             detail="Username already taken"
         )
     
-    hashed_password = get_password_hash(credentials.password)
+    try:
+        hashed_password = await hash_password(credentials.password)
+    except PasswordHashBusyError:
+        raise password_pool_busy()
     
     # Generate user ID from username (first 8 characters + random suffix)
     username_prefix = credentials.username[:8].upper()
@@ -86,7 +99,10 @@ async def register(credentials: UserCreate, db: Session = Depends(get_db)):
 @router.post("/login", response_model=None)
 async def login(credentials: UserLogin, db: Session = Depends(get_db)):
     """Login user and return access token."""
-    user = authenticate_user(db, credentials.email, credentials.password)
+    try:
+        user = await authenticate_user(db, credentials.email, credentials.password)
+    except PasswordHashBusyError:
+        raise password_pool_busy()
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -108,6 +124,7 @@ async def login(credentials: UserLogin, db: Session = Depends(get_db)):
     try:
         db.execute(update(User).where(User.id == user.id).values(last_seen=datetime.utcnow()))
         db.commit()
+        invalidate_user_cache(user.id)
     except Exception as e:
         print(f"Error updating last_seen: {e}")
         db.rollback()
@@ -132,14 +149,14 @@ async def refresh_token(request: Request):
         raise HTTPException(status_code=401, detail="Refresh token required")
 
     try:
-        payload = jwt.decode(refresh_token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
+        payload = verify_token(refresh_token, expected_type="refresh")
         user_id = payload.get("sub")
         exp = payload.get("exp")
         if not user_id or not exp:
             raise HTTPException(status_code=401, detail="Invalid refresh token")
         if datetime.utcfromtimestamp(exp) < datetime.utcnow():
             raise HTTPException(status_code=401, detail="Expired refresh token")
-    except JWTError:
+    except TokenError:
         raise HTTPException(status_code=401, detail="Invalid refresh token")
 
     access_token_expires = timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
@@ -156,6 +173,27 @@ async def refresh_token(request: Request):
         "refresh_token_expires": settings.REFRESH_TOKEN_EXPIRE_MINUTES
     }
 
+@router.post("/logout", status_code=status.HTTP_204_NO_CONTENT)
+async def logout(request: Request, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    """Revoke the access token of this request and, if given, the refresh token in the body."""
+    try:
+        data = await request.json()
+    except ValueError:
+        data = {}
+    access_token = request.headers.get("Authorization", "").partition(" ")[2]
+    revoke_token(db, access_token, expected_type="access")
+    refresh_token = data.get("refresh_token") if isinstance(data, dict) else None
+    if refresh_token:
+        revoke_token(db, refresh_token, expected_type="refresh", subject=str(current_user.id))
+
+@router.post("/ws-ticket")
+async def create_ws_ticket(current_user: User = Depends(get_current_user)):
+    """Single-use ticket for opening /api/ws/{user_id}?ticket=... as the current user."""
+    return {
+        "ticket": issue_ticket(current_user.id),
+        "expires_in": settings.WS_TICKET_TTL_SECONDS
+    }
+
 @router.get("/me", response_model=UserResponse)
 async def get_current_user_info(current_user: User = Depends(get_current_user)):
     """Get current user information."""
@@ -204,18 +242,17 @@ async def setup_profile(
             detail="Display name is required"
         )
     
-    # If avatar_url is provided and it's base64 data, save it as a file
-    final_avatar_url = avatar_url
-    if avatar_url and avatar_url.startswith('data:image'):
-        from app.utils.file_upload import save_base64_image, delete_file
-        
-        # Delete old avatar if exists
-        if current_user.avatar_url and current_user.avatar_url.startswith('/uploads'):
-            delete_file(current_user.avatar_url)
-        
-        # Save new base64 image as file
-        _, relative_url = save_base64_image(avatar_url, category='profile')
-        final_avatar_url = relative_url
+    # Base64 data goes through the avatar pipeline; other URLs must come from it
+    old_avatar_url = current_user.avatar_url
+    from app.utils.avatars import resolve_avatar_update
+    from app.utils.file_upload import UploadTooLargeError
+    
+    try:
+        final_avatar_url = await resolve_avatar_update(avatar_url, old_avatar_url)
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e) or "Invalid avatar image")
     
     from sqlalchemy import update
     db.execute(
@@ -224,6 +261,9 @@ async def setup_profile(
         .values(display_name=display_name.strip(), avatar_url=final_avatar_url)
     )
     db.commit()
+    invalidate_user_cache(current_user.id)
+    from app.utils.avatars import record_avatar_change
+    await record_avatar_change(db, current_user.id, old_avatar_url, final_avatar_url)
     db.refresh(current_user)
     
     return current_user
\ No newline at end of file
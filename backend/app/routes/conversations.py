@@ -5,12 +5,15 @@ from uuid import UUID
 from app.db.session import get_db
 from app.models.conversation import Conversation
 from app.models.user import User
-from app.models.contact import Contact
-from app.models.blocked_user import BlockedUser
 from app.schemas.conversation import ConversationResponse
 from app.core.auth import get_current_user
+from app.core.membership import get_membership, invalidate_membership
+from app.core.social_graph import get_social_graph
+from sqlalchemy import update, func, or_
+from app.utils.logger import get_logger
 
 router = APIRouter()
+logger = get_logger(__name__)
 
 @router.get("/", response_model=List[ConversationResponse])
 async def get_conversations(
@@ -20,18 +23,10 @@ async def get_conversations(
     """
     Get all conversations for the current user, excluding conversations with blocked users
     """
-    from app.utils.logger import safe_print
-    safe_print("=" * 50)
-    safe_print(f"GET /conversations/")
-    safe_print(f"User: {current_user.id} ({current_user.username})")
-    safe_print("=" * 50)
+    logger.debug("Get conversations: user=%s", current_user.id)
     try:
         # Get all blocked user IDs (where current user is blocker or blocked)
-        block_entries = db.query(BlockedUser).filter(
-            (BlockedUser.blocker_id == current_user.id) | (BlockedUser.blocked_user_id == current_user.id)
-        ).all()
-        blocked_user_ids = {str(entry.blocker_id) for entry in block_entries} | {str(entry.blocked_user_id) for entry in block_entries}
-        blocked_user_ids.discard(str(current_user.id))
+        blocked_user_ids = get_social_graph(db, current_user.id).blocked_either_way
         
         conversations = db.query(Conversation).filter(
             Conversation.members.contains([current_user.id])
@@ -46,7 +41,7 @@ async def get_conversations(
             # Check if conversation has any blocked users
             has_blocked_user = False
             for member_id in conv.members:
-                if str(member_id) in blocked_user_ids:
+                if member_id in blocked_user_ids:
                     has_blocked_user = True
                     break
             if not has_blocked_user:
@@ -54,9 +49,7 @@ async def get_conversations(
         
         return filtered_conversations
     except Exception as e:
-        import traceback
-        print(f"Error in get_conversations: {str(e)}")
-        print(traceback.format_exc())
+        logger.exception("Error in get_conversations")
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
 @router.get("/with/{user_id}")
@@ -68,30 +61,16 @@ async def get_or_create_conversation(
     """
     Get or create a direct conversation with a specific user
     """
-    from app.utils.logger import safe_print
-    safe_print("=" * 50)
-    safe_print(f"GET /conversations/with/{user_id}")
-    safe_print(f"User: {current_user.id} ({current_user.username})")
-    safe_print(f"Target User ID: {user_id}")
-    safe_print("=" * 50)
+    logger.debug("Get or create conversation: user=%s target=%s", current_user.id, user_id)
     try:
-        # Check if user is blocked
-        is_blocked = db.query(BlockedUser).filter(
-            ((BlockedUser.blocker_id == current_user.id) & (BlockedUser.blocked_user_id == user_id)) |
-            ((BlockedUser.blocker_id == user_id) & (BlockedUser.blocked_user_id == current_user.id))
-        ).first()
+        graph = get_social_graph(db, current_user.id)
         
-        if is_blocked:
+        # Check if user is blocked
+        if graph.is_blocked_with(user_id):
             raise HTTPException(status_code=403, detail="Cannot create conversation with a blocked user")
         
         # Check if users are friends
-        contact = db.query(Contact).filter(
-            Contact.owner_id == current_user.id,
-            Contact.peer_id == user_id,
-            Contact.status == "accepted"
-        ).first()
-        
-        if not contact:
+        if not graph.is_friend(user_id):
             raise HTTPException(status_code=403, detail="You must be friends with this user to start a conversation")
         
         # Find existing conversation - properly handle PostgreSQL ARRAY comparison
@@ -128,9 +107,7 @@ async def get_or_create_conversation(
     except HTTPException:
         raise
     except Exception as e:
-        import traceback
-        print(f"Error in get_or_create_conversation: {str(e)}")
-        print(traceback.format_exc())
+        logger.exception("Error in get_or_create_conversation")
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
 @router.post("/{conversation_id}/mute")
@@ -143,37 +120,37 @@ async def mute_conversation(
     """
     Mute a conversation for the current user
     """
-    from app.utils.logger import safe_print
-    safe_print("=" * 50)
-    safe_print(f"POST /conversations/{conversation_id}/mute")
-    safe_print(f"User: {current_user.id} ({current_user.username})")
-    safe_print("=" * 50)
+    logger.debug("Mute conversation: conversation=%s user=%s", conversation_id, current_user.id)
     try:
-        conversation = db.query(Conversation).filter(Conversation.id == conversation_id).first()
-        if not conversation:
+        membership = get_membership(db, conversation_id)
+        if not membership:
             raise HTTPException(status_code=404, detail="Conversation not found")
         
         # Check if user is a member
-        if conversation.members is None or current_user.id not in conversation.members:
+        if not membership.is_member(current_user.id):
             raise HTTPException(status_code=403, detail="Not a member of this conversation")
         
         # Add user to muted_by array if not already there
-        muted_by = list(conversation.muted_by) if conversation.muted_by else []
-        if current_user.id not in muted_by:
-            muted_by.append(current_user.id)
-            conversation.muted_by = muted_by
+        if not membership.is_muted_for(current_user.id):
+            db.execute(
+                update(Conversation)
+                .where(
+                    Conversation.id == conversation_id,
+                    or_(Conversation.muted_by.is_(None), ~Conversation.muted_by.any(current_user.id))
+                )
+                .values(muted_by=func.array_append(Conversation.muted_by, current_user.id))
+            )
             db.commit()
-            safe_print(f"Conversation {conversation_id} muted for user {current_user.id}")
+            invalidate_membership(conversation_id)
+            logger.debug("Conversation %s muted for user %s", conversation_id, current_user.id)
         else:
-            safe_print(f"Conversation {conversation_id} already muted for user {current_user.id}")
+            logger.debug("Conversation %s already muted for user %s", conversation_id, current_user.id)
         
         return {"message": "Conversation muted", "muted": True}
     except HTTPException:
         raise
     except Exception as e:
-        import traceback
-        safe_print(f"Error muting conversation: {str(e)}")
-        print(traceback.format_exc())
+        logger.exception("Error muting conversation")
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
 @router.post("/{conversation_id}/unmute")
@@ -186,36 +163,33 @@ async def unmute_conversation(
     """
     Unmute a conversation for the current user
     """
-    from app.utils.logger import safe_print
-    safe_print("=" * 50)
-    safe_print(f"POST /conversations/{conversation_id}/unmute")
-    safe_print(f"User: {current_user.id} ({current_user.username})")
-    safe_print("=" * 50)
+    logger.debug("Unmute conversation: conversation=%s user=%s", conversation_id, current_user.id)
     try:
-        conversation = db.query(Conversation).filter(Conversation.id == conversation_id).first()
-        if not conversation:
+        membership = get_membership(db, conversation_id)
+        if not membership:
             raise HTTPException(status_code=404, detail="Conversation not found")
         
         # Check if user is a member
-        if conversation.members is None or current_user.id not in conversation.members:
+        if not membership.is_member(current_user.id):
             raise HTTPException(status_code=403, detail="Not a member of this conversation")
         
         # Remove user from muted_by array
-        muted_by = list(conversation.muted_by) if conversation.muted_by else []
-        if current_user.id in muted_by:
-            muted_by.remove(current_user.id)
-            conversation.muted_by = muted_by if muted_by else []
+        if membership.is_muted_for(current_user.id):
+            db.execute(
+                update(Conversation)
+                .where(Conversation.id == conversation_id)
+                .values(muted_by=func.array_remove(Conversation.muted_by, current_user.id))
+            )
             db.commit()
-            safe_print(f"Conversation {conversation_id} unmuted for user {current_user.id}")
+            invalidate_membership(conversation_id)
+            logger.debug("Conversation %s unmuted for user %s", conversation_id, current_user.id)
         else:
-            safe_print(f"Conversation {conversation_id} was not muted for user {current_user.id}")
+            logger.debug("Conversation %s was not muted for user %s", conversation_id, current_user.id)
         
         return {"message": "Conversation unmuted", "muted": False}
     except HTTPException:
         raise
     except Exception as e:
-        import traceback
-        safe_print(f"Error unmuting conversation: {str(e)}")
-        print(traceback.format_exc())
+        logger.exception("Error unmuting conversation")
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
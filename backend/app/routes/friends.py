@@ -14,6 +14,9 @@ from app.schemas.contact import ContactCreate, ContactUpdate, ContactResponse
 from app.schemas.user import UserSearchResponse
 from app.core.auth import get_current_user
 from app.core.websocket import manager
+from app.core.social_graph import get_social_graph, invalidate_social_graph, record_friend_request
+from sqlalchemy import case
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 
 router = APIRouter()
 
@@ -36,23 +39,14 @@ async def create_friend_request(
     if receiver_id == current_user.id:
         raise HTTPException(status_code=400, detail="Cannot send friend request to yourself")
     
-    # Check if request already exists
-    existing_request = db.query(FriendRequest).filter(
-        FriendRequest.sender_id == current_user.id,
-        FriendRequest.receiver_id == receiver_id
-    ).first()
+    graph = get_social_graph(db, current_user.id)
     
-    if existing_request:
+    # Check if request already exists
+    if receiver_id in graph.sent_requests:
         raise HTTPException(status_code=400, detail="Friend request already exists")
     
     # Check if already friends
-    existing_contact = db.query(Contact).filter(
-        Contact.owner_id == current_user.id,
-        Contact.peer_id == receiver_id,
-        Contact.status == "accepted"
-    ).first()
-    
-    if existing_contact:
+    if graph.is_friend(receiver_id):
         raise HTTPException(status_code=400, detail="Already friends with this user")
     
     # Create friend request
@@ -62,45 +56,20 @@ async def create_friend_request(
         status="pending"
     )
     db.add(db_request)
-    db.commit()
-    db.refresh(db_request)
     
-    # Create contact entries for both users (check if they don't exist)
-    existing_sender_contact = db.query(Contact).filter(
-        Contact.owner_id == current_user.id,
-        Contact.peer_id == receiver_id
-    ).first()
-    
-    existing_receiver_contact = db.query(Contact).filter(
-        Contact.owner_id == receiver_id,
-        Contact.peer_id == current_user.id
-    ).first()
-    
-    if not existing_sender_contact:
-        sender_contact = Contact(
-            owner_id=current_user.id,
-            peer_id=receiver_id,
-            status="requested"
-        )
-        db.add(sender_contact)
-    else:
-        # Update existing contact to requested if it was blocked
-        if existing_sender_contact.status == "blocked":
-            existing_sender_contact.status = "requested"
-    
-    if not existing_receiver_contact:
-        receiver_contact = Contact(
-            owner_id=receiver_id,
-            peer_id=current_user.id,
-            status="requested"
-        )
-        db.add(receiver_contact)
-    else:
-        # Update existing contact to requested if it was blocked
-        if existing_receiver_contact.status == "blocked":
-            existing_receiver_contact.status = "requested"
+    # Create contact entries for both users, or move existing blocked ones back to requested
+    contact_insert = pg_insert(Contact).values([
+        {"owner_id": current_user.id, "peer_id": receiver_id, "status": "requested"},
+        {"owner_id": receiver_id, "peer_id": current_user.id, "status": "requested"},
+    ])
+    contact_rows = db.execute(contact_insert.on_conflict_do_update(
+        index_elements=[Contact.owner_id, Contact.peer_id],
+        set_={"status": case((Contact.status == "blocked", "requested"), else_=Contact.status)}
+    ).returning(Contact.owner_id, Contact.peer_id, Contact.status, Contact.created_at)).all()
     
     db.commit()
+    db.refresh(db_request)
+    record_friend_request(db_request.id, current_user.id, receiver_id, db_request.status, contact_rows)
     
     # Send WebSocket notification to receiver (don't fail if WebSocket fails)
     try:
@@ -164,6 +133,7 @@ async def update_friend_request(
     db_request.status = request_update.status
     db.commit()
     db.refresh(db_request)
+    invalidate_social_graph(db_request.sender_id, db_request.receiver_id)
     
     # Update contact statuses
     if request_update.status == "accepted":
@@ -272,6 +242,8 @@ async def update_friend_request(
         
         db.commit()
     
+    invalidate_social_graph(db_request.sender_id, db_request.receiver_id)
+    
     return {
         "id": db_request.id,
         "sender_id": db_request.sender_id,
@@ -397,8 +369,11 @@ async def get_contacts(
     """
     Get all contacts for current user
     """
-    contacts = db.query(Contact).filter(Contact.owner_id == current_user.id).all()
-    return contacts
+    graph = get_social_graph(db, current_user.id)
+    return [
+        {"owner_id": current_user.id, "peer_id": peer_id, "status": status, "created_at": created_at}
+        for peer_id, (status, created_at) in graph.contacts.items()
+    ]
 
 @router.get("/contacts/accepted", response_model=List[ContactResponse])
 async def get_accepted_contacts(
@@ -408,11 +383,12 @@ async def get_accepted_contacts(
     """
     Get all accepted contacts (friends) for current user
     """
-    contacts = db.query(Contact).filter(
-        Contact.owner_id == current_user.id,
-        Contact.status == "accepted"
-    ).all()
-    return contacts
+    graph = get_social_graph(db, current_user.id)
+    return [
+        {"owner_id": current_user.id, "peer_id": peer_id, "status": status, "created_at": created_at}
+        for peer_id, (status, created_at) in graph.contacts.items()
+        if status == "accepted"
+    ]
 
 @router.delete("/request/{request_id}", response_model=dict)
 async def cancel_friend_request(
@@ -450,8 +426,10 @@ async def cancel_friend_request(
         db.delete(receiver_contact)
     
     # Delete the friend request
+    sender_id, receiver_id = db_request.sender_id, db_request.receiver_id
     db.delete(db_request)
     db.commit()
+    invalidate_social_graph(sender_id, receiver_id)
     
     return {"message": "Friend request cancelled successfully"}
 
@@ -463,12 +441,10 @@ async def get_friends(
     """
     Get all friends (accepted contacts) for current user
     """
-    contacts = db.query(Contact).filter(
-        Contact.owner_id == current_user.id,
-        Contact.status == "accepted"
-    ).all()
+    graph = get_social_graph(db, current_user.id)
+    if not graph.friends:
+        return []
     
-    friend_ids = [contact.peer_id for contact in contacts]
-    friends = db.query(User).filter(User.id.in_(friend_ids)).all()
+    friends = db.query(User).filter(User.id.in_(graph.friends)).all()
     
     return friends
\ No newline at end of file
@@ -0,0 +1,138 @@
+import hmac
+from typing import Optional
+from fastapi import APIRouter, Depends, Header, HTTPException
+from fastapi.responses import PlainTextResponse, Response
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+from app.core.auth import auth_cache_stats
+from app.core.cache import CACHES
+from app.core.config import settings
+from app.core import loop_monitor, profiler
+from app.core.invalidation import invalidation_status
+from app.core.metrics import CONTENT_TYPE, render_metrics
+from app.core.sql_trace import n_plus_one_report
+from app.core.tokens import revocations
+from app.db.session import get_db
+from app.utils import orphan_sweeper
+from app.utils.avatars import avatar_files
+from app.utils.storage_usage import rebuild_usage
+
+def require_internal_access(x_internal_token: Optional[str] = Header(None)):
+    """
+    Allow internal endpoints only with the configured X-Internal-Token;
+    with no INTERNAL_API_TOKEN set they are refused to everyone.
+    """
+    if not settings.INTERNAL_API_TOKEN:
+        raise HTTPException(status_code=403, detail="Internal endpoints are disabled (INTERNAL_API_TOKEN is unset)")
+    if not x_internal_token or not hmac.compare_digest(x_internal_token, settings.INTERNAL_API_TOKEN):
+        raise HTTPException(status_code=403, detail="Internal endpoint")
+
+router = APIRouter(dependencies=[Depends(require_internal_access)])
+
+@router.get("/caches")
+async def get_cache_stats():
+    """
+    Hit rates of the in-process caches and the revoked token filter
+    """
+    return {
+        "caches": [cache.stats() for cache in CACHES.values()],
+        "auth": auth_cache_stats(),
+        "invalidation": invalidation_status(),
+        "revocations": revocations.stats()
+    }
+
+@router.get("/metrics")
+async def get_metrics():
+    """
+    Request, WebSocket event and broadcast metrics in the Prometheus text format
+    """
+    return Response(render_metrics(), media_type=CONTENT_TYPE)
+
+@router.get("/sql/n-plus-one")
+async def get_n_plus_one_report():
+    """
+    Statements recently repeated SQL_N_PLUS_ONE_THRESHOLD times or more within one request
+    """
+    return {"statements": n_plus_one_report()}
+
+@router.get("/loop")
+async def get_loop_status(limit: int = 50):
+    """
+    Event loop lag percentiles and the call sites that blocked the loop, ranked by total blocked time
+    """
+    if loop_monitor.loop_monitor is None:
+        return {"enabled": False}
+    return {"enabled": True, **loop_monitor.loop_monitor.status(limit)}
+
+@router.post("/loop/reset")
+async def reset_loop_status():
+    """
+    Clear the loop monitor's lag window and blocking call site ranking
+    """
+    if loop_monitor.loop_monitor is None:
+        raise HTTPException(status_code=404, detail="Loop monitor is disabled (LOOP_MONITOR_INTERVAL=0)")
+    loop_monitor.loop_monitor.reset()
+    return {"reset": True}
+
+@router.post("/profile", response_class=PlainTextResponse)
+async def run_profile(seconds: float = 10.0, hz: float = 100.0):
+    """
+    Sample every thread of this worker (event loop included) for the given time and
+    return collapsed stacks, e.g. for flamegraph.pl or speedscope
+    """
+    try:
+        stacks = await run_in_threadpool(profiler.profile, seconds, hz)
+    except profiler.ProfilerBusyError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return PlainTextResponse(stacks)
+
+@router.get("/profile/continuous", response_class=PlainTextResponse)
+async def get_continuous_profile():
+    """
+    Collapsed stacks aggregated by the always-on sampler since startup or the last reset
+    """
+    if profiler.continuous_sampler is None:
+        raise HTTPException(status_code=404, detail="Continuous profiler is disabled (PROFILER_SAMPLE_HZ=0)")
+    return PlainTextResponse(profiler.continuous_sampler.collapsed())
+
+@router.get("/profile/continuous/status")
+async def get_continuous_profile_status():
+    """
+    Sample rate, sample count and measured overhead of the always-on sampler
+    """
+    if profiler.continuous_sampler is None:
+        return {"enabled": False}
+    return {"enabled": True, **profiler.continuous_sampler.status()}
+
+@router.post("/profile/continuous/reset")
+async def reset_continuous_profile():
+    """
+    Start aggregating the always-on sampler's stacks afresh
+    """
+    if profiler.continuous_sampler is None:
+        raise HTTPException(status_code=404, detail="Continuous profiler is disabled (PROFILER_SAMPLE_HZ=0)")
+    profiler.continuous_sampler.reset()
+    return {"reset": True}
+
+@router.get("/orphans")
+async def get_orphan_sweeper_status():
+    """
+    Progress of the background orphaned upload sweeper and its last full pass
+    """
+    return orphan_sweeper.sweeper_status()
+
+@router.post("/orphans/sweep")
+async def sweep_orphans(dry_run: bool = True, grace_hours: Optional[float] = None):
+    """
+    Run a full orphaned upload sweep now (a dry run unless dry_run=false)
+    """
+    grace_seconds = grace_hours * 3600 if grace_hours is not None else None
+    return await run_in_threadpool(orphan_sweeper.sweep_all, dry_run, grace_seconds)
+
+@router.post("/storage-usage/rebuild")
+async def rebuild_storage_usage(db: Session = Depends(get_db)):
+    """
+    Recompute every user's storage usage from messages and avatars
+    """
+    users = await run_in_threadpool(rebuild_usage, db, avatar_files)
+    return {"users": users}
@@ -4,7 +4,7 @@ from typing import List
 from uuid import UUID
 import uuid
 import json
-import sys
+import logging
 from app.db.session import get_db
 from app.models.message import Message, MessageType
 from app.models.conversation import Conversation
@@ -12,8 +12,14 @@ from app.models.user import User
 from app.schemas.message import MessageCreate, MessageUpdate, MessageResponse
 from app.core.auth import get_current_user
 from app.core.websocket import manager
+from app.core.membership import get_membership
+from sqlalchemy import update
 from app.utils.emoji_extractor import get_emojis_string, split_text_and_emojis
-from app.utils.logger import safe_print, safe_repr
+from app.utils.attachment_blobs import add_blob_reference, release_blob_reference
+from app.utils.file_upload import parse_file_size
+from app.utils.logger import get_logger
+
+logger = get_logger(__name__)
 
 router = APIRouter()
 
@@ -26,57 +32,28 @@ async def create_message(
     """
     Create a new message
     """
-    safe_print("=" * 50)
-    safe_print(f"POST /messages/ - Create Message")
-    safe_print(f"User: {current_user.id} ({current_user.username})")
-    safe_print(f"Conversation ID: {message.conversation_id}")
-    safe_print(f"Message Type: {message.message_type}")
-    safe_print(f"Text: {message.text[:100] if message.text else 'None'}...")
-    safe_print(f"Media URL: {message.media_url}")
-    safe_print("=" * 50)
+    logger.debug(
+        "Create message: user=%s conversation=%s type=%s media_url=%s",
+        current_user.id, message.conversation_id, message.message_type, message.media_url
+    )
     try:
-        # Check if conversation exists
-        conversation = db.query(Conversation).filter(Conversation.id == message.conversation_id).first()
-        if not conversation:
+        # Check if conversation exists (membership is cached, no query on a hit)
+        membership = get_membership(db, message.conversation_id)
+        if not membership:
             raise HTTPException(status_code=404, detail="Conversation not found")
         
         # Use current_user.id instead of message.sender_id for security
         sender_id = current_user.id
         
-        # Check if user is member of conversation (properly handle PostgreSQL ARRAY)
-        if conversation.members is None:
+        # Check if user is member of conversation
+        if not membership.members:
             raise HTTPException(status_code=403, detail="Invalid conversation: no members")
         
-        # Convert UUIDs to strings for comparison
-        member_ids = [str(member) for member in conversation.members] if conversation.members else []
-        if str(sender_id) not in member_ids:
+        if not membership.is_member(sender_id):
             raise HTTPException(status_code=403, detail="User not authorized to send message to this conversation")
         
-        # Convert file_size from string to integer if provided
-        file_size_int = None
-        if message.file_size:
-            try:
-                # If it's a string like "1.5 MB", extract just the number part
-                if isinstance(message.file_size, str):
-                    # Try to parse size string (e.g., "1.5 MB" -> extract number)
-                    import re
-                    size_match = re.search(r'([\d.]+)', message.file_size)
-                    if size_match:
-                        size_num = float(size_match.group(1))
-                        # If ends with MB, convert to bytes (approximate)
-                        if 'MB' in message.file_size.upper():
-                            file_size_int = int(size_num * 1024 * 1024)
-                        elif 'KB' in message.file_size.upper():
-                            file_size_int = int(size_num * 1024)
-                        elif 'GB' in message.file_size.upper():
-                            file_size_int = int(size_num * 1024 * 1024 * 1024)
-                        else:
-                            file_size_int = int(size_num)
-                elif isinstance(message.file_size, (int, float)):
-                    file_size_int = int(message.file_size)
-            except (ValueError, AttributeError):
-                # If parsing fails, just set to None
-                file_size_int = None
+        # Convert file_size from a string like "1.5 MB" to bytes if provided
+        file_size_int = parse_file_size(message.file_size) if message.file_size else None
         
         # Handle text content - Python strings are already Unicode, so emojis work natively
         # Just ensure we have a string and not bytes
@@ -102,6 +79,9 @@ async def create_message(
             else:
                 emojis_content = get_emojis_string(text_content)
         
+        # Count the reference to a stored attachment and pick up its thumbnails
+        media_variants, media_placeholder, media_metadata = add_blob_reference(db, message.media_url, sender_id)
+        
         # Create message
         db_message = Message(
             id=uuid.uuid4(),
@@ -111,6 +91,9 @@ async def create_message(
             text=text_content,
             emojis=emojis_content,
             media_url=message.media_url,
+            media_variants=media_variants,
+            media_placeholder=media_placeholder,
+            media_metadata=media_metadata,
             file_name=message.file_name,
             file_size=file_size_int,
             latitude=message.latitude,
@@ -123,14 +106,18 @@ async def create_message(
         
         # Update conversation last message (use safe text without emojis for preview)
         if message.message_type == MessageType.location and message.latitude and message.longitude:
-            conversation.last_message = "📍 Location"
+            last_message = "📍 Location"
         elif text_content:
             # Keep emojis in preview - they're properly supported now
             # Just truncate to 50 characters
-            conversation.last_message = text_content[:50] if len(text_content) > 50 else text_content
+            last_message = text_content[:50] if len(text_content) > 50 else text_content
         else:
-            conversation.last_message = f"{message.message_type.value} message"
-        conversation.last_message_at = db_message.created_at
+            last_message = f"{message.message_type.value} message"
+        db.execute(
+            update(Conversation)
+            .where(Conversation.id == message.conversation_id)
+            .values(last_message=last_message, last_message_at=db_message.created_at)
+        )
         db.commit()
         
         # Broadcast message via WebSocket to all room participants
@@ -157,6 +144,9 @@ async def create_message(
             "emojis": db_message.emojis,  # Include extracted emojis
             "message_type": db_message.message_type.value,
             "media_url": db_message.media_url,
+            "media_variants": db_message.media_variants,
+            "media_placeholder": db_message.media_placeholder,
+            "media_metadata": db_message.media_metadata,
             "file_name": db_message.file_name,
             "file_size": file_size_str,
             "latitude": db_message.latitude,
@@ -171,11 +161,13 @@ async def create_message(
             conversation_id_str = str(message.conversation_id)
             sender_id_str = str(sender_id)
             
-            safe_print(f"Broadcasting message {db_message.id} to room {conversation_id_str}, excluding user {sender_id_str}")
-            safe_print(f"Message details: type={db_message.message_type.value}, media_url={db_message.media_url}, file_name={db_message.file_name}")
+            logger.debug(
+                "Broadcasting message %s to room %s, excluding user %s",
+                db_message.id, conversation_id_str, sender_id_str
+            )
             
             # Get all members except sender
-            recipient_ids = [str(member_id) for member_id in conversation.members if str(member_id) != sender_id_str]
+            recipient_ids = [member_key for member_key in membership.member_keys if member_key != sender_id_str]
             
             # Check which recipients have this conversation open (active)
             recipients_with_chat_open = []
@@ -187,15 +179,17 @@ async def create_message(
                 else:
                     recipients_without_chat_open.append(recipient_id)
             
-            safe_print(f"Recipients with chat open: {recipients_with_chat_open}")
-            safe_print(f"Recipients without chat open: {recipients_without_chat_open}")
+            logger.debug(
+                "Recipients with chat open: %s, without: %s", recipients_with_chat_open, recipients_without_chat_open
+            )
             
             # Broadcast message via WebSocket to all recipients
             # Use ensure_ascii=False to preserve emojis in JSON
             await manager.broadcast_to_room(
                 json.dumps(message_response, ensure_ascii=False),
                 conversation_id_str,
-                exclude_user=sender_id_str
+                exclude_user=sender_id_str,
+                allowed_users=membership.member_keys
             )
             
             # Send push notifications only to users who don't have the chat open
@@ -218,16 +212,12 @@ async def create_message(
                     notification_text = "📍 Location"
                 
                 # Filter out muted users before sending notifications
-                muted_by = list(conversation.muted_by) if conversation.muted_by else []
-                muted_by_str = [str(uid) for uid in muted_by]
-                
                 recipients_for_notification = [
                     rid for rid in recipients_without_chat_open 
-                    if rid not in muted_by_str
+                    if not membership.is_muted_for(UUID(rid))
                 ]
                 
-                safe_print(f"Recipients for notification (excluding muted): {recipients_for_notification}")
-                safe_print(f"Muted users: {muted_by_str}")
+                logger.debug("Recipients for notification (excluding muted): %s", recipients_for_notification)
                 
                 # Send notification via WebSocket for users not viewing chat and not muted
                 notification_message = json.dumps({
@@ -243,29 +233,16 @@ async def create_message(
                     try:
                         await manager.send_personal_message(notification_message, recipient_id)
                     except Exception as e:
-                        safe_print(f"Failed to send notification to {recipient_id}: {e}")
-            
-            safe_print(f"Broadcast completed for message {db_message.id}")
-        except Exception as broadcast_error:
-            safe_print(f"Error broadcasting message: {broadcast_error}")
-            import traceback
-            try:
-                traceback.print_exc()
-            except UnicodeEncodeError:
-                safe_print("Traceback contains Unicode characters - check logs")
+                        logger.warning("Failed to send notification to %s: %s", recipient_id, e)
+        except Exception:
+            logger.exception("Error broadcasting message %s", db_message.id)
             # Don't fail the request if broadcast fails, message is already saved
         
         return db_message
     except HTTPException:
         raise
     except Exception as e:
-        import traceback
-        safe_print(f"Error in create_message: {str(e)}")
-        # Use safe print for traceback (may contain Unicode in file paths)
-        try:
-            print(traceback.format_exc(), file=sys.stderr)
-        except:
-            safe_print("Traceback available in logs")
+        logger.exception("Error in create_message")
         # Safe error message to avoid Unicode encoding issues
         error_msg = str(e).encode('ascii', errors='replace').decode('ascii')
         raise HTTPException(status_code=500, detail=f"Internal server error: {error_msg}")
@@ -281,35 +258,22 @@ async def get_messages(
     """
     Get messages for a conversation
     """
-    safe_print("=" * 50)
-    safe_print(f"GET /messages/{conversation_id}")
-    safe_print(f"User: {current_user.id} ({current_user.username})")
-    safe_print(f"Skip: {skip}, Limit: {limit}")
-    safe_print("=" * 50)
+    logger.debug("Get messages: user=%s conversation=%s skip=%s limit=%s", current_user.id, conversation_id, skip, limit)
     try:
-        # Check if conversation exists
-        conversation = db.query(Conversation).filter(Conversation.id == conversation_id).first()
-        if not conversation:
+        # Check if conversation exists (membership is cached, no query on a hit)
+        membership = get_membership(db, conversation_id)
+        if not membership:
             raise HTTPException(status_code=404, detail="Conversation not found")
         
         # Check if user is a member of the conversation
-        # Convert UUID to string for comparison, or use proper UUID comparison
         user_id = current_user.id
-        if conversation.members is None:
+        if not membership.members:
             raise HTTPException(status_code=403, detail="Invalid conversation: no members")
         
-        # Properly check membership by converting UUIDs to comparable format
-        member_ids = [str(member) for member in conversation.members] if conversation.members else []
-        if str(user_id) not in member_ids:
+        if not membership.is_member(user_id):
             raise HTTPException(status_code=403, detail="Not authorized to view messages in this conversation")
         
         # Get messages, filtering out those deleted for the current user
-        # First, let's verify messages exist for this conversation
-        total_count = db.query(Message).filter(
-            Message.conversation_id == conversation_id
-        ).count()
-        safe_print(f"Total messages in DB for conversation {conversation_id}: {total_count}")
-        
         messages = db.query(Message).filter(
             Message.conversation_id == conversation_id
         ).order_by(Message.created_at.desc()).offset(skip).limit(limit).all()
@@ -332,42 +296,28 @@ async def get_messages(
             if not deleted_for_user and not is_deleted_for_everyone:
                 filtered_messages.append(msg)
         
-        safe_print(f"=== GET MESSAGES DEBUG ===")
-        safe_print(f"Conversation ID: {conversation_id}")
-        safe_print(f"User ID: {user_id}")
-        safe_print(f"Conversation members: {[str(m) for m in (conversation.members or [])]}")
-        safe_print(f"User in members: {str(user_id) in member_ids}")
-        safe_print(f"Total messages in DB: {len(messages)}")
-        safe_print(f"Messages after filtering: {len(filtered_messages)}")
-        if filtered_messages:
-            safe_print(f"Sample message IDs: {[str(msg.id) for msg in filtered_messages[:3]]}")
-            # Safe print to avoid emoji encoding errors on Windows
-            sample_details = []
-            for msg in filtered_messages[:2]:
-                # Only include non-emoji parts in debug output
-                sample_details.append({
+        if logger.isEnabledFor(logging.DEBUG):
+            # Only include non-emoji parts in debug output
+            sample_details = [
+                {
                     'id': str(msg.id),
                     'message_type': msg.message_type,
                     'text_length': len(msg.text) if msg.text else 0,
                     'has_emojis': bool(msg.emojis),
                     'media_url': msg.media_url
-                })
-            safe_print(f"Sample message details: {sample_details}")
-        else:
-            safe_print(f"WARNING: No messages to return! Check if messages exist in DB for conversation {conversation_id}")
-        safe_print(f"=========================")
+                }
+                for msg in filtered_messages[:2]
+            ]
+            logger.debug(
+                "Get messages %s: %d fetched, %d after filtering, sample %s",
+                conversation_id, len(messages), len(filtered_messages), sample_details
+            )
         
         return filtered_messages
     except HTTPException:
         raise
     except Exception as e:
-        import traceback
-        safe_print(f"Error in get_messages: {str(e)}")
-        # Use safe print for traceback
-        try:
-            print(traceback.format_exc(), file=sys.stderr)
-        except:
-            safe_print("Traceback available in logs")
+        logger.exception("Error in get_messages")
         # Safe error message to avoid Unicode encoding issues
         error_msg = str(e).encode('ascii', errors='replace').decode('ascii')
         raise HTTPException(status_code=500, detail=f"Internal server error: {error_msg}")
@@ -382,7 +332,7 @@ async def mark_message_delivered(
     """
     Mark message as delivered to a user
     """
-    safe_print(f"PUT /messages/{message_id}/deliver - User: {current_user.id} ({current_user.username})")
+    logger.debug("Mark delivered: message=%s user=%s", message_id, current_user.id)
     message = db.query(Message).filter(Message.id == message_id).first()
     if not message:
         raise HTTPException(status_code=404, detail="Message not found")
@@ -406,7 +356,7 @@ async def mark_message_read(
     """
     Mark message as read by a user
     """
-    safe_print(f"PUT /messages/{message_id}/read - User: {current_user.id} ({current_user.username})")
+    logger.debug("Mark read: message=%s user=%s", message_id, current_user.id)
     message = db.query(Message).filter(Message.id == message_id).first()
     if not message:
         raise HTTPException(status_code=404, detail="Message not found")
@@ -431,11 +381,7 @@ async def delete_message(
     """
     Delete a message (for me or for everyone)
     """
-    safe_print("=" * 50)
-    safe_print(f"DELETE /messages/{message_id}")
-    safe_print(f"User: {current_user.id} ({current_user.username})")
-    safe_print(f"Delete for everyone: {delete_for_everyone}")
-    safe_print("=" * 50)
+    logger.debug("Delete message: message=%s user=%s for_everyone=%s", message_id, current_user.id, delete_for_everyone)
     message = db.query(Message).filter(Message.id == message_id).first()
     if not message:
         raise HTTPException(status_code=404, detail="Message not found")
@@ -450,7 +396,11 @@ async def delete_message(
         # Mark as deleted for everyone
         message.deleted_for_everyone = "This message was deleted"
         message.text = None
+        release_blob_reference(db, message.media_url, message.sender_id)
         message.media_url = None
+        message.media_variants = None
+        message.media_placeholder = None
+        message.media_metadata = None
         # updated_at will be automatically updated by SQLAlchemy onupdate hook
         db.commit()
         
@@ -464,15 +414,17 @@ async def delete_message(
             }, ensure_ascii=False)
             
             # Broadcast to all users in the conversation room
+            membership = get_membership(db, conversation_id_str)
             await manager.broadcast_to_room(
                 delete_message,
                 conversation_id_str,
-                exclude_user=None  # Include sender too, so they see it deleted
+                exclude_user=None,  # Include sender too, so they see it deleted
+                allowed_users=membership.member_keys if membership else None
             )
             
-            safe_print(f"Broadcasted delete event for message {message_id} to conversation {conversation_id_str}")
-        except Exception as broadcast_error:
-            safe_print(f"Error broadcasting delete event: {broadcast_error}")
+            logger.debug("Broadcasted delete event for message %s to conversation %s", message_id, conversation_id_str)
+        except Exception:
+            logger.exception("Error broadcasting delete event for message %s", message_id)
             # Don't fail the request if broadcast fails
         
         return {"message": "Message deleted for everyone", "deleted": True}
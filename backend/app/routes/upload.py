@@ -1,16 +1,32 @@
-from fastapi import APIRouter, File, UploadFile, HTTPException, Depends
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, HTTPException, Depends, Header, Request, Response
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy.orm import Session
+from typing import Optional
 from app.core.auth import get_current_user
+from app.db.session import get_db
 from app.models.user import User
-from app.utils.file_upload import save_upload_file, get_file_path, get_file_size
+from fastapi.responses import RedirectResponse
+from app.schemas.upload import UploadSessionCreate, PresignUploadRequest, PresignCompleteRequest
+from app.utils.file_upload import (
+    save_upload_file, format_file_size, UploadTooLargeError, MalformedUploadError, MultipartFileStream, MAX_UPLOAD_SIZES,
+    get_file_category, content_addressed_destination, guess_content_type, storage_key,
+    stream_to_file, new_temp_path, locate_storage_key, unshard_key, UPLOADS_DIR, LEGACY_UPLOAD_DIR
+)
+from app.utils.storage import get_storage, read_direct_upload_token
+from app.utils.file_serving import FileServingResponse, is_content_addressed
+from app.utils import resumable_upload
+from app.utils.resumable_upload import UploadQuotaError, UploadSessionError
+from app.utils.attachment_blobs import register_blob, find_blob, is_sha256, ensure_blob_metadata
+from app.utils.thumbnails import generate_thumbnails
+from app.utils.storage_usage import get_usage, stored_bytes
+from app.utils.avatars import avatar_files, ingest_avatar
 from pathlib import Path
+from stat import S_ISREG
+import json
 
 router = APIRouter()
 public_router = APIRouter()
 
-# Legacy uploads directory (for backwards compatibility)
-LEGACY_UPLOAD_DIR = Path(__file__).parent.parent / "schemas" / "uploads"
-
 def get_file_type(filename: str) -> str:
     """Determine file type for legacy compatibility."""
     ext = Path(filename).suffix.lower()
@@ -27,116 +43,423 @@ def get_file_type(filename: str) -> str:
         return 'audio'
     return 'document'
 
-@router.post("/upload")
+async def _blob_media(db: Session, blob) -> tuple:
+    """
+    Thumbnails and metadata of a blob, generating them (off the event loop) if it has none yet.
+    Returns (variants, placeholder, metadata).
+    """
+    metadata = await run_in_threadpool(ensure_blob_metadata, db, blob)
+    if blob.variants is not None:
+        return blob.variants, blob.placeholder, metadata
+    media = await generate_thumbnails(blob.sha256, blob.url)
+    variants, placeholder = media if media else (None, None)
+    return variants, placeholder, metadata
+
+def _blob_response(blob, filename: str, variants, placeholder, metadata) -> dict:
+    return {
+        "url": blob.url,
+        "filename": filename,
+        "size": format_file_size(blob.size),
+        "type": get_file_type(filename),
+        "sha256": blob.sha256,
+        "variants": variants,
+        "placeholder": placeholder,
+        "metadata": metadata
+    }
+
+# Documents the multipart body the upload routes parse themselves from request.stream()
+_FILE_FORM_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {"multipart/form-data": {"schema": {
+            "type": "object",
+            "properties": {"file": {"type": "string", "format": "binary"}},
+            "required": ["file"]
+        }}}
+    }
+}
+
+@router.post("/upload", openapi_extra=_FILE_FORM_BODY)
 async def upload_file(
-    file: UploadFile = File(...),
+    request: Request,
+    db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
-    """Upload a file (attachment)."""
+    """
+    Upload a file (attachment) as multipart/form-data (field "file").
+    Identical content is stored once; check GET /blobs/{sha256} first to skip the upload.
+    """
     try:
-        file_type = get_file_type(file.filename)
+        # Parsed while it arrives (not spooled first), so the size limit stops oversized uploads early
+        upload = MultipartFileStream(request.stream(), request.headers.get("content-type", ""))
+        filename = await upload.read_filename()
+        _, relative_url, size_bytes, sha256 = await save_upload_file(filename, upload.chunks(), category='attachment')
+        blob = register_blob(db, sha256, relative_url, size_bytes)
+        variants, placeholder, metadata = await _blob_media(db, blob)
         
-        # Save file to organized directory structure
-        file_path, relative_url = save_upload_file(file, category='attachment')
-        
-        # Get file size
-        file_size_str = get_file_size(file_path)
-        
-        return {
-            "url": relative_url,
-            "filename": file.filename,
-            "size": file_size_str,
-            "type": file_type
-        }
+        return _blob_response(blob, filename, variants, placeholder, metadata)
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except MalformedUploadError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"File upload failed: {str(e)}")
 
 
-@router.post("/profile-image")
+@router.post("/profile-image", openapi_extra=_FILE_FORM_BODY)
 async def upload_profile_image(
-    file: UploadFile = File(...),
+    request: Request,
     current_user: User = Depends(get_current_user)
 ):
-    """Upload a profile image."""
+    """
+    Upload a profile image as multipart/form-data (field "file").
+    It goes through the avatar pipeline like POST /api/users/avatar, but isn't set as
+    the avatar: send the returned url as avatar_url to do that.
+    """
     try:
+        upload = MultipartFileStream(request.stream(), request.headers.get("content-type", ""))
+        filename = await upload.read_filename()
         # Check if file is an image
-        file_type = get_file_type(file.filename)
+        file_type = get_file_type(filename)
         if file_type not in ['image']:
             raise HTTPException(status_code=400, detail="Only image files are allowed for profile pictures")
         
-        # Save file to profile_images directory
-        file_path, relative_url = save_upload_file(file, category='profile')
-        
-        # Get file size
-        file_size_str = get_file_size(file_path)
+        # Resized to the avatar sizes, with the format checked from its magic bytes
+        relative_url = await ingest_avatar(upload.chunks())
+        size_bytes, _ = await run_in_threadpool(stored_bytes, avatar_files(relative_url))
         
         return {
             "url": relative_url,
-            "filename": file.filename,
-            "size": file_size_str,
+            "filename": filename,
+            "size": format_file_size(size_bytes),
             "type": file_type
         }
     except HTTPException:
         raise
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except ValueError as e:
+        # MalformedUploadError or InvalidAvatarError
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Profile image upload failed: {str(e)}")
 
-@public_router.get("/file/{path:path}")
-async def get_file(path: str):
+@router.get("/usage")
+async def get_storage_usage(
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Storage used by the current user's attachments and avatar.
+    """
+    usage = get_usage(db, current_user.id)
+    return {**usage, "size": format_file_size(usage["bytes_used"])}
+
+@router.get("/blobs/{sha256}")
+async def get_blob(
+    sha256: str,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Check whether an attachment with this SHA-256 is already stored.
+    If so, send the returned url as the message's media_url instead of uploading.
+    """
+    if not is_sha256(sha256):
+        raise HTTPException(status_code=400, detail="Expected a hex SHA-256 digest")
+    blob = await run_in_threadpool(find_blob, db, sha256)
+    if not blob:
+        raise HTTPException(status_code=404, detail="Blob not found")
+    metadata = await run_in_threadpool(ensure_blob_metadata, db, blob)
+    return {
+        "url": blob.url,
+        "sha256": blob.sha256,
+        "size": format_file_size(blob.size),
+        "size_bytes": blob.size,
+        "variants": blob.variants,
+        "placeholder": blob.placeholder,
+        "metadata": metadata
+    }
+
+@router.post("/presign")
+async def presign_upload(
+    request_data: PresignUploadRequest,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Get a presigned URL to upload an attachment directly to storage.
+    Send the bytes with the returned method and headers, then POST /presign/complete.
+    If the content is already stored, no upload is needed and the blob is returned.
+    """
+    sha256 = request_data.sha256.lower()
+    if not is_sha256(sha256):
+        raise HTTPException(status_code=400, detail="Expected a hex SHA-256 digest")
+    max_size = MAX_UPLOAD_SIZES.get(get_file_category(request_data.filename), MAX_UPLOAD_SIZES['file'])
+    if request_data.size > max_size:
+        raise HTTPException(status_code=413, detail=str(UploadTooLargeError(max_size)))
+    
+    blob = await run_in_threadpool(find_blob, db, sha256)
+    if blob:
+        variants, placeholder, metadata = await _blob_media(db, blob)
+        return {"exists": True, **_blob_response(blob, request_data.filename, variants, placeholder, metadata)}
+    
+    key, relative_url = content_addressed_destination(request_data.filename, sha256)
+    content_type = request_data.content_type or guess_content_type(request_data.filename)
+    upload = await run_in_threadpool(get_storage().presign_put, key, request_data.size, sha256, content_type)
+    return {"exists": False, "url": relative_url, "upload": upload}
+
+@router.post("/presign/complete")
+async def complete_presigned_upload(
+    request_data: PresignCompleteRequest,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """Register an attachment uploaded with a presigned URL."""
+    sha256 = request_data.sha256.lower()
+    if not is_sha256(sha256):
+        raise HTTPException(status_code=400, detail="Expected a hex SHA-256 digest")
+    key, relative_url = content_addressed_destination(request_data.filename, sha256)
+    size_bytes = await run_in_threadpool(get_storage().size, key)
+    if size_bytes is None:
+        raise HTTPException(status_code=409, detail="Upload not found in storage")
+    blob = register_blob(db, sha256, relative_url, size_bytes)
+    variants, placeholder, metadata = await _blob_media(db, blob)
+    return _blob_response(blob, request_data.filename, variants, placeholder, metadata)
+
+@router.get("/presign")
+async def presign_download(url: str, current_user: User = Depends(get_current_user)):
+    """Get a URL to download an upload directly from storage."""
+    if ".." in url:
+        raise HTTPException(status_code=400, detail="Invalid path")
+    key = await run_in_threadpool(locate_storage_key, url)
+    return {"url": get_storage().presign_get(key)}
+
+@public_router.put("/direct/{token}")
+async def direct_upload(token: str, request: Request):
+    """
+    Target of presigned URLs with the local storage backend.
+    The token carries the key, size and hash; the body must match both.
+    """
+    try:
+        key, size, sha256 = read_direct_upload_token(token)
+    except ValueError as e:
+        raise HTTPException(status_code=403, detail=str(e))
+    
+    storage = get_storage()
+    if await run_in_threadpool(storage.exists, key):
+        return Response(status_code=200)
+    
+    tmp_path = new_temp_path()
+    try:
+        size_bytes, digest = await stream_to_file(request.stream(), tmp_path, size)
+    except UploadTooLargeError:
+        raise HTTPException(status_code=400, detail="Body is larger than the presigned size")
+    if size_bytes != size or digest != sha256:
+        tmp_path.unlink(missing_ok=True)
+        raise HTTPException(status_code=400, detail="Body doesn't match the presigned size and SHA-256")
+    await run_in_threadpool(storage.put_file, tmp_path, key, request.headers.get("content-type"))
+    return Response(status_code=200)
+
+def _upload_session_response(session: dict) -> dict:
+    return {
+        "upload_id": session["upload_id"],
+        "filename": session["filename"],
+        "size": session["size"],
+        "offset": session["offset"],
+        "received": [list(r) for r in session["received"]],
+        "complete": session["complete"],
+        "max_chunk_size": resumable_upload.MAX_CHUNK_SIZE,
+        "expires_at": session["expires_at"]
+    }
+
+async def _load_upload_session(upload_id: str, current_user: User) -> dict:
+    try:
+        return await run_in_threadpool(resumable_upload.load_session, upload_id, current_user.id)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Upload session not found or expired")
+
+async def _load_and_respond(upload_id: str, current_user: User) -> dict:
+    return _upload_session_response(await _load_upload_session(upload_id, current_user))
+
+@router.post("/sessions", status_code=201)
+async def create_upload_session(
+    session_create: UploadSessionCreate,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Start a resumable upload.
+    Send chunks with PATCH /sessions/{upload_id} and an Upload-Offset header (in any
+    order, in parallel if wanted), then POST /sessions/{upload_id}/complete.
+    """
+    try:
+        await run_in_threadpool(resumable_upload.expire_stale_sessions)
+        session = await run_in_threadpool(
+            resumable_upload.create_session,
+            current_user.id, session_create.filename, session_create.size, session_create.category
+        )
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except UploadQuotaError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    except UploadSessionError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return await _load_and_respond(session["upload_id"], current_user)
+
+@router.get("/sessions/{upload_id}")
+async def get_upload_session(upload_id: str, current_user: User = Depends(get_current_user)):
+    """Get the byte ranges received so far, to resume an interrupted upload."""
+    return await _load_and_respond(upload_id, current_user)
+
+@router.head("/sessions/{upload_id}")
+async def head_upload_session(upload_id: str, current_user: User = Depends(get_current_user)):
+    """tus-style offset query."""
+    session = await _load_upload_session(upload_id, current_user)
+    return Response(headers={
+        "Upload-Offset": str(session["offset"]),
+        "Upload-Length": str(session["size"]),
+        "Cache-Control": "no-store"
+    })
+
+@router.patch("/sessions/{upload_id}")
+async def upload_session_chunk(
+    upload_id: str,
+    request: Request,
+    upload_offset: int = Header(..., alias="Upload-Offset"),
+    content_length: Optional[int] = Header(None, alias="Content-Length"),
+    current_user: User = Depends(get_current_user)
+):
+    """Write a chunk (raw request body) at Upload-Offset."""
+    session = await _load_upload_session(upload_id, current_user)
+    try:
+        await resumable_upload.write_chunk(session, upload_offset, content_length, request.stream())
+    except UploadSessionError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    session = await _load_upload_session(upload_id, current_user)
+    return Response(
+        content=json.dumps(_upload_session_response(session)),
+        media_type="application/json",
+        headers={"Upload-Offset": str(session["offset"])}
+    )
+
+@router.post("/sessions/{upload_id}/complete")
+async def complete_upload_session(
+    upload_id: str,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """Assemble a fully received upload into the attachments layout."""
+    session = await _load_upload_session(upload_id, current_user)
+    if not session["complete"]:
+        raise HTTPException(
+            status_code=409,
+            detail={"message": "Upload is incomplete", "received": [list(r) for r in session["received"]]}
+        )
+    _, relative_url, size_bytes, sha256 = await resumable_upload.finalize_session(session)
+    variants, placeholder, metadata = None, None, None
+    if session["category"] != 'profile':
+        blob = register_blob(db, sha256, relative_url, size_bytes)
+        relative_url = blob.url
+        variants, placeholder, metadata = await _blob_media(db, blob)
+    return {
+        "url": relative_url,
+        "filename": session["filename"],
+        "size": format_file_size(size_bytes),
+        "type": get_file_type(session["filename"]),
+        "sha256": sha256,
+        "variants": variants,
+        "placeholder": placeholder,
+        "metadata": metadata
+    }
+
+@router.delete("/sessions/{upload_id}")
+async def abort_upload_session(upload_id: str, current_user: User = Depends(get_current_user)):
+    """Abort a resumable upload and discard received chunks."""
+    session = await _load_upload_session(upload_id, current_user)
+    await run_in_threadpool(resumable_upload.delete_session, session)
+    return {"message": "Upload session deleted"}
+
+# Media types of served files; anything else is sent as application/octet-stream
+MEDIA_TYPE_MAP = {
+    '.jpg': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+    '.png': 'image/png',
+    '.gif': 'image/gif',
+    '.webp': 'image/webp',
+    '.mp4': 'video/mp4',
+    '.mov': 'video/quicktime',
+    '.avi': 'video/x-msvideo',
+    '.webm': 'video/webm',
+    '.pdf': 'application/pdf',
+    '.doc': 'application/msword',
+    '.docx': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+    '.txt': 'text/plain',
+    '.mp3': 'audio/mpeg',
+    '.wav': 'audio/wav',
+    '.ogg': 'audio/ogg',
+}
+
+def _stat_served_file(path: str):
+    """
+    Stat the file behind path, falling back to its pre-sharding location and the
+    legacy directory. Returns (file_path, stat) or None.
+    """
+    key = storage_key(path)
+    candidates = [UPLOADS_DIR / key]
+    flat_key = unshard_key(key)
+    if flat_key != key:
+        # Not migrated yet; checking the nested path again covers a move between the two stats
+        candidates += [UPLOADS_DIR / flat_key, UPLOADS_DIR / key]
+    candidates.append(LEGACY_UPLOAD_DIR / path.split('/')[-1])
+    for file_path in candidates:
+        try:
+            stat_result = file_path.stat()
+        except (FileNotFoundError, NotADirectoryError):
+            continue
+        if S_ISREG(stat_result.st_mode):
+            return file_path, stat_result
+    return None
+
+@public_router.api_route("/file/{path:path}", methods=["GET", "HEAD"])
+async def get_file(path: str, request: Request):
     """
     Serve files from uploads directory with path support.
     Example: /api/uploads/file/uploads/profile_images/image.jpg
+    Supports Range requests, ETag / Last-Modified validation and zero-copy sending.
     """
     if not path or ".." in path:
         raise HTTPException(status_code=400, detail="Invalid path")
     
-    # Construct full file path
-    file_path = get_file_path(f"/{path}")
-    
-    # If not found, try legacy location for backwards compatibility
-    if not file_path:
-        # Extract just the filename from path
-        filename = path.split('/')[-1] if '/' in path else path
-        legacy_path = LEGACY_UPLOAD_DIR / filename
-        if legacy_path.exists() and legacy_path.is_file():
-            file_path = legacy_path
-        else:
-            raise HTTPException(status_code=404, detail=f"File not found: {path}")
+    # Object storage serves the bytes itself
+    storage = get_storage()
+    if storage.local_path(storage_key(path)) is None:
+        key = await run_in_threadpool(locate_storage_key, path)
+        return RedirectResponse(storage.presign_get(key), status_code=307)
     
-    if not file_path.is_file():
-        raise HTTPException(status_code=404, detail="File not found")
+    # One stat() per request in the common case; the legacy location is only probed on a miss
+    served = _stat_served_file(path)
+    if served is None:
+        raise HTTPException(status_code=404, detail=f"File not found: {path}")
+    file_path, stat_result = served
     
-    # Determine media type
-    ext = file_path.suffix.lower()
-    media_type_map = {
-        '.jpg': 'image/jpeg',
-        '.jpeg': 'image/jpeg',
-        '.png': 'image/png',
-        '.gif': 'image/gif',
-        '.webp': 'image/webp',
-        '.mp4': 'video/mp4',
-        '.mov': 'video/quicktime',
-        '.avi': 'video/x-msvideo',
-        '.webm': 'video/webm',
-        '.pdf': 'application/pdf',
-        '.doc': 'application/msword',
-        '.docx': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
-        '.txt': 'text/plain',
-        '.mp3': 'audio/mpeg',
-        '.wav': 'audio/wav',
-        '.ogg': 'audio/ogg',
-    }
-    media_type = media_type_map.get(ext, 'application/octet-stream')
+    media_type = MEDIA_TYPE_MAP.get(file_path.suffix.lower(), 'application/octet-stream')
+    # Content-addressed files never change under the same name
+    cache_control = "public, max-age=31536000"
+    if is_content_addressed(file_path):
+        cache_control += ", immutable"
     
-    return FileResponse(
+    return await FileServingResponse.build(
+        request.headers,
+        request.method,
         file_path,
-        media_type=media_type,
+        stat_result,
+        media_type,
         filename=file_path.name,
         headers={
-            "Cache-Control": "public, max-age=31536000",
+            "Cache-Control": cache_control,
             "Access-Control-Allow-Origin": "*",
-            "Access-Control-Allow-Methods": "GET",
-            "Access-Control-Allow-Headers": "*"
+            "Access-Control-Allow-Methods": "GET, HEAD",
+            "Access-Control-Allow-Headers": "*",
+            "Access-Control-Expose-Headers": "Content-Range, Content-Length, Accept-Ranges, ETag"
         }
     )
-
@@ -1,21 +1,51 @@
-from fastapi import APIRouter, HTTPException, Depends, Query
+from fastapi import APIRouter, HTTPException, Depends, Query, Request
 from fastapi.security import HTTPBearer
 from sqlalchemy.orm import Session
-from typing import List
+from typing import Dict, List, Optional
 from uuid import UUID
 from app.db.session import get_db
 from app.models.user import User
-from app.schemas.user import UserUpdate, UserProfileResponse, UserResponse, UserSearchResponse
+from app.schemas.user import (
+    UserUpdate,
+    UserProfileResponse,
+    UserResponse,
+    UserSearchResponse,
+    ContactDiscoveryRequest,
+    ContactDiscoveryMatch,
+    ContactDiscoveryResponse,
+)
 from app.models.friend_request import FriendRequest
 from app.models.contact import Contact
 from app.models.blocked_user import BlockedUser
-from app.core.auth import get_current_user
-from sqlalchemy import or_
+from app.models.phone_book_entry import PhoneBookEntry
+from app.core.auth import get_current_user, invalidate_user_cache
+from app.core.cache import TTLCache
+from app.core.social_graph import get_social_graph, invalidate_social_graph
+from app.core.config import settings
+from app.utils.phone import normalize_phone, hash_phone, is_phone_hash
+from app.utils.avatars import ingest_avatar, record_avatar_change, resolve_avatar_update
+from app.utils.file_upload import MalformedUploadError, MultipartFileStream, UploadTooLargeError
+from sqlalchemy import or_, and_, case, exists, func, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from datetime import datetime, timedelta
+from jose import JWTError, jwt
+import hashlib
+import hmac
 import uuid
 
 router = APIRouter()
 security = HTTPBearer()
 
+# Short-lived per-searcher cache so search-as-you-type doesn't repeat identical queries
+search_cache = TTLCache("user_search", maxsize=settings.USER_SEARCH_CACHE_SIZE, ttl=settings.USER_SEARCH_CACHE_TTL)
+
+# Contact sync cursors get their own key so they can never pass as bearer tokens
+_CONTACT_SYNC_KEY = hmac.new(settings.SECRET_KEY.encode(), b"contact-sync-token", hashlib.sha256).hexdigest()
+
+def _escape_like(value: str) -> str:
+    """Escape LIKE wildcards so user input is matched literally."""
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
 @router.get("/profile/{user_id}", response_model=UserProfileResponse)
 async def get_user_profile(user_id: UUID, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
     """
@@ -36,6 +66,8 @@ async def update_user_profile(
     """
     Update user profile
     """
+    if user_id != current_user.id:
+        raise HTTPException(status_code=403, detail="You can only update your own profile")
     user = db.query(User).filter(User.id == user_id).first()
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
@@ -44,28 +76,60 @@ async def update_user_profile(
     if user_update.display_name is not None:
         user.display_name = user_update.display_name
     
+    old_avatar_url = user.avatar_url
     if user_update.avatar_url is not None:
-        # If avatar_url is base64 data, save it as a file
-        if user_update.avatar_url.startswith('data:image'):
-            from app.utils.file_upload import save_base64_image, delete_file
-            
-            # Delete old avatar if exists
-            if user.avatar_url and user.avatar_url.startswith('/uploads'):
-                delete_file(user.avatar_url)
-            
-            # Save new base64 image as file
-            _, relative_url = save_base64_image(user_update.avatar_url, category='profile')
-            user.avatar_url = relative_url
-        else:
-            user.avatar_url = user_update.avatar_url
+        # Base64 data goes through the avatar pipeline; other URLs must come from it
+        user.avatar_url = await _avatar_or_400(resolve_avatar_update(user_update.avatar_url, old_avatar_url))
     
     if user_update.discoverable is not None:
         user.discoverable = user_update.discoverable
     
     db.commit()
+    invalidate_user_cache(user.id)
+    await record_avatar_change(db, user.id, old_avatar_url, user.avatar_url)
     db.refresh(user)
     return user
 
+async def _avatar_or_400(pending):
+    try:
+        return await pending
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except ValueError as e:
+        # InvalidAvatarError, or malformed base64
+        raise HTTPException(status_code=400, detail=str(e) or "Invalid avatar image")
+
+@router.post("/avatar", response_model=UserResponse)
+async def upload_avatar(
+    request: Request,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Set the current user's avatar.
+    Send the image as multipart/form-data (field "file") or as the raw request body.
+    It is resized to fixed sizes and served from immutable, content-hashed URLs.
+    """
+    content_type = request.headers.get("content-type", "")
+    if content_type.startswith("multipart/form-data"):
+        # Parsed while it arrives rather than spooled by request.form(), so the size limit applies early
+        upload = MultipartFileStream(request.stream(), content_type)
+        try:
+            await upload.read_filename()
+        except MalformedUploadError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        avatar_url = await _avatar_or_400(ingest_avatar(upload.chunks()))
+    else:
+        avatar_url = await _avatar_or_400(ingest_avatar(request.stream()))
+    
+    old_avatar_url = current_user.avatar_url
+    db.execute(update(User).where(User.id == current_user.id).values(avatar_url=avatar_url))
+    db.commit()
+    invalidate_user_cache(current_user.id)
+    await record_avatar_change(db, current_user.id, old_avatar_url, avatar_url)
+    db.refresh(current_user)
+    return current_user
+
 @router.get("/search", response_model=List[UserSearchResponse])
 async def search_users(
     query: str = Query(..., min_length=1),
@@ -74,16 +138,60 @@ async def search_users(
 ):
     """
     Search users by username or display name
+
+    Results are ranked exact match first, then prefix matches, then substring/fuzzy
+    (trigram) matches. Queries shorter than three characters only do prefix matching,
+    which the lower(...) text_pattern_ops indexes serve; longer queries also use the
+    pg_trgm GIN indexes. Users blocked in either direction are excluded in the same query.
     """
-    # Search by username or display name, exclude current user and non-discoverable users
-    # Include blocked users so they can be unblocked
+    term = query.strip().lower()
+    if not term:
+        return []
+    
+    cache_key = (current_user.id, term)
+    cached = search_cache.get(cache_key)
+    if cached is not None:
+        return cached
+    
+    username = func.lower(User.username)
+    display_name = func.lower(User.display_name)
+    prefix = f"{_escape_like(term)}%"
+    is_prefix_match = or_(username.like(prefix, escape="\\"), display_name.like(prefix, escape="\\"))
+    
+    match_conditions = [is_prefix_match]
+    order_by = [case(
+        (or_(username == term, display_name == term), 0),
+        (is_prefix_match, 1),
+        else_=2
+    )]
+    if len(term) >= 3:
+        contains = f"%{_escape_like(term)}%"
+        match_conditions += [
+            User.username.ilike(contains, escape="\\"),
+            User.display_name.ilike(contains, escape="\\"),
+            User.username.op("%")(term),
+            User.display_name.op("%")(term),
+        ]
+        order_by.append(func.greatest(func.similarity(User.username, term), func.similarity(User.display_name, term)).desc())
+    order_by.append(username)
+    
+    # Exclude users blocked by or blocking the current user
+    is_blocked = exists().where(or_(
+        and_(BlockedUser.blocker_id == current_user.id, BlockedUser.blocked_user_id == User.id),
+        and_(BlockedUser.blocker_id == User.id, BlockedUser.blocked_user_id == current_user.id)
+    ))
+    
+    # Exclude current user and non-discoverable users
     users = db.query(User).filter(
         User.id != current_user.id,
         User.discoverable == True,
-        (User.username.ilike(f"%{query}%")) | (User.display_name.ilike(f"%{query}%"))
-    ).limit(20).all()
+        or_(*match_conditions),
+        ~is_blocked
+    ).order_by(*order_by).limit(20).all()
     
-    return users
+    results = [UserSearchResponse.model_validate(user) for user in users]
+    search_cache.set(cache_key, results)
+    return results
 
 @router.get("/search/phone", response_model=List[UserSearchResponse])
 async def search_users_by_phone(
@@ -101,6 +209,125 @@ async def search_users_by_phone(
     ).all()
     return users
 
+def _hash_submitted_phones(phones: List[str], hashed: bool) -> Dict[str, str]:
+    """Map phone hash -> phone as submitted, skipping entries that aren't valid numbers/hashes."""
+    result = {}
+    for phone in phones:
+        if hashed:
+            phone_hash = phone.strip().lower()
+            if not is_phone_hash(phone_hash):
+                continue
+        else:
+            normalized = normalize_phone(phone)
+            if not normalized:
+                continue
+            phone_hash = hash_phone(normalized)
+        result.setdefault(phone_hash, phone)
+    return result
+
+def _create_contact_sync_token(user_id: UUID, synced_at: datetime) -> str:
+    """Create a signed token recording when the user's address book was last synced."""
+    expire = synced_at + timedelta(minutes=settings.CONTACT_SYNC_TOKEN_EXPIRE_MINUTES)
+    # No "sub": the cursor names its owner only for the check in _read_contact_sync_token
+    return jwt.encode(
+        {"owner": str(user_id), "type": "contact_sync", "since": synced_at.isoformat(), "exp": expire},
+        _CONTACT_SYNC_KEY,
+        algorithm=settings.ALGORITHM
+    )
+
+def _read_contact_sync_token(token: str, user_id: UUID) -> datetime:
+    """Return the sync time recorded in a contact sync token, or raise 409 so the client does a full sync."""
+    try:
+        payload = jwt.decode(token, _CONTACT_SYNC_KEY, algorithms=[settings.ALGORITHM])
+        if payload.get("type") != "contact_sync" or payload.get("owner") != str(user_id):
+            raise ValueError("Token does not belong to this user")
+        return datetime.fromisoformat(payload["since"])
+    except (JWTError, KeyError, ValueError):
+        raise HTTPException(status_code=409, detail="Invalid or expired sync token, full sync required")
+
+@router.post("/contacts/discover", response_model=ContactDiscoveryResponse)
+async def discover_contacts(
+    request: ContactDiscoveryRequest,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Bulk contact discovery for address book sync
+
+    Resolves a batch of phone numbers (raw, or SHA-256 hashes of normalized numbers) to
+    discoverable users with a single query on the indexed users.phone_hash column.
+    Without a sync_token the batch replaces the stored address book. With the sync_token
+    from the previous response, only numbers added/removed since then need to be sent,
+    and users who joined since that sync and match an already stored number are returned too.
+    """
+    if len(request.phones) + len(request.removed) > settings.CONTACT_DISCOVERY_MAX_BATCH:
+        raise HTTPException(
+            status_code=413,
+            detail=f"At most {settings.CONTACT_DISCOVERY_MAX_BATCH} phone numbers per request"
+        )
+    
+    last_synced_at: Optional[datetime] = None
+    if request.sync_token:
+        last_synced_at = _read_contact_sync_token(request.sync_token, current_user.id)
+    
+    # Taken before querying so users joining during this request are reported by the next sync
+    synced_at = datetime.utcnow()
+    submitted = _hash_submitted_phones(request.phones, request.hashed)
+    
+    # Update the stored address book (only hashes are kept)
+    entries = db.query(PhoneBookEntry).filter(PhoneBookEntry.owner_id == current_user.id)
+    if last_synced_at is None:
+        entries.delete(synchronize_session=False)
+    else:
+        removed = list(_hash_submitted_phones(request.removed, request.hashed))
+        if removed:
+            entries.filter(PhoneBookEntry.phone_hash.in_(removed)).delete(synchronize_session=False)
+    if submitted:
+        db.execute(
+            pg_insert(PhoneBookEntry)
+            .values([{"owner_id": current_user.id, "phone_hash": phone_hash} for phone_hash in submitted])
+            .on_conflict_do_nothing()
+        )
+    
+    matches = []
+    if submitted:
+        users = db.query(User).filter(
+            User.phone_hash.in_(list(submitted)),
+            User.id != current_user.id,
+            User.discoverable == True
+        ).all()
+        for user in users:
+            matches.append(ContactDiscoveryMatch(
+                phone=submitted[user.phone_hash],
+                phone_hash=user.phone_hash,
+                user=UserSearchResponse.model_validate(user)
+            ))
+    
+    if last_synced_at is not None:
+        # Users who joined since the last sync and match a number stored by an earlier sync
+        joined_users = db.query(User).join(
+            PhoneBookEntry,
+            and_(PhoneBookEntry.phone_hash == User.phone_hash, PhoneBookEntry.owner_id == current_user.id)
+        ).filter(
+            User.created_at > last_synced_at,
+            User.id != current_user.id,
+            User.discoverable == True
+        ).all()
+        for user in joined_users:
+            if user.phone_hash in submitted:
+                continue
+            matches.append(ContactDiscoveryMatch(
+                phone_hash=user.phone_hash,
+                user=UserSearchResponse.model_validate(user)
+            ))
+    
+    db.commit()
+    
+    return ContactDiscoveryResponse(
+        matches=matches,
+        sync_token=_create_contact_sync_token(current_user.id, synced_at)
+    )
+
 @router.post("/block/{blocked_user_id}", response_model=dict)
 async def block_user(
     blocked_user_id: UUID,
@@ -121,12 +348,7 @@ async def block_user(
         raise HTTPException(status_code=400, detail="Cannot block yourself")
     
     # Check if already blocked
-    existing_block = db.query(BlockedUser).filter(
-        BlockedUser.blocker_id == user_id,
-        BlockedUser.blocked_user_id == blocked_user_id
-    ).first()
-    
-    if existing_block:
+    if blocked_user_id in get_social_graph(db, user_id).blocked:
         raise HTTPException(status_code=400, detail="User already blocked")
     
     # Create block entry
@@ -150,6 +372,8 @@ async def block_user(
         req.status = "blocked"
     
     db.commit()
+    invalidate_social_graph(user_id, blocked_user_id)
+    search_cache.discard_where(lambda key: key[0] in (user_id, blocked_user_id))
     
     return {"message": "User blocked successfully"}
 
@@ -163,18 +387,17 @@ async def unblock_user(
     """
     Unblock a user - Removes entry from blocked_users table
     """
-    # Find the block entry
-    block_entry = db.query(BlockedUser).filter(
-        BlockedUser.blocker_id == user_id,
-        BlockedUser.blocked_user_id == unblocked_user_id
-    ).first()
-    
-    if not block_entry:
+    if unblocked_user_id not in get_social_graph(db, user_id).blocked:
         raise HTTPException(status_code=404, detail="User not found in blocked list")
     
     # Delete the block entry
-    db.delete(block_entry)
+    db.query(BlockedUser).filter(
+        BlockedUser.blocker_id == user_id,
+        BlockedUser.blocked_user_id == unblocked_user_id
+    ).delete(synchronize_session=False)
     db.commit()
+    invalidate_social_graph(user_id, unblocked_user_id)
+    search_cache.discard_where(lambda key: key[0] in (user_id, unblocked_user_id))
     
     return {"message": "User unblocked successfully"}
 
@@ -186,13 +409,10 @@ async def get_blocked_users(
     """
     Get all blocked users for current user from blocked_users table
     """
-    block_entries = db.query(BlockedUser).filter(
-        BlockedUser.blocker_id == current_user.id
-    ).all()
+    blocked_user_ids = get_social_graph(db, current_user.id).blocked
     
-    if not block_entries:
+    if not blocked_user_ids:
         return []
     
-    blocked_user_ids = [entry.blocked_user_id for entry in block_entries]
     blocked_users = db.query(User).filter(User.id.in_(blocked_user_ids)).all()
     return blocked_users
\ No newline at end of file
@@ -3,30 +3,49 @@ from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends, Query
 from sqlalchemy.orm import Session
 from app.db.session import get_db
 from app.core.websocket import manager
-from app.models.user import User
+from app.core.ws_tickets import TicketError, redeem_ticket
+from app.core.membership import get_membership
 from app.models.message import Message
 from app.models.conversation import Conversation
 from app.utils.emoji_extractor import get_emojis_string
+from app.utils.attachment_blobs import add_blob_reference
+from sqlalchemy import update
+from typing import Optional
+from app.core.metrics import ws_message_duration, ws_message_type_label
+from app.core.sql_trace import finish_trace, start_trace
+from app.utils.logger import get_logger
 import json
+import time
 import uuid
 from datetime import datetime
 
 router = APIRouter()
+logger = get_logger(__name__)
 
 @router.websocket("/ws/{user_id}")
 async def websocket_endpoint(
     websocket: WebSocket, 
     user_id: str, 
+    ticket: Optional[str] = Query(None),
     db: Session = Depends(get_db)
 ):
-    """WebSocket endpoint for real-time messaging"""
-    # Verify user exists
-    user = db.query(User).filter(User.id == user_id).first()
-    if not user:
-        print(f"[DEBUG] WebSocket connect failed: User not found for user_id={user_id}")
-        # await websocket.close(code=4001, reason="User not found")
-        # return
-    # Accept connection even when user not found (DEBUG ONLY!)
+    """WebSocket endpoint for real-time messaging, opened with a ticket from POST /api/auth/ws-ticket"""
+    # The signed ticket identifies the user; redeeming it claims its nonce for all workers.
+    # Refusals accept first: closing before the handshake completes sends a bare 403 and
+    # the client never sees the 4001 code or the reason.
+    try:
+        ticket_user = redeem_ticket(db, ticket or "")
+    except TicketError as e:
+        logger.debug("WebSocket connect refused for %s: %s", user_id, e)
+        await websocket.accept()
+        await websocket.close(code=4001, reason=str(e))
+        return
+    if str(ticket_user) != user_id:
+        logger.debug("WebSocket connect refused: ticket for %s used for %s", ticket_user, user_id)
+        await websocket.accept()
+        await websocket.close(code=4001, reason="Connect ticket is for another user")
+        return
+    user_id = str(ticket_user)
     await manager.connect(websocket, user_id)
     
     try:
@@ -37,6 +56,9 @@ async def websocket_endpoint(
             
             # Handle different message types
             message_type = message_data.get("type")
+            type_label = ws_message_type_label(message_type)
+            started = time.perf_counter()
+            sql = start_trace(f"WS {type_label}")
             
             if message_type == "join_room":
                 # Join a conversation room
@@ -92,6 +114,9 @@ async def websocket_endpoint(
             elif message_type == "delivery_receipt":
                 # Handle delivery receipt
                 await handle_delivery_receipt(user_id, message_data, db)
+            
+            ws_message_duration.observe(time.perf_counter() - started, type_label)
+            finish_trace(sql)
                 
     except WebSocketDisconnect:
         # Check if user has no more connections before broadcasting offline
@@ -100,8 +125,8 @@ async def websocket_endpoint(
         # Broadcast offline status if this was the last connection
         if was_last_connection:
             await manager.broadcast_user_status(user_id, "offline")
-    except Exception as e:
-        print(f"WebSocket error: {e}")
+    except Exception:
+        logger.exception("WebSocket error for user %s", user_id)
         # Check if user has no more connections before broadcasting offline
         was_last_connection = user_id in manager.active_connections and len(manager.active_connections.get(user_id, set())) == 1
         manager.disconnect(websocket, user_id)
@@ -127,16 +152,16 @@ async def handle_new_message(websocket: WebSocket, user_id: str, message_data: d
         latitude = message_data.get("latitude")
         longitude = message_data.get("longitude")
         
-        # Verify conversation exists and user is member
-        conversation = db.query(Conversation).filter(Conversation.id == conversation_id).first()
-        if not conversation:
+        # Verify conversation exists and user is member (membership is cached, no query on a hit)
+        membership = get_membership(db, conversation_id)
+        if not membership:
             await websocket.send_text(json.dumps({
                 "type": "error",
                 "message": "Conversation not found"
             }))
             return
         
-        if uuid.UUID(user_id) not in conversation.members:
+        if not membership.is_member(uuid.UUID(user_id)):
             await websocket.send_text(json.dumps({
                 "type": "error",
                 "message": "Not authorized to send message to this conversation"
@@ -148,6 +173,9 @@ async def handle_new_message(websocket: WebSocket, user_id: str, message_data: d
         if message_text:
             emojis_content = get_emojis_string(message_text)
         
+        # Count the reference to a stored attachment and pick up its thumbnails
+        media_variants, media_placeholder, media_metadata = add_blob_reference(db, media_url, uuid.UUID(user_id))
+        
         # Create message in database
         message = Message(
             id=uuid.uuid4(),
@@ -157,6 +185,9 @@ async def handle_new_message(websocket: WebSocket, user_id: str, message_data: d
             text=message_text,
             emojis=emojis_content,
             media_url=media_url,
+            media_variants=media_variants,
+            media_placeholder=media_placeholder,
+            media_metadata=media_metadata,
             file_name=file_name,
             file_size=file_size,
             latitude=float(latitude) if latitude is not None else None,
@@ -167,8 +198,14 @@ async def handle_new_message(websocket: WebSocket, user_id: str, message_data: d
         db.commit()
         
         # Update conversation last message
-        conversation.last_message = message_text if message_text else f"{message_type.value} message"
-        conversation.last_message_at = message.created_at
+        db.execute(
+            update(Conversation)
+            .where(Conversation.id == membership.conversation_id)
+            .values(
+                last_message=message_text if message_text else f"{message_type.value} message",
+                last_message_at=message.created_at
+            )
+        )
         db.commit()
         
         # Prepare message for broadcasting
@@ -181,6 +218,9 @@ async def handle_new_message(websocket: WebSocket, user_id: str, message_data: d
             "emojis": message.emojis,  # Include extracted emojis
             "message_type": message.type.value,
             "media_url": message.media_url,
+            "media_variants": message.media_variants,
+            "media_placeholder": message.media_placeholder,
+            "media_metadata": message.media_metadata,
             "file_name": message.file_name,
             "file_size": message.file_size,
             "latitude": message.latitude,  # Include latitude for location messages
@@ -195,15 +235,16 @@ async def handle_new_message(websocket: WebSocket, user_id: str, message_data: d
         await manager.broadcast_to_room(
             json.dumps(message_response, ensure_ascii=False), 
             conversation_id, 
-            exclude_user=user_id
+            exclude_user=user_id,
+            allowed_users=membership.member_keys
         )
         
         # Send confirmation to sender
         message_response["status"] = "sent"
         await websocket.send_text(json.dumps(message_response, ensure_ascii=False))
         
-    except Exception as e:
-        print(f"Error handling new message: {e}")
+    except Exception:
+        logger.exception("Error handling new message")
         await websocket.send_text(json.dumps({
             "type": "error",
             "message": "Failed to send message"
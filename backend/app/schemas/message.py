@@ -4,10 +4,11 @@ try:
     from pydantic import AliasChoices
 except Exception:  # pragma: no cover - fallback if environment differs
     AliasChoices = None
-from typing import Optional, List, Union
+from typing import Any, Dict, Optional, List, Union
 from datetime import datetime
 from uuid import UUID
 from app.models.message import MessageType
+from app.utils.file_upload import parse_file_size
 
 class MessageBase(BaseModel):
     conversation_id: UUID
@@ -43,6 +44,11 @@ class MessageInDB(MessageBase):
     updated_at: Optional[datetime] = None  # Optional for backward compatibility with old records
     # Override file_size from Base to handle Integer from DB
     file_size: Optional[int] = None
+    # Thumbnails of image attachments (size name -> url, width, height) and a blurhash placeholder
+    media_variants: Optional[Dict[str, Any]] = None
+    media_placeholder: Optional[str] = None
+    # Width / height (pixels) and/or duration (seconds) of the attachment, for layout before download
+    media_metadata: Optional[Dict[str, Any]] = None
 
     @field_validator('type', mode='before')
     @classmethod
@@ -82,25 +88,9 @@ class MessageInDB(MessageBase):
         if isinstance(value, int):
             return value
         
-        # If it's a string (legacy data or formatted), try to parse it
+        # If it's a string (legacy data or formatted like "36.2 KB"), estimate the bytes
         if isinstance(value, str):
-            # If it's already a formatted string like "36.2 KB", we need to extract the number
-            # But for now, if we get a string, it means old data format - return None
-            # Or we could try to parse it, but for safety, return None
-            import re
-            match = re.search(r'([\d.]+)', value)
-            if match:
-                # Try to convert back to bytes estimate (not perfect, but better than failing)
-                num = float(match.group(1))
-                if 'MB' in value.upper():
-                    return int(num * 1024 * 1024)
-                elif 'KB' in value.upper():
-                    return int(num * 1024)
-                elif 'GB' in value.upper():
-                    return int(num * 1024 * 1024 * 1024)
-                else:
-                    return int(num)
-            return None
+            return parse_file_size(value)
         
         # Try to convert to int
         try:
@@ -0,0 +1,17 @@
+from typing import Optional
+from pydantic import BaseModel, Field
+
+class UploadSessionCreate(BaseModel):
+    filename: str = Field(..., min_length=1)
+    size: int = Field(..., gt=0)  # Total size of the file in bytes
+    category: str = "attachment"  # 'attachment' or 'profile'
+
+class PresignUploadRequest(BaseModel):
+    filename: str = Field(..., min_length=1)
+    size: int = Field(..., gt=0)  # Size of the file in bytes
+    sha256: str = Field(..., min_length=64, max_length=64)  # Hex SHA-256 of the content
+    content_type: Optional[str] = None
+
+class PresignCompleteRequest(BaseModel):
+    filename: str = Field(..., min_length=1)
+    sha256: str = Field(..., min_length=64, max_length=64)
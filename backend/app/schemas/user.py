@@ -1,5 +1,5 @@
-from pydantic import BaseModel, Field, validator, EmailStr
-from typing import Optional, List, Union
+from pydantic import BaseModel, Field, validator, EmailStr, computed_field
+from typing import Optional, List, Union, Dict
 from datetime import datetime
 from uuid import UUID
 import re
@@ -54,7 +54,12 @@ class UserInDB(UserBase):
         from_attributes = True
 
 class UserResponse(UserInDB):
-    pass
+    @computed_field
+    @property
+    def avatar_variants(self) -> Optional[Dict[str, str]]:
+        """Fixed-size avatar URLs keyed by edge length (None for external or older avatars)."""
+        from app.utils.avatars import avatar_variant_urls
+        return avatar_variant_urls(self.avatar_url)
 
 class UserSearchResponse(BaseModel):
     id: UUID
@@ -79,6 +84,24 @@ class UserProfileResponse(BaseModel):
     class Config:
         from_attributes = True
 
+class ContactDiscoveryRequest(BaseModel):
+    # Without sync_token: the full address book. With sync_token: only numbers added since that sync
+    phones: List[str] = []
+    # Numbers removed from the address book since sync_token (ignored on a full sync)
+    removed: List[str] = []
+    # True if phones/removed are SHA-256 hex digests of normalized numbers instead of raw numbers
+    hashed: bool = False
+    sync_token: Optional[str] = None
+
+class ContactDiscoveryMatch(BaseModel):
+    phone: Optional[str] = None  # Number as submitted; None for matches found from a previous sync
+    phone_hash: str
+    user: UserSearchResponse
+
+class ContactDiscoveryResponse(BaseModel):
+    matches: List[ContactDiscoveryMatch]
+    sync_token: str
+
 class UsernameCheck(BaseModel):
     username: str
     available: bool
@@ -5,7 +5,10 @@ from app.utils.file_upload import (
     get_file_path,
     delete_file,
     get_file_size,
-    initialize_directories
+    format_file_size,
+    parse_file_size,
+    initialize_directories,
+    UploadTooLargeError
 )
 
 __all__ = [
@@ -14,6 +17,9 @@ __all__ = [
     'get_file_path',
     'delete_file',
     'get_file_size',
-    'initialize_directories'
+    'format_file_size',
+    'parse_file_size',
+    'initialize_directories',
+    'UploadTooLargeError'
 ]
 
@@ -0,0 +1,135 @@
+"""
+Reference-counted, content-addressed attachment blobs.
+
+Attachments are stored once per SHA-256 (see ``store_content_addressed``) and
+tracked in the attachment_blobs table. ``ref_count`` counts the messages whose
+media_url points at the blob: it is incremented when a message is created and
+decremented when the message's media is deleted for everyone. Blobs that drop
+to zero are left on disk for the orphan sweeper. The sender's storage usage is
+adjusted along with the count.
+
+Handing a blob's url to a client (``register_blob``, ``find_blob``) sets its
+``last_claimed_at``. The client only references the blob once it sends a message,
+so the sweeper leaves blobs claimed within its grace period alone.
+"""
+import re
+from datetime import datetime
+from typing import Optional, Tuple
+from sqlalchemy import update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+from app.models.attachment_blob import AttachmentBlob
+from app.models.message import Message
+from app.utils.file_upload import delete_file, locate_storage_key
+from app.utils.media_metadata import stored_file_metadata
+from app.utils.storage import get_storage
+from app.utils.storage_usage import adjust_usage
+
+_SHA256 = re.compile(r"^[0-9a-fA-F]{64}$")
+
+
+def is_sha256(value: str) -> bool:
+    """Check if a value is a hex SHA-256 digest."""
+    return bool(_SHA256.match(value))
+
+
+def register_blob(db: Session, sha256: str, url: str, size: int) -> AttachmentBlob:
+    """
+    Record a stored attachment and commit.
+
+    The same bytes uploaded under another extension land in a second file; that
+    copy is deleted and the blob stored first is returned instead.
+
+    Returns:
+        The blob; its url is the canonical url for this content
+    """
+    now = datetime.utcnow()
+    db.execute(
+        pg_insert(AttachmentBlob)
+        .values(sha256=sha256, url=url, size=size, ref_count=0, last_claimed_at=now)
+        .on_conflict_do_update(index_elements=[AttachmentBlob.sha256], set_={"last_claimed_at": now})
+    )
+    db.commit()
+    blob = db.query(AttachmentBlob).filter(AttachmentBlob.sha256 == sha256).one()
+    if blob.url != url:
+        delete_file(url)
+    return blob
+
+
+def claim_blob(db: Session, sha256: str) -> bool:
+    """Record that a blob's url was just handed out and commit; False if the blob is gone."""
+    claimed = db.execute(
+        update(AttachmentBlob).where(AttachmentBlob.sha256 == sha256).values(last_claimed_at=datetime.utcnow())
+    ).rowcount
+    db.commit()
+    return claimed > 0
+
+
+def find_blob(db: Session, sha256: str) -> Optional[AttachmentBlob]:
+    """
+    Get a stored blob by hash and claim it for the caller, who will hand out its url;
+    None if it's unknown, was just swept or its file is gone.
+    """
+    sha256 = sha256.lower()
+    blob = db.query(AttachmentBlob).filter(AttachmentBlob.sha256 == sha256).first()
+    # A sweep that deleted the row first makes the claim miss; one that runs after sees it
+    if blob is None or not claim_blob(db, sha256):
+        return None
+    if not get_storage().exists(locate_storage_key(blob.url)):
+        return None
+    return blob
+
+
+def ensure_blob_metadata(db: Session, blob: AttachmentBlob) -> dict:
+    """
+    Media metadata of a blob, parsed from the stored file's headers and saved the
+    first time it's asked for. Blocking; call it from a threadpool.
+    """
+    if blob.media_metadata is not None:
+        return blob.media_metadata
+    metadata = stored_file_metadata(blob.url)
+    db.execute(update(AttachmentBlob).where(AttachmentBlob.sha256 == blob.sha256).values(media_metadata=metadata))
+    db.execute(
+        update(Message)
+        .where(Message.media_url == blob.url, Message.media_metadata.is_(None))
+        .values(media_metadata=metadata)
+    )
+    db.commit()
+    return metadata
+
+
+def add_blob_reference(
+    db: Session, url: Optional[str], sender_id=None
+) -> Tuple[Optional[dict], Optional[str], Optional[dict]]:
+    """
+    Count a new message by sender_id using url; a no-op for urls that aren't blobs. Caller commits.
+
+    Returns:
+        Tuple of (variants, placeholder, media_metadata) of the blob, to copy onto the message
+    """
+    if not url:
+        return None, None, None
+    row = db.execute(
+        update(AttachmentBlob)
+        .where(AttachmentBlob.url == url)
+        .values(ref_count=AttachmentBlob.ref_count + 1)
+        .returning(AttachmentBlob.variants, AttachmentBlob.placeholder, AttachmentBlob.media_metadata, AttachmentBlob.size)
+    ).first()
+    if row is None:
+        return None, None, None
+    adjust_usage(db, sender_id, row.size, 1)
+    return row.variants, row.placeholder, row.media_metadata
+
+
+def release_blob_reference(db: Session, url: Optional[str], sender_id=None) -> None:
+    """Drop a message's reference to url; a no-op for urls that aren't blobs. Caller commits."""
+    if not url:
+        return
+    row = db.execute(
+        update(AttachmentBlob)
+        .where(AttachmentBlob.url == url, AttachmentBlob.ref_count > 0)
+        .values(ref_count=AttachmentBlob.ref_count - 1)
+        .returning(AttachmentBlob.size)
+    ).first()
+    if row is not None:
+        adjust_usage(db, sender_id, -row.size, -1)
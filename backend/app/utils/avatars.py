@@ -0,0 +1,199 @@
+"""
+Avatar ingestion: stream, sniff, crop and resize to fixed sizes.
+
+Avatars are stored as profile_images/<ab>/<cd>/<sha256>_<size>.webp, where the hash is of
+the uploaded bytes, so their URLs never change content and can be cached forever.
+``User.avatar_url`` points at the largest size; the others are derived from it.
+
+Only URLs this pipeline produced are accepted as avatar_url (``resolve_avatar_update``),
+and only those are deleted when an avatar is replaced, so an avatar_url can never be
+pointed at another file (a shared attachment, say) to have it deleted.
+"""
+import base64
+import re
+import shutil
+import uuid
+from pathlib import Path
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from app.models.user import User
+from app.utils import image_variants
+from app.utils.file_upload import (
+    MAX_UPLOAD_SIZES,
+    UPLOAD_TMP_DIR,
+    delete_file,
+    guess_content_type,
+    new_temp_path,
+    shard_key,
+    stream_to_file,
+)
+from app.utils.storage import get_storage
+from app.utils.storage_usage import adjust_usage, stored_bytes
+from app.utils.thumbnails import run_in_image_pool
+
+# Square edge lengths (px) every avatar is rendered at; the largest is avatar_url
+AVATAR_SIZES = (48, 128, 512)
+
+# Leading bytes identifying each accepted format
+_MAGIC_BYTES = (
+    (b"\xff\xd8\xff", "jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"GIF87a", "gif"),
+    (b"GIF89a", "gif"),
+)
+
+_AVATAR_URL = re.compile(
+    r"^(?P<prefix>/uploads/profile_images/(?:[0-9a-f]{2}/[0-9a-f]{2}/)?[0-9a-f]{64})_(?P<size>\d+)(?P<ext>\.webp|\.jpg)$"
+)
+
+# Base64 characters decoded per step (a multiple of 4)
+_BASE64_STEP = 4 * 256 * 1024
+
+
+class InvalidAvatarError(ValueError):
+    """Raised when an avatar upload isn't a supported image."""
+
+
+def sniff_image_format(head: bytes) -> Optional[str]:
+    """Identify an image format from its first bytes; None if unsupported."""
+    for magic, image_format in _MAGIC_BYTES:
+        if head.startswith(magic):
+            return image_format
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
+    return None
+
+
+def avatar_variant_urls(avatar_url: Optional[str]) -> Optional[Dict[str, str]]:
+    """URLs of every size of an avatar produced by this pipeline, keyed by size."""
+    if not avatar_url:
+        return None
+    match = _AVATAR_URL.match(avatar_url)
+    if not match or int(match["size"]) not in AVATAR_SIZES:
+        return None
+    return {str(size): f"{match['prefix']}_{size}{match['ext']}" for size in AVATAR_SIZES}
+
+
+async def decode_data_url(data_url: str) -> AsyncIterator[bytes]:
+    """Decode a base64 data: URL in slices instead of all at once."""
+    payload = data_url.split(",", 1)[1] if "," in data_url else data_url
+    payload = "".join(payload.split())
+    for start in range(0, len(payload), _BASE64_STEP):
+        yield base64.b64decode(payload[start:start + _BASE64_STEP])
+
+
+def _read_head(path: Path) -> bytes:
+    with path.open("rb") as f:
+        return f.read(16)
+
+
+def _store_avatar(work_dir: Path, files: Dict[int, str]) -> None:
+    storage = get_storage()
+    for filename in files.values():
+        key = shard_key(f"profile_images/{filename}")
+        if storage.exists(key):
+            continue
+        storage.put_file(work_dir / filename, key, guess_content_type(filename))
+
+
+async def ingest_avatar(chunks: AsyncIterator[bytes]) -> str:
+    """
+    Turn an uploaded image into fixed-size, content-hashed avatars.
+
+    The upload is streamed to disk (limited to the profile upload size), its format
+    is checked from magic bytes, and cropping/resizing runs in the image process pool.
+
+    Returns:
+        URL of the largest size, to store as avatar_url
+
+    Raises:
+        UploadTooLargeError: If the upload exceeds the profile size limit
+        InvalidAvatarError: If it isn't a JPEG, PNG, GIF or WebP image
+    """
+    if image_variants.Image is None:
+        raise InvalidAvatarError("Avatar processing is unavailable (Pillow is not installed)")
+
+    tmp_path = new_temp_path()
+    work_dir = UPLOAD_TMP_DIR / f"avatar-{uuid.uuid4()}"
+    try:
+        _, sha256 = await stream_to_file(chunks, tmp_path, MAX_UPLOAD_SIZES['profile'])
+        image_format = sniff_image_format(await run_in_threadpool(_read_head, tmp_path))
+        if image_format is None:
+            raise InvalidAvatarError("Avatar must be a JPEG, PNG, GIF or WebP image")
+
+        await run_in_threadpool(work_dir.mkdir, parents=True)
+        try:
+            files = await run_in_image_pool(
+                image_variants.render_avatar, str(tmp_path), image_format, str(work_dir), sha256, AVATAR_SIZES
+            )
+        except Exception:
+            raise InvalidAvatarError("Avatar image could not be decoded")
+        await run_in_threadpool(_store_avatar, work_dir, files)
+        largest_key = shard_key(f"profile_images/{files[max(AVATAR_SIZES)]}")
+        return f"/uploads/{largest_key}"
+    finally:
+        tmp_path.unlink(missing_ok=True)
+        await run_in_threadpool(shutil.rmtree, work_dir, True)
+
+
+async def resolve_avatar_update(value: Optional[str], current_url: Optional[str]) -> Optional[str]:
+    """
+    avatar_url to store for a requested profile change: a data: URL goes through
+    ingest_avatar, the current avatar_url or a URL of this pipeline is kept, and an
+    empty value clears the avatar.
+
+    Raises:
+        UploadTooLargeError: If a data: URL exceeds the profile size limit
+        InvalidAvatarError: For any other URL, or a data: URL that isn't a supported image
+    """
+    if not value:
+        return None
+    if value == current_url:
+        return current_url
+    if value.startswith('data:image'):
+        return await ingest_avatar(decode_data_url(value))
+    variants = avatar_variant_urls(value)
+    if variants is None:
+        raise InvalidAvatarError("avatar_url must be an image data: URL or a URL returned by POST /api/users/avatar")
+    return variants[str(max(AVATAR_SIZES))]
+
+
+def avatar_files(avatar_url: str) -> List[str]:
+    """URLs of every stored file of an avatar (every size, or the single file of an older avatar)."""
+    return list((avatar_variant_urls(avatar_url) or {"": avatar_url}).values())
+
+
+def delete_avatar(avatar_url: str) -> None:
+    """Delete every stored size of an avatar."""
+    for url in avatar_files(avatar_url):
+        delete_file(url)
+
+
+def _stored_avatar_bytes(avatar_url: Optional[str]) -> Tuple[int, int]:
+    if not avatar_url or not avatar_url.startswith('/uploads'):
+        return 0, 0
+    return stored_bytes(avatar_files(avatar_url))
+
+
+async def record_avatar_change(db: Session, user_id, old_url: Optional[str], new_url: Optional[str]) -> None:
+    """
+    Account for a committed avatar change: move the user's storage usage from the
+    old avatar to the new one, then delete the old avatar's files if this pipeline
+    made them. Content-hashed avatars are kept while another user has the same one;
+    older avatars are left to the orphan sweeper, which checks every reference.
+    """
+    if old_url == new_url:
+        return
+    old_bytes, old_files = await run_in_threadpool(_stored_avatar_bytes, old_url)
+    new_bytes, new_files = await run_in_threadpool(_stored_avatar_bytes, new_url)
+    adjust_usage(db, user_id, new_bytes - old_bytes, new_files - old_files)
+    db.commit()
+
+    if avatar_variant_urls(old_url) is None:
+        return
+    shared = db.query(User.id).filter(User.avatar_url == old_url, User.id != user_id).first()
+    if not shared:
+        await run_in_threadpool(delete_avatar, old_url)
@@ -0,0 +1,287 @@
+"""
+Conditional and ranged file responses for served uploads.
+
+``FileServingResponse`` answers Range requests with 206 (so video seeking only
+fetches what's played), honours If-None-Match / If-Modified-Since / If-Range, and
+sends the body with the ASGI zero-copy extensions when the server offers them
+(``http.response.zerocopysend``, then ``http.response.pathsend``), falling back to
+chunked reads in the threadpool.
+"""
+import hashlib
+import os
+import re
+from email.utils import formatdate, parsedate_to_datetime
+from pathlib import Path
+from typing import Mapping, Optional, Tuple
+from urllib.parse import quote
+
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import Response
+from starlette.staticfiles import StaticFiles
+from starlette.types import Receive, Scope, Send
+
+from app.core.cache import TTLCache
+from app.core.config import settings
+from app.utils.file_upload import shard_key
+
+# Cache-Control for files whose name is their content hash
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+# Bytes read per chunk when the server has no zero-copy extension
+SERVE_CHUNK_SIZE = 256 * 1024
+
+# Content-addressed uploads are named <sha256>[_<variant>].<ext>
+_CONTENT_ADDRESSED = re.compile(r"^[0-9a-f]{64}(_[a-z0-9]+)?$")
+_RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+# Strong ETags of files not named by their hash, keyed by (path, size, mtime)
+etag_cache = TTLCache("file_etags", maxsize=settings.FILE_ETAG_CACHE_SIZE, ttl=settings.FILE_ETAG_CACHE_TTL)
+
+
+class RangeNotSatisfiable(Exception):
+    """Raised when a Range header lies entirely outside the file."""
+
+
+def is_content_addressed(file_path: Path) -> bool:
+    return bool(_CONTENT_ADDRESSED.match(file_path.stem))
+
+
+def _hash_file(file_path: Path) -> str:
+    sha256 = hashlib.sha256()
+    with file_path.open("rb") as source:
+        for chunk in iter(lambda: source.read(SERVE_CHUNK_SIZE), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+async def content_etag(file_path: Path, stat_result: os.stat_result) -> str:
+    """
+    Strong ETag derived from the file's content hash.
+
+    Content-addressed files carry the hash in their name; other files are hashed
+    once (in the threadpool) and cached until their size or mtime changes.
+    """
+    if is_content_addressed(file_path):
+        return f'"{file_path.stem}"'
+    key = (str(file_path), stat_result.st_size, stat_result.st_mtime_ns)
+    etag = etag_cache.get(key)
+    if etag is None:
+        etag = f'"{await run_in_threadpool(_hash_file, file_path)}"'
+        etag_cache.set(key, etag)
+    return etag
+
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parse a single-range Range header into an inclusive (start, end).
+
+    Returns None for headers to ignore (malformed or multiple ranges), in which
+    case the whole file is sent with 200 as RFC 9110 allows.
+
+    Raises:
+        RangeNotSatisfiable: If the range starts past the end of the file
+    """
+    match = _RANGE.match(header.strip())
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # Suffix range: the last N bytes
+        suffix = int(last)
+        if suffix == 0:
+            raise RangeNotSatisfiable()
+        return max(0, size - suffix), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size:
+        raise RangeNotSatisfiable()
+    if end < start:
+        return None
+    return start, end
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    """Weak comparison of an If-None-Match header against etag."""
+    if header.strip() == "*":
+        return True
+    candidates = [tag.strip() for tag in header.split(",")]
+    return etag in (tag[2:] if tag.startswith("W/") else tag for tag in candidates)
+
+
+def _not_modified_since(header: Optional[str], mtime: float) -> bool:
+    if not header:
+        return False
+    try:
+        since = parsedate_to_datetime(header).timestamp()
+    except (TypeError, ValueError):
+        return False
+    # HTTP dates have one-second resolution
+    return int(mtime) <= since
+
+
+def _if_range_allows(header: Optional[str], etag: str, mtime: float) -> bool:
+    """If-Range: only serve a partial response if the validator still matches."""
+    if not header:
+        return True
+    header = header.strip()
+    if header.startswith('"') or header.startswith("W/"):
+        # Strong comparison; weak tags never match
+        return header == etag
+    return _not_modified_since(header, mtime)
+
+
+class FileServingResponse(Response):
+    """
+    Serve a file with validators, conditional requests and byte ranges.
+
+    Build it with ``FileServingResponse.build`` once the file is stat'ed.
+    """
+
+    def __init__(
+        self,
+        file_path: Path,
+        status_code: int,
+        headers: Mapping[str, str],
+        offset: int = 0,
+        length: int = 0,
+        send_body: bool = True
+    ):
+        super().__init__(status_code=status_code, headers=headers)
+        self.file_path = file_path
+        self.offset = offset
+        self.length = length
+        self.send_body = send_body and length > 0
+
+    @classmethod
+    async def build(
+        cls,
+        request_headers: Mapping[str, str],
+        method: str,
+        file_path: Path,
+        stat_result: os.stat_result,
+        media_type: str,
+        headers: Optional[Mapping[str, str]] = None,
+        filename: Optional[str] = None
+    ) -> "FileServingResponse":
+        size = stat_result.st_size
+        mtime = stat_result.st_mtime
+        etag = await content_etag(file_path, stat_result)
+
+        response_headers = dict(headers or {})
+        response_headers["etag"] = etag
+        response_headers["last-modified"] = formatdate(mtime, usegmt=True)
+        response_headers["accept-ranges"] = "bytes"
+        response_headers["content-type"] = media_type
+        if filename:
+            quoted = quote(filename)
+            if quoted != filename:
+                response_headers["content-disposition"] = f"attachment; filename*=utf-8''{quoted}"
+            else:
+                response_headers["content-disposition"] = f'attachment; filename="{filename}"'
+
+        # If-None-Match takes precedence over If-Modified-Since (RFC 9110 13.2.2)
+        if_none_match = request_headers.get("if-none-match")
+        if if_none_match is not None:
+            not_modified = _etag_matches(if_none_match, etag)
+        else:
+            not_modified = _not_modified_since(request_headers.get("if-modified-since"), mtime)
+        if not_modified:
+            for header in ("content-type", "content-disposition", "accept-ranges"):
+                response_headers.pop(header, None)
+            return cls(file_path, 304, response_headers, send_body=False)
+
+        send_body = method != "HEAD"
+        range_header = request_headers.get("range")
+        if range_header and _if_range_allows(request_headers.get("if-range"), etag, mtime):
+            try:
+                byte_range = parse_range(range_header, size)
+            except RangeNotSatisfiable:
+                return cls(
+                    file_path, 416,
+                    {**response_headers, "content-range": f"bytes */{size}", "content-length": "0"},
+                    send_body=False
+                )
+            if byte_range is not None:
+                start, end = byte_range
+                length = end - start + 1
+                response_headers["content-range"] = f"bytes {start}-{end}/{size}"
+                response_headers["content-length"] = str(length)
+                return cls(file_path, 206, response_headers, offset=start, length=length, send_body=send_body)
+
+        response_headers["content-length"] = str(size)
+        return cls(file_path, 200, response_headers, offset=0, length=size, send_body=send_body)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if not self.send_body:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        extensions = scope.get("extensions") or {}
+        if "http.response.zerocopysend" in extensions:
+            # The extension takes a file object; the server sendfile()s from its descriptor
+            file_obj = await run_in_threadpool(self.file_path.open, "rb")
+            try:
+                await send({
+                    "type": "http.response.zerocopysend",
+                    "file": file_obj,
+                    "offset": self.offset,
+                    "count": self.length,
+                    "more_body": False,
+                })
+            finally:
+                file_obj.close()
+            return
+        if "http.response.pathsend" in extensions and self.status_code == 200:
+            await send({"type": "http.response.pathsend", "path": str(self.file_path)})
+            return
+
+        fd = await run_in_threadpool(os.open, self.file_path, os.O_RDONLY)
+        try:
+            position = self.offset
+            remaining = self.length
+            while remaining > 0:
+                chunk = await run_in_threadpool(os.pread, fd, min(SERVE_CHUNK_SIZE, remaining), position)
+                if not chunk:
+                    break
+                position += len(chunk)
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+            if remaining > 0:
+                # File shrank underneath us; end the response rather than hang
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+        finally:
+            os.close(fd)
+
+
+
+class ImmutableStaticFiles(StaticFiles):
+    """StaticFiles that lets clients cache content-addressed files forever."""
+
+    def file_response(self, full_path, stat_result, scope, status_code=200):
+        response = super().file_response(full_path, stat_result, scope, status_code)
+        if is_content_addressed(Path(full_path)):
+            response.headers["cache-control"] = IMMUTABLE_CACHE_CONTROL
+        return response
+
+
+class ShardedStaticFiles(ImmutableStaticFiles):
+    """
+    The /uploads mount: serves files in sharded folders from their nested location,
+    so URLs from before the layout migration keep working while and after it runs.
+    """
+
+    def lookup_path(self, path: str):
+        key = path.replace(os.sep, "/")
+        nested = shard_key(key)
+        if nested == key:
+            return super().lookup_path(path)
+        full_path, stat_result = super().lookup_path(nested)
+        if stat_result is None:
+            full_path, stat_result = super().lookup_path(path)
+        if stat_result is None:
+            # Moved by the migration between the two lookups
+            full_path, stat_result = super().lookup_path(nested)
+        return full_path, stat_result
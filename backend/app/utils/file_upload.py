@@ -1,16 +1,33 @@
 """File upload utility with organized folder structure."""
 import os
+import re
 import uuid
-import shutil
+import hashlib
+import mimetypes
 from pathlib import Path
-from fastapi import UploadFile
-from typing import Tuple, Optional
+from starlette.concurrency import run_in_threadpool
+from typing import AsyncIterator, Dict, List, Tuple, Optional
 import base64
 from datetime import datetime
+from app.utils.storage import get_storage
+from app.utils.logger import get_logger
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:  # python-multipart before 0.0.13
+    from multipart.multipart import MultipartParser, parse_options_header
+
+logger = get_logger(__name__)
 
 # Base uploads directory (relative to backend folder)
 UPLOADS_DIR = Path(__file__).parent.parent.parent / "uploads"
 
+# Partial uploads are streamed here first (outside the /uploads static mount)
+UPLOAD_TMP_DIR = UPLOADS_DIR.parent / "upload_tmp"
+
+# Legacy uploads directory, still served by GET /api/uploads/file (for backwards compatibility)
+LEGACY_UPLOAD_DIR = Path(__file__).parent.parent / "schemas" / "uploads"
+
 # Folder structure
 PROFILE_IMAGES_DIR = UPLOADS_DIR / "profile_images"
 ATTACHMENTS_DIR = UPLOADS_DIR / "attachments"
@@ -20,6 +37,10 @@ ATTACHMENT_SUBDIRS = {
     'files': ATTACHMENTS_DIR / 'files'
 }
 
+# Folders whose files are spread over <ab>/<cd>/ subdirectories so no directory grows unbounded
+SHARDED_FOLDERS = ("profile_images", "attachments/images", "attachments/music", "attachments/files")
+_HEX_PREFIX = re.compile(r"^[0-9a-f]{4}")
+
 # File type mappings
 FILE_TYPE_MAP = {
     'image': ['.jpg', '.jpeg', '.png', '.gif', '.webp', '.bmp', '.svg'],
@@ -32,10 +53,34 @@ ALLOWED_EXTENSIONS = set()
 for extensions in FILE_TYPE_MAP.values():
     ALLOWED_EXTENSIONS.update(extensions)
 
+# Maximum upload size per category (bytes), enforced while streaming
+MAX_UPLOAD_SIZES = {
+    'profile': 10 * 1024 * 1024,
+    'image': 25 * 1024 * 1024,
+    'music': 50 * 1024 * 1024,
+    'file': 200 * 1024 * 1024,
+}
+
+# Bytes read from the request and written to disk per step
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+
+class UploadTooLargeError(ValueError):
+    """Raised when an upload exceeds the maximum size of its category."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        super().__init__(f"File exceeds the maximum size of {format_file_size(limit)}")
+
+
+class MalformedUploadError(ValueError):
+    """Raised when a multipart upload has no file field or its body is cut short."""
+
 
 def initialize_directories():
     """Create all necessary upload directories."""
     PROFILE_IMAGES_DIR.mkdir(parents=True, exist_ok=True)
+    UPLOAD_TMP_DIR.mkdir(parents=True, exist_ok=True)
     for subdir in ATTACHMENT_SUBDIRS.values():
         subdir.mkdir(parents=True, exist_ok=True)
 
@@ -72,66 +117,269 @@ def get_file_category(filename: str) -> str:
     return 'file'
 
 
-def save_upload_file(file: UploadFile, category: str = 'attachment') -> Tuple[Path, str]:
+def _attachment_folder(filename: str) -> Tuple[str, Path, str]:
     """
-    Save uploaded file to appropriate directory.
+    Get the attachment folder for a filename.
+    
+    Returns:
+        Tuple of (folder_key, folder_path, file_category)
+    """
+    # Determine attachment subfolder based on file type
+    file_category = get_file_category(filename)
+    
+    # Map category to folder key (category is singular, folder key is plural)
+    folder_map = {
+        'image': 'images',    # 'image' category -> 'images' folder
+        'music': 'music',     # 'music' category -> 'music' folder  
+        'file': 'files'       # 'file' category -> 'files' folder
+    }
+    folder_key = folder_map.get(file_category, 'files')
+    target_dir = ATTACHMENT_SUBDIRS.get(folder_key, ATTACHMENT_SUBDIRS['files'])
+    return folder_key, target_dir, file_category
+
+
+def resolve_upload_destination(filename: str, category: str = 'attachment') -> Tuple[str, str, int]:
+    """
+    Pick a new unique destination for an upload.
     
     Args:
-        file: UploadFile object
+        filename: Original filename (used for its extension and file category)
         category: Either 'profile' for profile images or 'attachment' for attachments
         
     Returns:
-        Tuple of (file_path, relative_url)
+        Tuple of (storage_key, relative_url, max_size_bytes)
     """
-    initialize_directories()
-    
-    ext = Path(file.filename).suffix.lower()
+    ext = Path(filename).suffix.lower()
     unique_filename = f"{uuid.uuid4()}{ext}"
     
     if category == 'profile':
         # Save to profile_images folder
-        file_path = PROFILE_IMAGES_DIR / unique_filename
-        relative_url = f"/uploads/profile_images/{unique_filename}"
+        key = shard_key(f"profile_images/{unique_filename}")
+        return key, f"/uploads/{key}", MAX_UPLOAD_SIZES['profile']
+    
+    folder_key, _, file_category = _attachment_folder(filename)
+    
+    # Use folder_key (plural) in URL, not file_category (singular)
+    key = shard_key(f"attachments/{folder_key}/{unique_filename}")
+    
+    return key, f"/uploads/{key}", MAX_UPLOAD_SIZES.get(file_category, MAX_UPLOAD_SIZES['file'])
+
+
+def content_addressed_destination(filename: str, sha256: str) -> Tuple[str, str]:
+    """
+    Get the content-addressed location of an attachment: <folder>/<sha256><ext>.
+    
+    Returns:
+        Tuple of (storage_key, relative_url)
+    """
+    ext = Path(filename).suffix.lower()
+    folder_key, _, _ = _attachment_folder(filename)
+    key = shard_key(f"attachments/{folder_key}/{sha256}{ext}")
+    return key, f"/uploads/{key}"
+
+
+def guess_content_type(filename: str) -> Optional[str]:
+    return mimetypes.guess_type(filename)[0]
+
+
+def store_content_addressed(tmp_path: Path, filename: str, sha256: str) -> Tuple[str, str]:
+    """
+    Move a fully written temporary file to its content-addressed location in storage.
+    If identical content is already stored, the temporary file is discarded instead.
+    
+    Returns:
+        Tuple of (storage_key, relative_url)
+    """
+    key, relative_url = content_addressed_destination(filename, sha256)
+    storage = get_storage()
+    if storage.exists(key):
+        tmp_path.unlink(missing_ok=True)
     else:
-        # Determine attachment subfolder based on file type
-        file_category = get_file_category(file.filename)
+        storage.put_file(tmp_path, key, guess_content_type(filename))
+    logger.debug("File upload: %s -> %s", filename, relative_url)
+    return key, relative_url
+
+
+async def stream_to_file(chunks: AsyncIterator[bytes], file_path: Path, max_size: int) -> Tuple[int, str]:
+    """
+    Stream chunks to file_path, hashing and counting in the same pass.
+    Every disk write runs in the threadpool; the partial file is removed on error.
+    
+    Returns:
+        Tuple of (size_bytes, sha256_hex)
         
-        # Map category to folder key (category is singular, folder key is plural)
-        folder_map = {
-            'image': 'images',    # 'image' category -> 'images' folder
-            'music': 'music',     # 'music' category -> 'music' folder  
-            'file': 'files'       # 'file' category -> 'files' folder
-        }
-        folder_key = folder_map.get(file_category, 'files')
-        target_dir = ATTACHMENT_SUBDIRS.get(folder_key, ATTACHMENT_SUBDIRS['files'])
-        file_path = target_dir / unique_filename
+    Raises:
+        UploadTooLargeError: As soon as more than max_size bytes arrive
+    """
+    sha256 = hashlib.sha256()
+    size_bytes = 0
+    buffer = await run_in_threadpool(file_path.open, "wb")
+    try:
+        async for chunk in chunks:
+            if not chunk:
+                continue
+            size_bytes += len(chunk)
+            if size_bytes > max_size:
+                raise UploadTooLargeError(max_size)
+            await run_in_threadpool(_write_chunk, buffer, sha256, chunk)
+    except BaseException:
+        await run_in_threadpool(buffer.close)
+        file_path.unlink(missing_ok=True)
+        raise
+    await run_in_threadpool(buffer.close)
+    
+    return size_bytes, sha256.hexdigest()
+
+
+class MultipartFileStream:
+    """
+    One file field of a multipart/form-data body, parsed as the body arrives.
+
+    request.form() (and an UploadFile parameter) spools the whole body to a temporary
+    file before the handler runs, so a size limit checked afterwards only applies once
+    everything was received and written. Reading request.stream() through this class
+    hands the file's bytes on as they arrive; other fields are skipped.
+    """
+
+    def __init__(self, body: AsyncIterator[bytes], content_type: str, field_name: str = "file"):
+        mime_type, params = parse_options_header(content_type)
+        if mime_type != b"multipart/form-data" or b"boundary" not in params:
+            raise MalformedUploadError("Expected a multipart/form-data body")
+        self.filename: Optional[str] = None
+        self._body = body.__aiter__()
+        self._field_name = field_name.encode()
+        self._headers: Dict[bytes, bytes] = {}
+        self._header_field = b""
+        self._header_value = b""
+        self._in_file = False
+        self._file_done = False
+        self._data: List[bytes] = []
+        self._parser = MultipartParser(params[b"boundary"], callbacks={
+            "on_part_begin": self._on_part_begin,
+            "on_header_field": self._on_header_field,
+            "on_header_value": self._on_header_value,
+            "on_header_end": self._on_header_end,
+            "on_headers_finished": self._on_headers_finished,
+            "on_part_data": self._on_part_data,
+            "on_part_end": self._on_part_end,
+        })
+
+    def _on_part_begin(self) -> None:
+        self._headers = {}
+
+    def _on_header_field(self, data: bytes, start: int, end: int) -> None:
+        self._header_field += data[start:end]
+
+    def _on_header_value(self, data: bytes, start: int, end: int) -> None:
+        self._header_value += data[start:end]
+
+    def _on_header_end(self) -> None:
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field = self._header_value = b""
+
+    def _on_headers_finished(self) -> None:
+        _, options = parse_options_header(self._headers.get(b"content-disposition", b""))
+        if self.filename is None and options.get(b"name") == self._field_name and b"filename" in options:
+            self.filename = options[b"filename"].decode("utf-8", "replace")
+            self._in_file = True
+
+    def _on_part_data(self, data: bytes, start: int, end: int) -> None:
+        if self._in_file:
+            self._data.append(data[start:end])
+
+    def _on_part_end(self) -> None:
+        if self._in_file:
+            self._in_file = False
+            self._file_done = True
+
+    async def _feed(self) -> None:
+        try:
+            chunk = await self._body.__anext__()
+        except StopAsyncIteration:
+            raise MalformedUploadError(
+                "Missing file field" if self.filename is None else "Upload ended before the file was complete"
+            )
+        self._parser.write(chunk)
+
+    async def read_filename(self) -> str:
+        """Read the body up to the file field's headers and return its filename."""
+        while self.filename is None:
+            await self._feed()
+        return self.filename
+
+    async def chunks(self) -> AsyncIterator[bytes]:
+        """The file's bytes, as the body is received; call read_filename first."""
+        while True:
+            if self._data:
+                data = b"".join(self._data)
+                self._data.clear()
+                yield data
+            if self._file_done:
+                return
+            await self._feed()
+
+
+def new_temp_path() -> Path:
+    """Unique path in UPLOAD_TMP_DIR for a partial upload."""
+    return UPLOAD_TMP_DIR / f"{uuid.uuid4()}.part"
+
+
+async def save_upload_file(
+    filename: str, chunks: AsyncIterator[bytes], category: str = 'attachment'
+) -> Tuple[str, str, int, str]:
+    """
+    Stream an uploaded file to the configured storage.
+    
+    chunks should come straight from the request (request.stream(), or
+    MultipartFileStream.chunks for multipart bodies), not from an UploadFile, which
+    has already been received in full: then the per-category size limit stops the
+    upload as soon as it is exceeded. Every disk write runs in the threadpool, and
+    the byte count and SHA-256 are computed in the same pass. Attachments are stored
+    content-addressed (named by their SHA-256), so identical uploads share one file.
+    
+    Args:
+        filename: Client-side file name, which picks the folder and size limit
+        chunks: The file's bytes
+        category: Either 'profile' for profile images or 'attachment' for attachments
         
-        # Use folder_key (plural) in URL, not file_category (singular)
-        relative_url = f"/uploads/attachments/{folder_key}/{unique_filename}"
+    Returns:
+        Tuple of (storage_key, relative_url, size_bytes, sha256_hex)
         
-        # Debug logging to verify correct folder assignment
-        print(f"File upload: {file.filename} -> category: {file_category} -> folder_key: {folder_key} -> folder: {target_dir} -> URL: {relative_url}")
+    Raises:
+        UploadTooLargeError: If the file exceeds the size limit for its category
+    """
+    key, relative_url, max_size = resolve_upload_destination(filename, category)
     
-    # Save file
-    with file_path.open("wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    # Stream to a temporary file first: the name of attachments depends on the content
+    # hash, and remote backends upload finished files
+    tmp_path = new_temp_path()
+    size_bytes, sha256 = await stream_to_file(chunks, tmp_path, max_size)
     
-    return file_path, relative_url
+    if category == 'profile':
+        await run_in_threadpool(get_storage().put_file, tmp_path, key, guess_content_type(filename))
+        return key, relative_url, size_bytes, sha256
+    
+    key, relative_url = await run_in_threadpool(store_content_addressed, tmp_path, filename, sha256)
+    return key, relative_url, size_bytes, sha256
+
 
+def _write_chunk(buffer, sha256, chunk: bytes) -> None:
+    """Hash and write one chunk (runs in the threadpool; hashlib releases the GIL)."""
+    sha256.update(chunk)
+    buffer.write(chunk)
 
-def save_base64_image(base64_data: str, category: str = 'profile') -> Tuple[Path, str]:
+
+def save_base64_image(base64_data: str, category: str = 'profile') -> Tuple[str, str]:
     """
-    Save base64 image to appropriate directory.
+    Save base64 image to the configured storage.
     
     Args:
         base64_data: Base64 encoded image string (with or without data URL prefix)
         category: Either 'profile' for profile images or 'attachment' for attachments
         
     Returns:
-        Tuple of (file_path, relative_url)
+        Tuple of (storage_key, relative_url)
     """
-    initialize_directories()
-    
     # Remove data URL prefix if present
     if ',' in base64_data:
         header, base64_data = base64_data.split(',', 1)
@@ -152,18 +400,15 @@ def save_base64_image(base64_data: str, category: str = 'profile') -> Tuple[Path
     unique_filename = f"{uuid.uuid4()}{ext}"
     
     if category == 'profile':
-        file_path = PROFILE_IMAGES_DIR / unique_filename
-        relative_url = f"/uploads/profile_images/{unique_filename}"
+        key = shard_key(f"profile_images/{unique_filename}")
     else:
-        file_path = ATTACHMENT_SUBDIRS['images'] / unique_filename
-        relative_url = f"/uploads/attachments/images/{unique_filename}"
+        key = shard_key(f"attachments/images/{unique_filename}")
     
     # Decode and save base64 data
     image_data = base64.b64decode(base64_data)
-    with file_path.open("wb") as f:
-        f.write(image_data)
+    get_storage().put_bytes(image_data, key, guess_content_type(unique_filename))
     
-    return file_path, relative_url
+    return key, f"/uploads/{key}"
 
 
 def get_file_path(relative_url: str) -> Optional[Path]:
@@ -174,19 +419,74 @@ def get_file_path(relative_url: str) -> Optional[Path]:
         relative_url: Relative URL like '/uploads/profile_images/filename.jpg' or 'uploads/profile_images/filename.jpg'
         
     Returns:
-        Path object or None if not found
+        Path object or None if not found (always None for remote storage backends)
+    """
+    file_path = get_storage().local_path(locate_storage_key(relative_url))
+    return file_path if file_path and file_path.is_file() else None
+
+
+def _shard_prefix(filename: str) -> str:
+    # Generated names start with a hash or UUID; anything else is hashed to spread it evenly
+    prefix = filename[:4] if _HEX_PREFIX.match(filename) else hashlib.sha256(filename.encode()).hexdigest()[:4]
+    return f"{prefix[:2]}/{prefix[2:]}"
+
+
+def shard_key(key: str) -> str:
+    """
+    Map a key in a sharded folder to its nested location, e.g.
+    'attachments/images/abcd12.jpg' -> 'attachments/images/ab/cd/abcd12.jpg'.
+    Keys that are already nested or outside SHARDED_FOLDERS are returned unchanged.
+    """
+    folder, _, name = key.rpartition("/")
+    if folder in SHARDED_FOLDERS:
+        return f"{folder}/{_shard_prefix(name)}/{name}"
+    return key
+
+
+def unshard_key(key: str) -> str:
+    """Inverse of shard_key: the flat key a file had before the nested layout."""
+    parts = key.rsplit("/", 3)
+    if len(parts) == 4 and parts[0] in SHARDED_FOLDERS and f"{parts[1]}/{parts[2]}" == _shard_prefix(parts[3]):
+        return f"{parts[0]}/{parts[3]}"
+    return key
+
+
+def storage_key(relative_url: str) -> str:
+    """
+    Map a relative upload URL like '/uploads/profile_images/a.jpg' to its storage key.
+    URLs from before the nested layout map to the nested key they were migrated to.
     """
     # Remove leading slash if present
     if relative_url.startswith('/'):
         relative_url = relative_url[1:]
     
-    # Remove 'uploads/' prefix if present since UPLOADS_DIR already points to uploads
+    # Remove 'uploads/' prefix if present since keys are relative to the uploads root
     if relative_url.startswith('uploads/'):
         relative_url = relative_url[8:]  # Remove 'uploads/' prefix
     
-    # Construct path: UPLOADS_DIR is already the uploads directory
-    file_path = UPLOADS_DIR / relative_url
-    return file_path if file_path.exists() and file_path.is_file() else None
+    return shard_key(relative_url)
+
+
+def locate_storage_key(relative_url: str) -> str:
+    """
+    Key the file behind a URL is currently stored under: its nested key, or the flat
+    key while the layout migration hasn't moved it yet. Costs a storage lookup for
+    files in sharded folders, so call it from a threadpool.
+    """
+    key = storage_key(relative_url)
+    flat_key = unshard_key(key)
+    if flat_key == key:
+        return key
+    storage = get_storage()
+    # A file moved between the two checks is found at the nested key
+    if storage.exists(key) or not storage.exists(flat_key):
+        return key
+    return flat_key
+
+
+def upload_path(relative_url: str) -> Path:
+    """Map a relative upload URL to its path under UPLOADS_DIR, without touching the disk."""
+    return UPLOADS_DIR / storage_key(relative_url)
 
 
 def delete_file(relative_url: str) -> bool:
@@ -199,20 +499,52 @@ def delete_file(relative_url: str) -> bool:
     Returns:
         True if deleted successfully, False otherwise
     """
-    file_path = get_file_path(relative_url)
-    if file_path and file_path.exists():
-        try:
-            file_path.unlink()
-            return True
-        except Exception as e:
-            print(f"Error deleting file: {e}")
-            return False
-    return False
+    try:
+        return get_storage().delete(locate_storage_key(relative_url))
+    except Exception as e:
+        logger.warning("Error deleting file %s: %s", relative_url, e)
+        return False
 
 
 def get_file_size(file_path: Path) -> str:
     """Get human-readable file size."""
-    size_bytes = file_path.stat().st_size
+    return format_file_size(file_path.stat().st_size)
+
+
+# Leading number of a size string such as "1.5 MB"
+_SIZE_NUMBER = re.compile(r'([\d.]+)')
+
+
+def parse_file_size(value) -> Optional[int]:
+    """
+    Byte count of a file size sent by clients: an int, or a string such as "1.5 MB",
+    "36.2 KB" or "2048" (approximate for formatted sizes). None if it can't be parsed.
+    """
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return int(value)
+    if not isinstance(value, str):
+        return None
+    match = _SIZE_NUMBER.search(value)
+    if not match:
+        return None
+    try:
+        number = float(match.group(1))
+    except ValueError:
+        return None
+    unit = value.upper()
+    if 'MB' in unit:
+        return int(number * 1024 * 1024)
+    if 'KB' in unit:
+        return int(number * 1024)
+    if 'GB' in unit:
+        return int(number * 1024 * 1024 * 1024)
+    return int(number)
+
+
+def format_file_size(size_bytes: int) -> str:
+    """Format a byte count as a human-readable size."""
     if size_bytes < 1024:
         return f"{size_bytes} B"
     elif size_bytes < 1024 * 1024:
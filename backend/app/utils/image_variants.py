@@ -0,0 +1,189 @@
+"""
+Image decoding for the thumbnail and avatar pipelines.
+
+Everything here runs inside the image process pool (see app.utils.thumbnails),
+never on the API worker's event loop, so the module only depends on Pillow.
+"""
+import math
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+try:
+    from PIL import Image, ImageOps, features
+except ImportError:  # Pillow is optional; thumbnails are disabled without it
+    Image = None
+
+# Edge length of the image the placeholder is computed from
+PLACEHOLDER_SAMPLE_SIZE = 32
+# Blurhash components (detail) along x and y
+PLACEHOLDER_COMPONENTS = (4, 3)
+
+_BASE83 = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz#$%*+,-.:;=?@[]^_{|}~"
+
+
+def _encode83(value: int, length: int) -> str:
+    result = ""
+    for i in range(1, length + 1):
+        digit = (value // (83 ** (length - i))) % 83
+        result += _BASE83[digit]
+    return result
+
+
+def _srgb_to_linear(value: int) -> float:
+    v = value / 255
+    return v / 12.92 if v <= 0.04045 else ((v + 0.055) / 1.055) ** 2.4
+
+
+def _linear_to_srgb(value: float) -> int:
+    v = max(0.0, min(1.0, value))
+    if v <= 0.0031308:
+        return int(v * 12.92 * 255 + 0.5)
+    return int((1.055 * v ** (1 / 2.4) - 0.055) * 255 + 0.5)
+
+
+def _sign_pow(value: float, exponent: float) -> float:
+    return math.copysign(abs(value) ** exponent, value)
+
+
+def encode_blurhash(pixels: List[Tuple[int, int, int]], width: int, height: int,
+                    x_components: int = 4, y_components: int = 3) -> str:
+    """
+    Encode RGB pixels (row-major) as a blurhash string (https://blurha.sh).
+    Meant for a small downsampled image; cost is width * height * components.
+    """
+    linear = [(_srgb_to_linear(r), _srgb_to_linear(g), _srgb_to_linear(b)) for r, g, b in pixels]
+    cos_x = [[math.cos(math.pi * i * x / width) for x in range(width)] for i in range(x_components)]
+    cos_y = [[math.cos(math.pi * j * y / height) for y in range(height)] for j in range(y_components)]
+
+    factors = []
+    for j in range(y_components):
+        for i in range(x_components):
+            normalisation = 1 if i == 0 and j == 0 else 2
+            r = g = b = 0.0
+            for y in range(height):
+                row_basis = normalisation * cos_y[j][y]
+                offset = y * width
+                for x in range(width):
+                    basis = row_basis * cos_x[i][x]
+                    pr, pg, pb = linear[offset + x]
+                    r += basis * pr
+                    g += basis * pg
+                    b += basis * pb
+            scale = 1 / (width * height)
+            factors.append((r * scale, g * scale, b * scale))
+
+    dc, ac = factors[0], factors[1:]
+    result = _encode83((x_components - 1) + (y_components - 1) * 9, 1)
+
+    if ac:
+        actual_max = max(abs(c) for factor in ac for c in factor)
+        quantised_max = max(0, min(82, int(math.floor(actual_max * 166 - 0.5))))
+        maximum_value = (quantised_max + 1) / 166
+        result += _encode83(quantised_max, 1)
+    else:
+        maximum_value = 1
+        result += _encode83(0, 1)
+
+    result += _encode83((_linear_to_srgb(dc[0]) << 16) + (_linear_to_srgb(dc[1]) << 8) + _linear_to_srgb(dc[2]), 4)
+
+    for factor in ac:
+        quantised = [
+            max(0, min(18, int(math.floor(_sign_pow(c / maximum_value, 0.5) * 9 + 9.5))))
+            for c in factor
+        ]
+        result += _encode83(quantised[0] * 19 * 19 + quantised[1] * 19 + quantised[2], 2)
+
+    return result
+
+
+def generate_variants(source_path: str, output_dir: str, stem: str, sizes: Dict[str, int]) -> Optional[dict]:
+    """
+    Write downscaled copies of an image to output_dir and compute its placeholder.
+
+    Variants are named <stem>_<size name>.webp (.jpg when Pillow lacks WebP) and
+    only generated for sizes smaller than the original.
+
+    Args:
+        source_path: Absolute path of the original image
+        output_dir: Directory the variants are written to
+        stem: Filename stem of the original in storage
+        sizes: Mapping of size name to longest edge in pixels
+
+    Returns:
+        Dict with width, height, placeholder and variants (name -> filename, width,
+        height), or None if Pillow isn't installed
+    """
+    if Image is None:
+        return None
+
+    path = Path(source_path)
+    use_webp = features.check("webp")
+    ext = ".webp" if use_webp else ".jpg"
+
+    with Image.open(path) as img:
+        # Dimensions of the original as displayed, read before draft() shrinks the decode
+        width, height = img.size
+        if img.getexif().get(0x0112, 1) in (5, 6, 7, 8):
+            width, height = height, width
+        # Let JPEG decode at a reduced scale when the largest variant allows it
+        largest = max(sizes.values())
+        img.draft("RGB", (largest, largest))
+        img = ImageOps.exif_transpose(img)
+        has_alpha = img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info)
+        img = img.convert("RGBA" if has_alpha and use_webp else "RGB")
+
+        variants = {}
+        for name, edge in sorted(sizes.items(), key=lambda item: item[1]):
+            if max(width, height) <= edge:
+                continue
+            variant = img.copy()
+            variant.thumbnail((edge, edge), Image.LANCZOS)
+            variant_path = Path(output_dir) / f"{stem}_{name}{ext}"
+            if use_webp:
+                variant.save(variant_path, "WEBP", quality=80, method=4)
+            else:
+                variant.save(variant_path, "JPEG", quality=80, optimize=True, progressive=True)
+            variants[name] = {"filename": variant_path.name, "width": variant.width, "height": variant.height}
+
+        sample = img.convert("RGB")
+        sample.thumbnail((PLACEHOLDER_SAMPLE_SIZE, PLACEHOLDER_SAMPLE_SIZE))
+        placeholder = encode_blurhash(list(sample.getdata()), sample.width, sample.height, *PLACEHOLDER_COMPONENTS)
+
+    return {"width": width, "height": height, "placeholder": placeholder, "variants": variants}
+
+
+def render_avatar(source_path: str, image_format: str, output_dir: str, stem: str, sizes: Tuple[int, ...]) -> Optional[dict]:
+    """
+    Center-crop an image to a square and write it at each size.
+
+    Only the sniffed format is decoded, so a file that merely claims to be an image
+    (or is another format in disguise) is rejected by Pillow.
+
+    Returns:
+        Dict mapping each size to its filename (<stem>_<size>.webp, or .jpg when
+        Pillow lacks WebP), or None if Pillow isn't installed
+    """
+    if Image is None:
+        return None
+
+    use_webp = features.check("webp")
+    ext = ".webp" if use_webp else ".jpg"
+    largest = max(sizes)
+
+    with Image.open(source_path, formats=[image_format.upper()]) as img:
+        img.draft("RGB", (largest, largest))
+        img = ImageOps.exif_transpose(img)
+        has_alpha = img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info)
+        img = img.convert("RGBA" if has_alpha and use_webp else "RGB")
+        square = ImageOps.fit(img, (largest, largest), Image.LANCZOS)
+
+    files = {}
+    for size in sorted(sizes, reverse=True):
+        resized = square if size == largest else square.resize((size, size), Image.LANCZOS)
+        path = Path(output_dir) / f"{stem}_{size}{ext}"
+        if use_webp:
+            resized.save(path, "WEBP", quality=82, method=4)
+        else:
+            resized.save(path, "JPEG", quality=85, optimize=True, progressive=True)
+        files[size] = path.name
+    return files
@@ -1,7 +1,24 @@
-"""Safe logging utility that handles Unicode/emoji characters."""
+"""
+Logging for the API.
+
+Records go through the standard ``logging`` module under the "app" logger, but
+handlers never write from the calling thread: ``setup_logging`` puts a queue in
+front of them and a background thread does the formatting and the stdout writes.
+Call sites use ``get_logger(__name__)`` and %-style arguments, so a record below
+LOG_LEVEL costs one level check and its message is never built.
+
+``safe_print`` and ``safe_repr`` remain for scripts and startup output.
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import random
 import sys
 import io
-from typing import Any
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
 
 # Configure stdout/stderr for UTF-8 on Windows
 if sys.platform == 'win32':
@@ -14,6 +31,140 @@ if sys.platform == 'win32':
     except:
         pass
 
+ROOT_LOGGER = "app"
+
+# Attributes every LogRecord has; anything else was passed through extra=
+_RECORD_FIELDS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def get_logger(name: str) -> logging.Logger:
+    """Logger under the "app" hierarchy, e.g. get_logger(__name__) in app.routes.messages."""
+    if name != ROOT_LOGGER and not name.startswith(ROOT_LOGGER + "."):
+        name = f"{ROOT_LOGGER}.{name}"
+    return logging.getLogger(name)
+
+
+def _extra_fields(record: logging.LogRecord) -> Dict[str, Any]:
+    return {key: value for key, value in vars(record).items() if key not in _RECORD_FIELDS}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: ts, level, logger, msg, extra fields and exc."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        entry.update(_extra_fields(record))
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Human-readable lines for development, with extra fields appended as key=value."""
+
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)-7s %(name)s: %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        extra = _extra_fields(record)
+        if extra:
+            first, newline, rest = line.partition("\n")
+            fields = " ".join(f"{key}={value}" for key, value in extra.items())
+            line = f"{first} {fields}{newline}{rest}"
+        return line
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """Hands records to the writer thread with their message and traceback already rendered."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Arguments may be ORM objects or other state that changes after the call returns
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.exc_info = None
+        return record
+
+
+class _StreamHandler(logging.StreamHandler):
+    """StreamHandler that falls back to ASCII when the console can't encode a record."""
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            self.stream.write(self.format(record) + self.terminator)
+        except (UnicodeEncodeError, UnicodeDecodeError):
+            self.stream.write(self.format(record).encode('ascii', errors='replace').decode('ascii') + self.terminator)
+        except Exception:
+            self.handleError(record)
+
+
+def setup_logging(level: Optional[str] = None, fmt: Optional[str] = None) -> None:
+    """
+    Route the "app" loggers through a queue to a background writer. Idempotent.
+
+    Args:
+        level: Minimum level (defaults to LOG_LEVEL)
+        fmt: "json" or "text" (defaults to LOG_FORMAT)
+    """
+    global _listener
+    if _listener is not None:
+        return
+    from app.core.config import settings
+
+    stream_handler = _StreamHandler(sys.stdout)
+    stream_handler.setFormatter(TextFormatter() if (fmt or settings.LOG_FORMAT) == "text" else JsonFormatter())
+
+    log_queue = queue.SimpleQueue()
+    logger = logging.getLogger(ROOT_LOGGER)
+    logger.setLevel((level or settings.LOG_LEVEL).upper())
+    logger.addHandler(_QueueHandler(log_queue))
+    logger.propagate = False
+
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+
+def shutdown_logging() -> None:
+    """Write out queued records and stop the writer thread."""
+    global _listener
+    if _listener is None:
+        return
+    _listener.stop()
+    _listener = None
+
+
+class RouteSampler:
+    """
+    Decides which requests get an access log record: a fraction per route
+    template (LOG_ROUTE_SAMPLE_RATES), LOG_REQUEST_SAMPLE_RATE for the rest.
+    """
+
+    def __init__(self, default_rate: float, route_rates: Optional[Dict[str, float]] = None):
+        self.default_rate = default_rate
+        self.route_rates = dict(route_rates or {})
+
+    def should_log(self, route: str) -> bool:
+        rate = self.route_rates.get(route, self.default_rate)
+        if rate >= 1:
+            return True
+        if rate <= 0:
+            return False
+        return random.random() < rate
+
+
 def safe_print(*args, **kwargs):
     """
     Safe print function that handles Unicode characters including emojis.
@@ -65,4 +216,3 @@ def safe_repr(obj: Any) -> str:
             return str(obj).encode('ascii', errors='replace').decode('ascii')
         except:
             return "<Unable to represent object>"
-
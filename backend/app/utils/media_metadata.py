@@ -0,0 +1,515 @@
+"""
+Media metadata from container headers.
+
+Reads only the few bytes that describe a file (image headers, MP4 boxes, Matroska
+elements, MP3 frame headers, the last Ogg page) without decoding pixels or audio,
+so clients can lay out a message bubble before downloading the media:
+
+    images (PNG, JPEG, GIF, WebP)   width, height
+    video (MP4/MOV, WebM/MKV)       width, height, duration
+    audio (MP3, Ogg, WAV, M4A)      duration
+
+The format is detected from magic bytes, not the file extension. Parsers take a
+``read(offset, length)`` callable, so they work on local files and on object
+storage (ranged GETs) alike.
+"""
+import struct
+from typing import Callable, Optional
+
+from app.utils.file_upload import locate_storage_key
+from app.utils.storage import get_storage
+
+Reader = Callable[[int, int], bytes]
+
+# Bytes read up front to detect the format
+_HEAD_SIZE = 64
+# Upper bound on the boxes / elements walked, so a malformed file can't loop for long
+_MAX_STEPS = 4096
+
+
+class _Truncated(Exception):
+    """A header points past what could be read."""
+
+
+def _read_exact(read: Reader, offset: int, length: int) -> bytes:
+    data = read(offset, length)
+    if len(data) < length:
+        raise _Truncated()
+    return data
+
+
+def _dimensions(width: int, height: int, **extra) -> Optional[dict]:
+    if width <= 0 or height <= 0:
+        return None
+    return {"width": width, "height": height, **extra}
+
+
+def _rounded(seconds: float) -> float:
+    return round(seconds, 3)
+
+
+# --- Images -------------------------------------------------------------------
+
+def _png(read: Reader, size: int) -> Optional[dict]:
+    width, height = struct.unpack(">II", _read_exact(read, 16, 8))
+    return _dimensions(width, height)
+
+
+def _gif(read: Reader, size: int) -> Optional[dict]:
+    width, height = struct.unpack("<HH", _read_exact(read, 6, 4))
+    return _dimensions(width, height)
+
+
+def _webp(read: Reader, size: int) -> Optional[dict]:
+    header = _read_exact(read, 12, 18)
+    chunk = header[:4]
+    if chunk == b"VP8 ":
+        width, height = struct.unpack("<HH", _read_exact(read, 26, 4))
+        return _dimensions(width & 0x3FFF, height & 0x3FFF)
+    if chunk == b"VP8L":
+        bits = int.from_bytes(header[9:13], "little")
+        return _dimensions((bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1)
+    if chunk == b"VP8X":
+        width = int.from_bytes(header[12:15], "little") + 1
+        height = int.from_bytes(header[15:18], "little") + 1
+        return _dimensions(width, height)
+    return None
+
+
+# Start-of-frame markers carrying the image size (not DHT 0xC4, JPG 0xC8 or DAC 0xCC)
+_JPEG_SOF = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def _exif_orientation(segment: bytes) -> int:
+    """Orientation tag of an APP1 Exif segment (1 when absent)."""
+    if not segment.startswith(b"Exif\x00\x00"):
+        return 1
+    tiff = segment[6:]
+    endian = "<" if tiff[:2] == b"II" else ">"
+    try:
+        ifd_offset = struct.unpack(endian + "I", tiff[4:8])[0]
+        count = struct.unpack(endian + "H", tiff[ifd_offset:ifd_offset + 2])[0]
+        for i in range(count):
+            entry = ifd_offset + 2 + i * 12
+            tag, _, _, value = struct.unpack(endian + "HHIH", tiff[entry:entry + 10])
+            if tag == 0x0112:
+                return value
+    except struct.error:
+        pass
+    return 1
+
+
+def _jpeg(read: Reader, size: int) -> Optional[dict]:
+    offset = 2
+    orientation = 1
+    for _ in range(_MAX_STEPS):
+        marker = _read_exact(read, offset, 4)
+        if marker[0] != 0xFF:
+            return None
+        kind = marker[1]
+        if kind == 0xFF:
+            # Fill byte before a marker
+            offset += 1
+            continue
+        if kind in (0xD8, 0x01) or 0xD0 <= kind <= 0xD7:
+            offset += 2
+            continue
+        length = struct.unpack(">H", marker[2:4])[0]
+        if kind == 0xE1 and orientation == 1:
+            orientation = _exif_orientation(_read_exact(read, offset + 4, min(length - 2, 65533)))
+        if kind in _JPEG_SOF:
+            height, width = struct.unpack(">HH", _read_exact(read, offset + 5, 4))
+            # Orientations 5-8 are rotated by 90 degrees when displayed
+            if orientation in (5, 6, 7, 8):
+                width, height = height, width
+            return _dimensions(width, height)
+        if kind in (0xD9, 0xDA):
+            return None
+        offset += 2 + length
+    return None
+
+
+# --- MP4 / MOV (ISO base media) -------------------------------------------------
+
+_MP4_CONTAINERS = {b"moov", b"trak", b"mdia"}
+
+
+def _mp4_boxes(read: Reader, start: int, end: int):
+    """Yield (type, payload offset, payload size) of the boxes in [start, end)."""
+    offset = start
+    for _ in range(_MAX_STEPS):
+        if offset + 8 > end:
+            return
+        header = _read_exact(read, offset, 8)
+        box_size, box_type = struct.unpack(">I4s", header)
+        header_size = 8
+        if box_size == 1:
+            box_size = struct.unpack(">Q", _read_exact(read, offset + 8, 8))[0]
+            header_size = 16
+        elif box_size == 0:
+            box_size = end - offset
+        if box_size < header_size:
+            return
+        yield box_type, offset + header_size, box_size - header_size
+        offset += box_size
+
+
+def _mp4(read: Reader, size: int) -> Optional[dict]:
+    result = {}
+    tracks = []
+
+    def walk(start: int, end: int, track: Optional[dict]):
+        for box_type, payload, payload_size in _mp4_boxes(read, start, end):
+            if box_type == b"mvhd":
+                version = _read_exact(read, payload, 1)[0]
+                if version == 1:
+                    timescale, duration = struct.unpack(">IQ", _read_exact(read, payload + 20, 12))
+                else:
+                    timescale, duration = struct.unpack(">II", _read_exact(read, payload + 12, 8))
+                if timescale:
+                    result["duration"] = _rounded(duration / timescale)
+            elif box_type == b"tkhd" and track is not None:
+                version = _read_exact(read, payload, 1)[0]
+                dims_offset = payload + (88 if version == 1 else 76)
+                width, height = struct.unpack(">II", _read_exact(read, dims_offset, 8))
+                # 16.16 fixed point
+                track["width"], track["height"] = width >> 16, height >> 16
+            elif box_type == b"hdlr" and track is not None:
+                track["handler"] = _read_exact(read, payload + 8, 4)
+            elif box_type == b"trak":
+                child = {}
+                tracks.append(child)
+                walk(payload, payload + payload_size, child)
+            elif box_type in _MP4_CONTAINERS:
+                walk(payload, payload + payload_size, track)
+
+    for box_type, payload, payload_size in _mp4_boxes(read, 0, size):
+        if box_type == b"moov":
+            walk(payload, payload + payload_size, None)
+            break
+
+    for track in tracks:
+        if track.get("handler") == b"vide" and track.get("width") and track.get("height"):
+            result["width"], result["height"] = track["width"], track["height"]
+            break
+    return result or None
+
+
+# --- WebM / Matroska (EBML) -----------------------------------------------------
+
+_EBML_SEGMENT = 0x18538067
+_EBML_INFO = 0x1549A966
+_EBML_TRACKS = 0x1654AE6B
+_EBML_TRACK_ENTRY = 0xAE
+_EBML_VIDEO = 0xE0
+_EBML_CLUSTER = 0x1F43B675
+_EBML_TIMECODE_SCALE = 0x2AD7B1
+_EBML_DURATION = 0x4489
+_EBML_PIXEL_WIDTH = 0xB0
+_EBML_PIXEL_HEIGHT = 0xBA
+_EBML_UNKNOWN_SIZE = -1
+
+
+def _ebml_vint(read: Reader, offset: int, keep_marker: bool):
+    """Read a variable-length integer; returns (value, length)."""
+    first = _read_exact(read, offset, 1)[0]
+    length = 1
+    mask = 0x80
+    while length <= 8 and not first & mask:
+        mask >>= 1
+        length += 1
+    if length > 8:
+        raise _Truncated()
+    data = _read_exact(read, offset, length)
+    value = int.from_bytes(data, "big")
+    if keep_marker:
+        return value, length
+    value &= (1 << (7 * length)) - 1
+    if value == (1 << (7 * length)) - 1:
+        return _EBML_UNKNOWN_SIZE, length
+    return value, length
+
+
+def _ebml_elements(read: Reader, start: int, end: int):
+    """Yield (id, data offset, data size) of the elements in [start, end)."""
+    offset = start
+    for _ in range(_MAX_STEPS):
+        if offset >= end:
+            return
+        element_id, id_length = _ebml_vint(read, offset, keep_marker=True)
+        data_size, size_length = _ebml_vint(read, offset + id_length, keep_marker=False)
+        data = offset + id_length + size_length
+        yield element_id, data, data_size
+        if data_size == _EBML_UNKNOWN_SIZE:
+            return
+        offset = data + data_size
+
+
+def _ebml_uint(read: Reader, offset: int, size: int) -> int:
+    return int.from_bytes(_read_exact(read, offset, size), "big")
+
+
+def _ebml_float(read: Reader, offset: int, size: int) -> float:
+    data = _read_exact(read, offset, size)
+    return struct.unpack(">f" if size == 4 else ">d", data)[0]
+
+
+def _matroska(read: Reader, size: int) -> Optional[dict]:
+    result = {}
+    segment = None
+    for element_id, data, data_size in _ebml_elements(read, 0, size):
+        if element_id == _EBML_SEGMENT:
+            segment = (data, size if data_size == _EBML_UNKNOWN_SIZE else min(size, data + data_size))
+            break
+    if segment is None:
+        return None
+
+    timecode_scale = 1_000_000
+    duration = None
+    for element_id, data, data_size in _ebml_elements(read, *segment):
+        if data_size == _EBML_UNKNOWN_SIZE or element_id == _EBML_CLUSTER:
+            # Media data; everything describing the file comes before it
+            break
+        if element_id == _EBML_INFO:
+            for child_id, child, child_size in _ebml_elements(read, data, data + data_size):
+                if child_id == _EBML_TIMECODE_SCALE:
+                    timecode_scale = _ebml_uint(read, child, child_size)
+                elif child_id == _EBML_DURATION and child_size in (4, 8):
+                    duration = _ebml_float(read, child, child_size)
+        elif element_id == _EBML_TRACKS:
+            for entry_id, entry, entry_size in _ebml_elements(read, data, data + data_size):
+                if entry_id != _EBML_TRACK_ENTRY or "width" in result:
+                    continue
+                for child_id, child, child_size in _ebml_elements(read, entry, entry + entry_size):
+                    if child_id != _EBML_VIDEO:
+                        continue
+                    for video_id, value, value_size in _ebml_elements(read, child, child + child_size):
+                        if video_id == _EBML_PIXEL_WIDTH:
+                            result["width"] = _ebml_uint(read, value, value_size)
+                        elif video_id == _EBML_PIXEL_HEIGHT:
+                            result["height"] = _ebml_uint(read, value, value_size)
+    if duration is not None:
+        result["duration"] = _rounded(duration * timecode_scale / 1e9)
+    return result or None
+
+
+# --- Audio --------------------------------------------------------------------
+
+# Bitrates (kbps) by [version is MPEG-1][layer index][bitrate index]
+_MP3_BITRATES = {
+    (True, 1): [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+    (True, 2): [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+    (True, 3): [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    (False, 1): [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+    (False, 2): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    (False, 3): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+_MP3_SAMPLE_RATES = {3: [44100, 48000, 32000], 2: [22050, 24000, 16000], 0: [11025, 12000, 8000]}
+
+
+def _id3_size(head: bytes) -> int:
+    """Bytes taken by a leading ID3v2 tag (0 without one)."""
+    if head[:3] != b"ID3" or len(head) < 10:
+        return 0
+    size = 0
+    for byte in head[6:10]:
+        size = (size << 7) | (byte & 0x7F)
+    footer = 10 if head[5] & 0x10 else 0
+    return 10 + size + footer
+
+
+def _mp3(read: Reader, size: int) -> Optional[dict]:
+    offset = _id3_size(_read_exact(read, 0, 10))
+    # The first frame header is usually right after the tag; allow a little padding
+    window = read(offset, 4096)
+    position = 0
+    while position + 4 <= len(window):
+        if window[position] == 0xFF and window[position + 1] & 0xE0 == 0xE0:
+            break
+        position += 1
+    else:
+        return None
+    header = int.from_bytes(window[position:position + 4], "big")
+    frame_offset = offset + position
+
+    version_bits = (header >> 19) & 0x3
+    layer = 4 - ((header >> 17) & 0x3)
+    bitrate_index = (header >> 12) & 0xF
+    rate_index = (header >> 10) & 0x3
+    if version_bits == 1 or layer == 4 or bitrate_index in (0, 15) or rate_index == 3:
+        return None
+    mpeg1 = version_bits == 3
+    sample_rate = _MP3_SAMPLE_RATES[version_bits][rate_index]
+    samples_per_frame = 384 if layer == 1 else (1152 if layer == 2 or mpeg1 else 576)
+    channel_mode = (header >> 6) & 0x3
+
+    # A Xing/Info header in the first frame gives the exact frame count (VBR files)
+    side_info = (17 if channel_mode == 3 else 32) if mpeg1 else (9 if channel_mode == 3 else 17)
+    xing_offset = frame_offset + 4 + side_info
+    xing = read(xing_offset, 12)
+    if xing[:4] in (b"Xing", b"Info") and len(xing) == 12 and struct.unpack(">I", xing[4:8])[0] & 0x1:
+        frames = struct.unpack(">I", xing[8:12])[0]
+        return {"duration": _rounded(frames * samples_per_frame / sample_rate)}
+    vbri = read(frame_offset + 36, 18)
+    if vbri[:4] == b"VBRI" and len(vbri) == 18:
+        frames = struct.unpack(">I", vbri[14:18])[0]
+        return {"duration": _rounded(frames * samples_per_frame / sample_rate)}
+
+    # Constant bitrate: the audio data's size gives the duration
+    bitrate = _MP3_BITRATES[(mpeg1, layer)][bitrate_index] * 1000
+    audio_bytes = size - frame_offset
+    if size > 128 and read(size - 128, 3) == b"TAG":
+        audio_bytes -= 128
+    return {"duration": _rounded(audio_bytes * 8 / bitrate)}
+
+
+def _ogg(read: Reader, size: int) -> Optional[dict]:
+    # The identification header in the first page gives the sample rate
+    first_page = read(0, 512)
+    segments = first_page[26] if len(first_page) > 27 else 0
+    packet = first_page[27 + segments:]
+    if packet.startswith(b"\x01vorbis"):
+        sample_rate = struct.unpack("<I", packet[12:16])[0]
+        pre_skip = 0
+    elif packet.startswith(b"OpusHead"):
+        # Opus granule positions always count 48 kHz samples
+        sample_rate = 48000
+        pre_skip = struct.unpack("<H", packet[10:12])[0]
+    elif packet.startswith(b"\x7fFLAC"):
+        sample_rate = int.from_bytes(packet[27:30], "big") >> 4
+        pre_skip = 0
+    else:
+        return None
+    if not sample_rate:
+        return None
+
+    # The granule position of the last page is the total sample count
+    tail_size = min(size, 65536)
+    tail = read(size - tail_size, tail_size)
+    last_page = tail.rfind(b"OggS")
+    if last_page < 0 or last_page + 14 > len(tail):
+        return None
+    granule = struct.unpack("<q", tail[last_page + 6:last_page + 14])[0]
+    if granule <= 0:
+        return None
+    return {"duration": _rounded(max(0, granule - pre_skip) / sample_rate)}
+
+
+def _wav(read: Reader, size: int) -> Optional[dict]:
+    byte_rate = None
+    offset = 12
+    for _ in range(_MAX_STEPS):
+        header = read(offset, 8)
+        if len(header) < 8:
+            return None
+        chunk_id, chunk_size = struct.unpack("<4sI", header)
+        if chunk_id == b"fmt ":
+            byte_rate = struct.unpack("<I", _read_exact(read, offset + 16, 4))[0]
+        elif chunk_id == b"data":
+            if not byte_rate:
+                return None
+            # Streamed WAVs may leave the data size at its maximum
+            data_size = min(chunk_size, size - offset - 8)
+            return {"duration": _rounded(data_size / byte_rate)}
+        offset += 8 + chunk_size + (chunk_size & 1)
+    return None
+
+
+def _detect(head: bytes) -> Optional[Callable[[Reader, int], Optional[dict]]]:
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return _png
+    if head.startswith(b"\xff\xd8\xff"):
+        return _jpeg
+    if head[:6] in (b"GIF87a", b"GIF89a"):
+        return _gif
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return _webp
+    if head[:4] == b"RIFF" and head[8:12] == b"WAVE":
+        return _wav
+    if head[4:8] in (b"ftyp", b"moov", b"mdat", b"wide"):
+        return _mp4
+    if head[:4] == b"\x1a\x45\xdf\xa3":
+        return _matroska
+    if head[:4] == b"OggS":
+        return _ogg
+    if head[:3] == b"ID3" or (len(head) > 1 and head[0] == 0xFF and head[1] & 0xE0 == 0xE0):
+        return _mp3
+    return None
+
+
+def extract_metadata(read: Reader, size: int) -> dict:
+    """
+    Dimensions and/or duration of a media file, from its headers only.
+
+    Args:
+        read: Returns up to length bytes at offset
+        size: Size of the file in bytes
+
+    Returns:
+        Dict with width/height (pixels) and/or duration (seconds); empty when the
+        format isn't recognised or its headers are damaged
+    """
+    parser = _detect(read(0, _HEAD_SIZE))
+    if parser is None:
+        return {}
+    try:
+        return parser(read, size) or {}
+    except (_Truncated, struct.error, IndexError, ValueError, ZeroDivisionError):
+        return {}
+
+
+def extract_file_metadata(path) -> dict:
+    """extract_metadata for a local file."""
+    with open(path, "rb") as source:
+        source.seek(0, 2)
+        size = source.tell()
+
+        def read(offset: int, length: int) -> bytes:
+            if offset < 0 or offset >= size:
+                return b""
+            source.seek(offset)
+            return source.read(length)
+
+        return extract_metadata(read, size)
+
+
+class _BlockReader:
+    """Reads a stored object in cached blocks, so header walks make few storage requests."""
+
+    BLOCK_SIZE = 64 * 1024
+
+    def __init__(self, storage, key: str, size: int):
+        self.storage = storage
+        self.key = key
+        self.size = size
+        self.blocks = {}
+
+    def _block(self, index: int) -> bytes:
+        if index not in self.blocks:
+            self.blocks[index] = self.storage.read_range(self.key, index * self.BLOCK_SIZE, self.BLOCK_SIZE)
+        return self.blocks[index]
+
+    def __call__(self, offset: int, length: int) -> bytes:
+        if offset < 0 or offset >= self.size or length <= 0:
+            return b""
+        end = min(offset + length, self.size)
+        first, last = offset // self.BLOCK_SIZE, (end - 1) // self.BLOCK_SIZE
+        data = b"".join(self._block(index) for index in range(first, last + 1))
+        start = offset - first * self.BLOCK_SIZE
+        return data[start:start + (end - offset)]
+
+
+def stored_file_metadata(relative_url: str) -> dict:
+    """
+    extract_metadata for an upload in storage, read in place (ranged reads on
+    object storage). Blocking; call it from a threadpool.
+    """
+    storage = get_storage()
+    key = locate_storage_key(relative_url)
+    local_path = storage.local_path(key)
+    if local_path is not None:
+        return extract_file_metadata(local_path) if local_path.is_file() else {}
+    size = storage.size(key)
+    if size is None:
+        return {}
+    return extract_metadata(_BlockReader(storage, key, size), size)
@@ -0,0 +1,309 @@
+"""
+Orphaned upload sweeper.
+
+Reconciles stored files with the rows pointing at them and deletes files nothing
+references: attachments uploaded but never sent, media of messages deleted for
+everyone, replaced avatars, stale scratch files in UPLOAD_TMP_DIR and files in
+the legacy schemas/uploads directory.
+
+A file is referenced when its URL is a ``messages.media_url``, ``users.avatar_url``
+or ``conversations.avatar_url``, or the URL of an attachment blob still counted by
+a message. Derived files named ``<sha256>_<name>`` (thumbnails, avatar sizes) are
+referenced through their original. Files younger than the grace period are never
+touched, so uploads that haven't been attached to a message yet survive; neither
+are blobs (and their derived files) whose url was handed out within it
+(``AttachmentBlob.last_claimed_at``), however old their file.
+
+The sweep is incremental: each call to ``sweep_batch`` checks the next
+ORPHAN_SWEEP_BATCH_SIZE keys after a cursor, and the background loop
+(``run_orphan_sweeper``) runs one batch every ORPHAN_SWEEP_INTERVAL seconds.
+"""
+import asyncio
+import re
+import shutil
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Optional, Set
+
+from sqlalchemy import delete, or_, text
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from app.core.config import settings
+from app.core.ws_tickets import prune_used_tickets
+from app.db.session import SessionLocal
+from app.models.attachment_blob import AttachmentBlob
+from app.models.conversation import Conversation
+from app.models.message import Message
+from app.models.user import User
+from app.utils.avatars import AVATAR_SIZES
+from app.utils.file_upload import LEGACY_UPLOAD_DIR, SHARDED_FOLDERS, UPLOAD_TMP_DIR, shard_key, unshard_key
+from app.utils.logger import get_logger
+from app.utils.storage import get_storage
+
+logger = get_logger(__name__)
+
+# Derived files: <sha256>_<variant><ext> next to their original
+_DERIVED_FILE = re.compile(r"^(?P<sha>[0-9a-f]{64})_(?P<variant>[a-z0-9]+)(?P<ext>\.[A-Za-z0-9]+)$")
+
+# Keeps concurrent sweeps (several API workers) from checking the same keys at once
+_ADVISORY_LOCK_ID = 0x6F727068
+
+# Keys listed in dry-run reports
+_REPORT_SAMPLE_SIZE = 100
+
+# Position of the background sweep and the result of its last full pass
+_cursor = ""
+_pass_totals: Dict[str, int] = {}
+last_pass: Optional[dict] = None
+
+
+def _new_report(dry_run: bool) -> dict:
+    return {"dry_run": dry_run, "scanned": 0, "orphaned": 0, "deleted": 0, "bytes": 0, "keys": []}
+
+
+def _merge_report(total: dict, batch: dict) -> None:
+    for field in ("scanned", "orphaned", "deleted", "bytes"):
+        total[field] += batch[field]
+    total["keys"].extend(batch["keys"][:_REPORT_SAMPLE_SIZE - len(total["keys"])])
+
+
+def _record_orphan(report: dict, key: str, size: int) -> None:
+    report["orphaned"] += 1
+    report["bytes"] += size
+    if len(report["keys"]) < _REPORT_SAMPLE_SIZE:
+        report["keys"].append(key)
+
+
+def _key_urls(key: str) -> Set[str]:
+    """URLs that resolve to key: its own, and its flat or nested form across the layout migration."""
+    return {f"/uploads/{key}", f"/uploads/{unshard_key(key)}", f"/uploads/{shard_key(key)}"}
+
+
+def _legacy_urls(name: str) -> Set[str]:
+    """URLs a legacy file could have been stored under: the uploads root or any upload folder, flat or nested."""
+    urls = {f"/uploads/{name}"}
+    for folder in SHARDED_FOLDERS:
+        urls.add(f"/uploads/{folder}/{name}")
+        urls.add(f"/uploads/{shard_key(f'{folder}/{name}')}")
+    return urls
+
+
+def _owner_urls(key: str, blob_urls: Dict[str, str]) -> Set[str]:
+    """URLs whose presence in the database keeps the file at key alive."""
+    owners = _key_urls(key)
+    folder, _, name = key.rpartition("/")
+    match = _DERIVED_FILE.match(name)
+    if match:
+        sha256 = match["sha"]
+        if sha256 in blob_urls:
+            owners.add(blob_urls[sha256])
+        # Smaller avatar sizes belong to the avatar_url of the largest one
+        owners |= _key_urls(f"{folder}/{sha256}_{max(AVATAR_SIZES)}{match['ext']}")
+    return owners
+
+
+def _referenced_urls(db: Session, urls: Set[str]) -> Set[str]:
+    url_list = list(urls)
+    referenced = set()
+    referenced.update(row[0] for row in db.query(Message.media_url).filter(Message.media_url.in_(url_list)).distinct())
+    referenced.update(row[0] for row in db.query(User.avatar_url).filter(User.avatar_url.in_(url_list)).distinct())
+    referenced.update(
+        row[0] for row in db.query(Conversation.avatar_url).filter(Conversation.avatar_url.in_(url_list)).distinct()
+    )
+    referenced.update(
+        row[0] for row in
+        db.query(AttachmentBlob.url).filter(AttachmentBlob.url.in_(url_list), AttachmentBlob.ref_count > 0)
+    )
+    return referenced
+
+
+def _try_lock(db: Session) -> bool:
+    """Take the sweeper's transaction-scoped advisory lock, if no other sweep holds it."""
+    return bool(db.execute(text("SELECT pg_try_advisory_xact_lock(:id)"), {"id": _ADVISORY_LOCK_ID}).scalar())
+
+
+def sweep_batch(db: Session, start_after: str, limit: int, grace_seconds: float, dry_run: bool) -> dict:
+    """
+    Check the next limit stored keys after start_after and delete the orphans among them.
+    Runs blocking storage and database calls; call it from a threadpool.
+
+    Returns:
+        Report with scanned / orphaned / deleted / bytes counts, a sample of orphaned
+        keys, and cursor (the key to continue after, "" once the end is reached)
+    """
+    report = _new_report(dry_run)
+    if not _try_lock(db):
+        report["cursor"] = start_after
+        report["skipped"] = True
+        db.rollback()
+        return report
+
+    storage = get_storage()
+    keys = storage.list_keys(start_after, limit)
+    report["scanned"] = len(keys)
+    report["cursor"] = keys[-1][0] if len(keys) >= limit else ""
+
+    cutoff = time.time() - grace_seconds
+    candidates = [(key, size) for key, size, mtime in keys if mtime < cutoff]
+    if not candidates:
+        db.rollback()
+        return report
+
+    candidate_shas = {}
+    for key, _ in candidates:
+        name = key.rpartition("/")[2]
+        match = _DERIVED_FILE.match(name)
+        candidate_shas[key] = match["sha"] if match else Path(name).stem
+    claim_cutoff = datetime.utcfromtimestamp(cutoff)
+    blob_urls = {}
+    claimed = set()
+    for sha256, url, last_claimed_at in db.query(
+        AttachmentBlob.sha256, AttachmentBlob.url, AttachmentBlob.last_claimed_at
+    ).filter(AttachmentBlob.sha256.in_(list(set(candidate_shas.values())))):
+        blob_urls[sha256] = url
+        if last_claimed_at is not None and last_claimed_at >= claim_cutoff:
+            claimed.add(sha256)
+
+    owners = {key: _owner_urls(key, blob_urls) for key, _ in candidates}
+    referenced = _referenced_urls(db, set().union(*owners.values()))
+
+    orphans = []
+    for key, size in candidates:
+        # Handed to a client that may not have sent its message yet
+        if owners[key] & referenced or candidate_shas[key] in claimed:
+            continue
+        sha256 = Path(key).stem
+        if blob_urls.get(sha256) in _key_urls(key) and not dry_run:
+            # Only drop the blob if no message picked it up, and nobody claimed it, since the checks above
+            dropped = db.execute(
+                delete(AttachmentBlob)
+                .where(
+                    AttachmentBlob.sha256 == sha256,
+                    AttachmentBlob.ref_count == 0,
+                    or_(AttachmentBlob.last_claimed_at.is_(None), AttachmentBlob.last_claimed_at < claim_cutoff)
+                )
+                .returning(AttachmentBlob.sha256)
+            ).first()
+            if dropped is None:
+                continue
+        orphans.append((key, size))
+
+    db.commit()
+    for key, size in orphans:
+        _record_orphan(report, key, size)
+        if not dry_run and storage.delete(key):
+            report["deleted"] += 1
+    return report
+
+
+def _sweep_directory(directory: Path, report: dict, grace_seconds: float, dry_run: bool, db: Optional[Session]) -> None:
+    """Sweep a local directory outside storage: scratch entries, or legacy files when db is given."""
+    if not directory.exists():
+        return
+    cutoff = time.time() - grace_seconds
+    for entry in directory.iterdir():
+        try:
+            stat_result = entry.stat()
+        except FileNotFoundError:
+            continue
+        if stat_result.st_mtime >= cutoff:
+            continue
+        report["scanned"] += 1
+        if db is not None:
+            if not entry.is_file():
+                continue
+            # Legacy files are served for an upload URL ending in their name; exact matches use the URL indexes
+            if _referenced_urls(db, _legacy_urls(entry.name)):
+                continue
+        _record_orphan(report, str(entry), stat_result.st_size)
+        if dry_run:
+            continue
+        if entry.is_dir():
+            shutil.rmtree(entry, ignore_errors=True)
+        else:
+            entry.unlink(missing_ok=True)
+        report["deleted"] += 1
+
+
+def sweep_local_leftovers(db: Session, grace_seconds: float, dry_run: bool) -> dict:
+    """Sweep stale scratch files in UPLOAD_TMP_DIR and unreferenced legacy uploads."""
+    report = _new_report(dry_run)
+    _sweep_directory(UPLOAD_TMP_DIR, report, grace_seconds, dry_run, None)
+    _sweep_directory(LEGACY_UPLOAD_DIR, report, grace_seconds, dry_run, db)
+    return report
+
+
+def sweep_all(dry_run: bool = True, grace_seconds: Optional[float] = None) -> dict:
+    """
+    One full pass over storage, the scratch directory and legacy uploads.
+    Blocking; call it from a threadpool.
+    """
+    if grace_seconds is None:
+        grace_seconds = settings.ORPHAN_SWEEP_GRACE_HOURS * 3600
+    report = _new_report(dry_run)
+    db = SessionLocal()
+    try:
+        cursor = ""
+        while True:
+            batch = sweep_batch(db, cursor, settings.ORPHAN_SWEEP_BATCH_SIZE, grace_seconds, dry_run)
+            if batch.get("skipped"):
+                report["skipped"] = True
+                break
+            _merge_report(report, batch)
+            cursor = batch["cursor"]
+            if not cursor:
+                break
+        _merge_report(report, sweep_local_leftovers(db, grace_seconds, dry_run))
+    finally:
+        db.close()
+    return report
+
+
+def _sweep_next_batch() -> None:
+    global _cursor, _pass_totals, last_pass
+    grace_seconds = settings.ORPHAN_SWEEP_GRACE_HOURS * 3600
+    dry_run = settings.ORPHAN_SWEEP_DRY_RUN
+    db = SessionLocal()
+    try:
+        prune_used_tickets(db)
+        batch = sweep_batch(db, _cursor, settings.ORPHAN_SWEEP_BATCH_SIZE, grace_seconds, dry_run)
+        if batch.get("skipped"):
+            return
+        if not _pass_totals:
+            _pass_totals = {**_new_report(dry_run), "started_at": time.time()}
+        _merge_report(_pass_totals, batch)
+        _cursor = batch["cursor"]
+        if not _cursor:
+            # End of storage: finish the pass with the directories outside it
+            _merge_report(_pass_totals, sweep_local_leftovers(db, grace_seconds, dry_run))
+            last_pass = {**_pass_totals, "finished_at": time.time()}
+            _pass_totals = {}
+            logger.info(
+                "Orphan sweep%s: %d orphaned files (%d bytes) of %d scanned, %d deleted",
+                " (dry run)" if dry_run else "", last_pass["orphaned"], last_pass["bytes"],
+                last_pass["scanned"], last_pass["deleted"]
+            )
+    finally:
+        db.close()
+
+
+async def run_orphan_sweeper() -> None:
+    """Background task: sweep one batch (and drop expired connect ticket nonces) every ORPHAN_SWEEP_INTERVAL seconds, forever."""
+    while True:
+        await asyncio.sleep(settings.ORPHAN_SWEEP_INTERVAL)
+        try:
+            await run_in_threadpool(_sweep_next_batch)
+        except Exception:
+            logger.exception("Orphan sweep failed")
+
+
+def sweeper_status() -> dict:
+    return {
+        "enabled": settings.ORPHAN_SWEEP_INTERVAL > 0,
+        "dry_run": settings.ORPHAN_SWEEP_DRY_RUN,
+        "cursor": _cursor,
+        "current_pass": _pass_totals or None,
+        "last_pass": last_pass,
+    }
@@ -0,0 +1,42 @@
+"""Phone number normalization and hashing for contact discovery."""
+import hashlib
+import re
+from typing import Optional
+
+_PHONE_SEPARATORS = re.compile(r"[\s\-().]")
+_PHONE_HASH = re.compile(r"^[0-9a-f]{64}$")
+
+
+def normalize_phone(phone: str) -> Optional[str]:
+    """
+    Normalize a phone number to '+<digits>' (or bare digits when no country code is given).
+    
+    Args:
+        phone: Phone number as typed in an address book, e.g. '+1 (555) 010-9999' or '0044 20 7946 0000'
+        
+    Returns:
+        Normalized number, or None if it doesn't look like a phone number
+    """
+    if not phone:
+        return None
+    
+    value = _PHONE_SEPARATORS.sub("", phone.strip())
+    if value.startswith("00"):
+        value = "+" + value[2:]
+    
+    has_country_code = value.startswith("+")
+    digits = value[1:] if has_country_code else value
+    if not digits.isdigit() or not 6 <= len(digits) <= 15:
+        return None
+    
+    return f"+{digits}" if has_country_code else digits
+
+
+def hash_phone(normalized_phone: str) -> str:
+    """Return the SHA-256 hex digest clients use to discover contacts without sending raw numbers."""
+    return hashlib.sha256(normalized_phone.encode("utf-8")).hexdigest()
+
+
+def is_phone_hash(value: str) -> bool:
+    """Check if a value is a lowercase SHA-256 hex digest."""
+    return bool(value) and bool(_PHONE_HASH.match(value))
@@ -0,0 +1,322 @@
+"""
+Resumable (tus-style) chunked uploads.
+
+Each upload session lives in its own directory under UPLOAD_SESSIONS_DIR:
+
+    <upload_id>/session.json     immutable metadata (owner, filename, size, ...)
+    <upload_id>/data.part        preallocated file the chunks are written into
+    <upload_id>/ranges/<a>-<b>   empty marker per fully written chunk [a, b)
+
+and _owners/<user_id>/<upload_id>_<size> marks each user's open sessions, so the
+per-user limits on open sessions and preallocated bytes are checked without
+reading every session. Checking the limits and creating a session happen under
+a per-user file lock (_owners/<user_id>.lock), so concurrent requests from one
+user can't all pass the check.
+
+A range marker is only created after its bytes are on disk, and creating a file
+is atomic, so chunks can be uploaded in parallel (even to different workers)
+without any lock; an interrupted chunk simply has no marker and is re-sent.
+"""
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import AsyncIterator, List, Optional, Tuple
+
+from starlette.concurrency import run_in_threadpool
+
+from app.core.config import settings
+from app.utils.file_upload import (
+    UPLOAD_CHUNK_SIZE,
+    UploadTooLargeError,
+    guess_content_type,
+    resolve_upload_destination,
+    store_content_addressed,
+)
+from app.utils.storage import get_storage
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# Kept outside UPLOADS_DIR so partial files are never served by the /uploads mount
+UPLOAD_SESSIONS_DIR = Path(__file__).parent.parent.parent / "upload_sessions"
+
+# Per-user index of open sessions (not itself a session directory)
+_OWNERS_DIR = UPLOAD_SESSIONS_DIR / "_owners"
+
+# Sessions without activity for this long are deleted
+SESSION_TTL = timedelta(hours=24)
+
+# Largest chunk accepted by a single PATCH request
+MAX_CHUNK_SIZE = 32 * 1024 * 1024
+
+# Minimum seconds between sweeps for expired sessions
+_SWEEP_INTERVAL = 600
+_last_sweep = 0.0
+
+
+class UploadSessionError(ValueError):
+    """Raised when a request doesn't fit the state of an upload session."""
+
+
+class UploadQuotaError(UploadSessionError):
+    """Raised when a user already has too many open sessions or bytes reserved."""
+
+
+def _session_dir(upload_id: str) -> Path:
+    # upload_id is always a UUID we generated; validating it also prevents path traversal
+    return UPLOAD_SESSIONS_DIR / str(uuid.UUID(upload_id))
+
+
+def _owner_marker(session: dict) -> Path:
+    return _OWNERS_DIR / str(uuid.UUID(session["user_id"])) / f"{session['upload_id']}_{session['size']}"
+
+
+def _open_sessions(user_id: str) -> List[Tuple[str, int]]:
+    """(upload_id, size) of the user's unexpired sessions; drops markers of finished or expired ones."""
+    owner_dir = _OWNERS_DIR / str(uuid.UUID(str(user_id)))
+    if not owner_dir.exists():
+        return []
+    cutoff = time.time() - SESSION_TTL.total_seconds()
+    sessions = []
+    for marker in owner_dir.iterdir():
+        upload_id, _, size = marker.name.partition("_")
+        try:
+            if _session_dir(upload_id).stat().st_mtime >= cutoff:
+                sessions.append((upload_id, int(size)))
+                continue
+        except (FileNotFoundError, ValueError):
+            pass
+        marker.unlink(missing_ok=True)
+    return sessions
+
+
+@contextmanager
+def _owner_lock(user_id: str):
+    """Hold the user's quota lock, across threads and worker processes sharing UPLOAD_SESSIONS_DIR."""
+    _OWNERS_DIR.mkdir(parents=True, exist_ok=True)
+    # Next to the owner directory, not in it, where it would be read as a session marker
+    with (_OWNERS_DIR / f"{uuid.UUID(str(user_id))}.lock").open("a+b") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        else:
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+        # Closing the file releases the lock
+        yield
+
+
+def _merge_ranges(ranges: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    merged: List[Tuple[int, int]] = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def create_session(user_id: str, filename: str, size: int, category: str = 'attachment') -> dict:
+    """
+    Create an upload session and preallocate its data file.
+
+    Raises:
+        UploadTooLargeError: If size exceeds the limit for the file's category
+        UploadQuotaError: If the user's open sessions would exceed UPLOAD_SESSION_MAX_OPEN
+            or UPLOAD_SESSION_MAX_BYTES
+    """
+    _, _, max_size = resolve_upload_destination(filename, category)
+    if size > max_size:
+        raise UploadTooLargeError(max_size)
+    if size <= 0:
+        raise UploadSessionError("Upload size must be positive")
+
+    with _owner_lock(user_id):
+        open_sessions = _open_sessions(user_id)
+        if len(open_sessions) >= settings.UPLOAD_SESSION_MAX_OPEN:
+            raise UploadQuotaError(
+                f"Too many unfinished uploads (at most {settings.UPLOAD_SESSION_MAX_OPEN}); complete or cancel one first"
+            )
+        if sum(open_size for _, open_size in open_sessions) + size > settings.UPLOAD_SESSION_MAX_BYTES:
+            raise UploadQuotaError("Unfinished uploads are too large in total; complete or cancel one first")
+        return _create_session_files(user_id, filename, size, category)
+
+
+def _create_session_files(user_id: str, filename: str, size: int, category: str) -> dict:
+    upload_id = str(uuid.uuid4())
+    session_dir = _session_dir(upload_id)
+    (session_dir / "ranges").mkdir(parents=True)
+    with (session_dir / "data.part").open("wb") as part:
+        part.truncate(size)
+
+    session = {
+        "upload_id": upload_id,
+        "user_id": str(user_id),
+        "filename": filename,
+        "category": category,
+        "size": size,
+        "created_at": datetime.utcnow().isoformat(),
+    }
+    (session_dir / "session.json").write_text(json.dumps(session))
+    marker = _owner_marker(session)
+    marker.parent.mkdir(parents=True, exist_ok=True)
+    marker.touch()
+    return session
+
+
+def load_session(upload_id: str, user_id: str) -> dict:
+    """
+    Load a session owned by user_id, with its received ranges.
+
+    Raises:
+        FileNotFoundError: If the session doesn't exist, expired or belongs to someone else
+    """
+    try:
+        session_dir = _session_dir(upload_id)
+    except ValueError:
+        raise FileNotFoundError(upload_id)
+    session = json.loads((session_dir / "session.json").read_text())
+    if session["user_id"] != str(user_id):
+        raise FileNotFoundError(upload_id)
+
+    ranges = []
+    for marker in (session_dir / "ranges").iterdir():
+        start, end = marker.name.split("-")
+        ranges.append((int(start), int(end)))
+    session["received"] = _merge_ranges(ranges)
+    # Like tus Upload-Offset: length of the contiguous prefix received so far
+    first = session["received"][0] if session["received"] else None
+    session["offset"] = first[1] if first and first[0] == 0 else 0
+    session["complete"] = session["received"] == [(0, session["size"])]
+    session["expires_at"] = (
+        datetime.utcfromtimestamp(session_dir.stat().st_mtime) + SESSION_TTL
+    ).isoformat()
+    return session
+
+
+async def write_chunk(session: dict, offset: int, length: Optional[int], body: AsyncIterator[bytes]) -> int:
+    """
+    Write one chunk at offset, streaming it from the request body.
+
+    Returns:
+        Number of bytes written
+    """
+    size = session["size"]
+    if offset < 0 or offset >= size:
+        raise UploadSessionError(f"Offset must be between 0 and {size - 1}")
+    if length is not None and (length > MAX_CHUNK_SIZE or offset + length > size):
+        raise UploadSessionError("Chunk is too large or extends past the end of the upload")
+
+    session_dir = _session_dir(session["upload_id"])
+    part = await run_in_threadpool((session_dir / "data.part").open, "r+b")
+    written = 0
+    try:
+        await run_in_threadpool(part.seek, offset)
+        async for data in body:
+            if not data:
+                continue
+            written += len(data)
+            if written > MAX_CHUNK_SIZE or offset + written > size:
+                raise UploadSessionError("Chunk is too large or extends past the end of the upload")
+            await run_in_threadpool(part.write, data)
+        await run_in_threadpool(part.flush)
+    finally:
+        await run_in_threadpool(part.close)
+
+    if length is not None and written != length:
+        raise UploadSessionError(f"Expected {length} bytes but received {written}")
+    if written:
+        # Marking the range only after the bytes are written makes interrupted chunks retryable
+        (session_dir / "ranges" / f"{offset}-{offset + written}").touch()
+        os.utime(session_dir)
+    return written
+
+
+def _hash_file(path: Path) -> str:
+    sha256 = hashlib.sha256()
+    with path.open("rb") as source:
+        for chunk in iter(lambda: source.read(UPLOAD_CHUNK_SIZE), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+async def finalize_session(session: dict) -> Tuple[Path, str, int, str]:
+    """
+    Move a complete upload into storage and delete the session.
+    Attachments are stored content-addressed, like save_upload_file does.
+
+    Returns:
+        Tuple of (storage_key, relative_url, size_bytes, sha256_hex), like save_upload_file
+    """
+    if not session["complete"]:
+        raise UploadSessionError("Upload is incomplete")
+
+    session_dir = _session_dir(session["upload_id"])
+    part_path = session_dir / "data.part"
+    sha256 = await run_in_threadpool(_hash_file, part_path)
+    if session["category"] == 'profile':
+        key, relative_url, _ = resolve_upload_destination(session["filename"], session["category"])
+        await run_in_threadpool(
+            get_storage().put_file, part_path, key, guess_content_type(session["filename"])
+        )
+    else:
+        key, relative_url = await run_in_threadpool(
+            store_content_addressed, part_path, session["filename"], sha256
+        )
+    await run_in_threadpool(shutil.rmtree, session_dir, True)
+    _owner_marker(session).unlink(missing_ok=True)
+    return key, relative_url, session["size"], sha256
+
+
+def delete_session(session: dict) -> None:
+    """Abort an upload session."""
+    shutil.rmtree(_session_dir(session["upload_id"]), ignore_errors=True)
+    _owner_marker(session).unlink(missing_ok=True)
+
+
+def expire_stale_sessions(force: bool = False) -> int:
+    """
+    Delete sessions without activity for SESSION_TTL.
+
+    Runs at most every few minutes unless force is set; call it from a threadpool.
+
+    Returns:
+        Number of sessions deleted
+    """
+    global _last_sweep
+    now = time.time()
+    if not force and now - _last_sweep < _SWEEP_INTERVAL:
+        return 0
+    _last_sweep = now
+
+    if not UPLOAD_SESSIONS_DIR.exists():
+        return 0
+
+    cutoff = now - SESSION_TTL.total_seconds()
+    deleted = 0
+    for session_dir in UPLOAD_SESSIONS_DIR.iterdir():
+        if session_dir == _OWNERS_DIR:
+            continue
+        try:
+            if session_dir.stat().st_mtime >= cutoff:
+                continue
+        except FileNotFoundError:
+            continue
+        try:
+            session = json.loads((session_dir / "session.json").read_text())
+        except (OSError, ValueError):
+            # Interrupted while being created; it has no marker yet
+            session = None
+        shutil.rmtree(session_dir, ignore_errors=True)
+        if session is not None:
+            _owner_marker(session).unlink(missing_ok=True)
+        deleted += 1
+    return deleted
@@ -0,0 +1,339 @@
+"""
+Storage backends for uploaded media.
+
+Files are addressed by key, the path below /uploads (e.g. ``attachments/images/<sha256>.jpg``).
+The public URL stored in the database stays ``/uploads/<key>`` whatever the backend;
+with object storage, requests for it are redirected to the bucket.
+
+    STORAGE_BACKEND=local   files under UPLOADS_DIR, served by the API (default)
+    STORAGE_BACKEND=s3      any S3-compatible store (AWS S3, MinIO, ...); set S3_ENDPOINT_URL
+                            for a local MinIO, e.g. http://127.0.0.1:9000
+
+Both backends hand out presigned PUT URLs so clients can send bytes straight to
+storage; the local backend's URL points at PUT /api/uploads/direct/{token}.
+"""
+import base64
+import os
+import shutil
+import threading
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple
+
+from jose import JWTError, jwt
+
+from app.core.config import settings
+
+try:
+    import boto3
+    from botocore.config import Config as BotoConfig
+    from botocore.exceptions import ClientError
+except ImportError:  # boto3 is only needed for STORAGE_BACKEND=s3
+    boto3 = None
+
+
+class StorageBackend(ABC):
+    """Interface implemented by every storage backend; subclasses must implement every abstract method."""
+
+    name = "base"
+
+    @abstractmethod
+    def exists(self, key: str) -> bool:
+        """Whether an object is stored under key."""
+
+    @abstractmethod
+    def size(self, key: str) -> Optional[int]:
+        """Size in bytes, or None if the key doesn't exist."""
+
+    @abstractmethod
+    def put_file(self, source: Path, key: str, content_type: Optional[str] = None) -> None:
+        """Store a finished local file under key; the source file is consumed."""
+
+    @abstractmethod
+    def put_bytes(self, data: bytes, key: str, content_type: Optional[str] = None) -> None:
+        """Store data under key."""
+
+    @abstractmethod
+    def delete(self, key: str) -> bool:
+        """Delete key; returns False if it didn't exist."""
+
+    @abstractmethod
+    def move(self, key: str, new_key: str) -> None:
+        """Move an object to a new key (replacing anything stored there)."""
+
+    def local_path(self, key: str) -> Optional[Path]:
+        """Path of key on this machine, for backends that keep files locally."""
+        return None
+
+    @abstractmethod
+    def fetch_to(self, key: str, target: Path) -> None:
+        """Copy the object at key into a local file."""
+
+    @abstractmethod
+    def read_range(self, key: str, offset: int, length: int) -> bytes:
+        """Up to length bytes of the object at key, starting at offset."""
+
+    @abstractmethod
+    def presign_put(self, key: str, size: int, sha256: str, content_type: Optional[str] = None) -> dict:
+        """
+        Presigned request a client can use to upload key directly.
+
+        Returns:
+            Dict with url, method and the headers the client must send
+        """
+
+    @abstractmethod
+    def presign_get(self, key: str) -> str:
+        """URL a client can download key from."""
+
+    @abstractmethod
+    def list_keys(self, start_after: str = "", limit: int = 1000) -> List[Tuple[str, int, float]]:
+        """
+        Stored keys in lexicographic order, starting after start_after.
+
+        Returns:
+            Up to limit tuples of (key, size, modified time as a Unix timestamp)
+        """
+
+
+class LocalStorage(StorageBackend):
+    """Files under a local directory (UPLOADS_DIR), served at /uploads."""
+
+    name = "local"
+
+    def __init__(self, root: Path):
+        self.root = root
+
+    def _path(self, key: str) -> Path:
+        return self.root / key
+
+    def exists(self, key: str) -> bool:
+        return self._path(key).is_file()
+
+    def size(self, key: str) -> Optional[int]:
+        try:
+            return self._path(key).stat().st_size
+        except FileNotFoundError:
+            return None
+
+    def put_file(self, source: Path, key: str, content_type: Optional[str] = None) -> None:
+        target = self._path(key)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        shutil.move(str(source), str(target))
+
+    def put_bytes(self, data: bytes, key: str, content_type: Optional[str] = None) -> None:
+        target = self._path(key)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        with target.open("wb") as f:
+            f.write(data)
+
+    def delete(self, key: str) -> bool:
+        try:
+            self._path(key).unlink()
+            return True
+        except FileNotFoundError:
+            return False
+
+    def move(self, key: str, new_key: str) -> None:
+        target = self._path(new_key)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        # Atomic on the same filesystem, so readers see the file at one key or the other
+        os.replace(self._path(key), target)
+
+    def local_path(self, key: str) -> Optional[Path]:
+        return self._path(key)
+
+    def fetch_to(self, key: str, target: Path) -> None:
+        shutil.copyfile(self._path(key), target)
+
+    def read_range(self, key: str, offset: int, length: int) -> bytes:
+        with self._path(key).open("rb") as source:
+            source.seek(offset)
+            return source.read(length)
+
+    def presign_put(self, key: str, size: int, sha256: str, content_type: Optional[str] = None) -> dict:
+        expires_at = datetime.utcnow() + timedelta(seconds=settings.PRESIGN_EXPIRE_SECONDS)
+        token = jwt.encode(
+            {"type": "direct_upload", "key": key, "size": size, "sha256": sha256, "exp": expires_at},
+            settings.SECRET_KEY,
+            algorithm=settings.ALGORITHM
+        )
+        headers = {"Content-Length": str(size)}
+        if content_type:
+            headers["Content-Type"] = content_type
+        return {"url": f"/api/uploads/direct/{token}", "method": "PUT", "headers": headers}
+
+    def presign_get(self, key: str) -> str:
+        return f"/uploads/{key}"
+
+    def _walk(self, directory: Path, prefix: str, start_after: str) -> Iterator[Tuple[str, os.stat_result]]:
+        try:
+            entries = list(os.scandir(directory))
+        except FileNotFoundError:
+            return
+        # Directories sort as "<name>/" so the walk yields keys in the same order S3 lists them
+        entries.sort(key=lambda entry: entry.name + ("/" if entry.is_dir(follow_symlinks=False) else ""))
+        for entry in entries:
+            key = prefix + entry.name
+            if entry.is_dir(follow_symlinks=False):
+                sub_prefix = key + "/"
+                # Skip subtrees that lie entirely before the cursor
+                if sub_prefix < start_after and not start_after.startswith(sub_prefix):
+                    continue
+                yield from self._walk(Path(entry.path), sub_prefix, start_after)
+            elif key > start_after and entry.is_file(follow_symlinks=False):
+                try:
+                    yield key, entry.stat()
+                except FileNotFoundError:
+                    continue
+
+    def list_keys(self, start_after: str = "", limit: int = 1000) -> List[Tuple[str, int, float]]:
+        keys = []
+        for key, stat_result in self._walk(self.root, "", start_after):
+            keys.append((key, stat_result.st_size, stat_result.st_mtime))
+            if len(keys) >= limit:
+                break
+        return keys
+
+
+class S3Storage(StorageBackend):
+    """Objects in an S3-compatible bucket."""
+
+    name = "s3"
+
+    def __init__(self):
+        if boto3 is None:
+            raise RuntimeError("STORAGE_BACKEND=s3 requires boto3 (pip install boto3)")
+        if not settings.S3_BUCKET:
+            raise RuntimeError("STORAGE_BACKEND=s3 requires S3_BUCKET")
+        self.bucket = settings.S3_BUCKET
+        self.client = boto3.client(
+            "s3",
+            endpoint_url=settings.S3_ENDPOINT_URL,
+            region_name=settings.S3_REGION,
+            aws_access_key_id=settings.S3_ACCESS_KEY_ID,
+            aws_secret_access_key=settings.S3_SECRET_ACCESS_KEY,
+            # Path-style addressing works with MinIO and other stand-ins without DNS setup
+            config=BotoConfig(signature_version="s3v4", s3={"addressing_style": "path"})
+        )
+
+    def _head(self, key: str) -> Optional[dict]:
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=key)
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return None
+            raise
+
+    def exists(self, key: str) -> bool:
+        return self._head(key) is not None
+
+    def size(self, key: str) -> Optional[int]:
+        head = self._head(key)
+        return head["ContentLength"] if head else None
+
+    def _extra_args(self, content_type: Optional[str]) -> dict:
+        extra = {"CacheControl": "public, max-age=31536000"}
+        if content_type:
+            extra["ContentType"] = content_type
+        return extra
+
+    def put_file(self, source: Path, key: str, content_type: Optional[str] = None) -> None:
+        try:
+            self.client.upload_file(str(source), self.bucket, key, ExtraArgs=self._extra_args(content_type))
+        finally:
+            source.unlink(missing_ok=True)
+
+    def put_bytes(self, data: bytes, key: str, content_type: Optional[str] = None) -> None:
+        self.client.put_object(Bucket=self.bucket, Key=key, Body=data, **self._extra_args(content_type))
+
+    def delete(self, key: str) -> bool:
+        if not self.exists(key):
+            return False
+        self.client.delete_object(Bucket=self.bucket, Key=key)
+        return True
+
+    def move(self, key: str, new_key: str) -> None:
+        # S3 has no rename: copy (multipart for large objects), then delete the source
+        self.client.copy({"Bucket": self.bucket, "Key": key}, self.bucket, new_key)
+        self.client.delete_object(Bucket=self.bucket, Key=key)
+
+    def fetch_to(self, key: str, target: Path) -> None:
+        self.client.download_file(self.bucket, key, str(target))
+
+    def read_range(self, key: str, offset: int, length: int) -> bytes:
+        if length <= 0:
+            return b""
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=key, Range=f"bytes={offset}-{offset + length - 1}")
+        except ClientError as e:
+            # Reading past the end of the object
+            if e.response.get("Error", {}).get("Code") == "InvalidRange":
+                return b""
+            raise
+        return response["Body"].read()
+
+    def presign_put(self, key: str, size: int, sha256: str, content_type: Optional[str] = None) -> dict:
+        # The signed checksum makes the store reject bytes that don't match the declared hash
+        checksum = base64.b64encode(bytes.fromhex(sha256)).decode()
+        params = {"Bucket": self.bucket, "Key": key, "ContentLength": size, "ChecksumSHA256": checksum}
+        headers = {"Content-Length": str(size), "x-amz-checksum-sha256": checksum}
+        if content_type:
+            params["ContentType"] = content_type
+            headers["Content-Type"] = content_type
+        url = self.client.generate_presigned_url(
+            "put_object", Params=params, ExpiresIn=settings.PRESIGN_EXPIRE_SECONDS
+        )
+        return {"url": url, "method": "PUT", "headers": headers}
+
+    def presign_get(self, key: str) -> str:
+        if settings.S3_PUBLIC_URL:
+            return f"{settings.S3_PUBLIC_URL.rstrip('/')}/{key}"
+        return self.client.generate_presigned_url(
+            "get_object", Params={"Bucket": self.bucket, "Key": key}, ExpiresIn=settings.PRESIGN_EXPIRE_SECONDS
+        )
+
+    def list_keys(self, start_after: str = "", limit: int = 1000) -> List[Tuple[str, int, float]]:
+        response = self.client.list_objects_v2(Bucket=self.bucket, StartAfter=start_after, MaxKeys=min(limit, 1000))
+        return [
+            (item["Key"], item["Size"], item["LastModified"].timestamp())
+            for item in response.get("Contents", [])
+        ]
+
+
+_storage: Optional[StorageBackend] = None
+_storage_lock = threading.Lock()
+
+
+def get_storage() -> StorageBackend:
+    """The configured storage backend (created on first use)."""
+    global _storage
+    if _storage is None:
+        with _storage_lock:
+            if _storage is None:
+                if settings.STORAGE_BACKEND == "s3":
+                    _storage = S3Storage()
+                else:
+                    from app.utils.file_upload import UPLOADS_DIR
+                    _storage = LocalStorage(UPLOADS_DIR)
+    return _storage
+
+
+def read_direct_upload_token(token: str) -> Tuple[str, int, str]:
+    """
+    Validate a local presigned upload token.
+
+    Returns:
+        Tuple of (key, size, sha256)
+
+    Raises:
+        ValueError: If the token is invalid or expired
+    """
+    try:
+        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
+        if payload.get("type") != "direct_upload":
+            raise ValueError("Wrong token type")
+        return payload["key"], int(payload["size"]), payload["sha256"]
+    except (JWTError, KeyError, ValueError):
+        raise ValueError("Invalid or expired upload URL")
@@ -0,0 +1,107 @@
+"""
+Per-user storage usage, kept incrementally.
+
+A user is charged for the attachments of the messages they sent (released when
+a message's media is deleted for everyone) and for their current avatar. The
+counters are adjusted alongside the change they account for, so reading them
+never walks storage; ``rebuild_usage`` recomputes them from the
+database for backfills or after manual cleanups.
+"""
+from datetime import datetime
+from typing import Callable, Iterable, Optional, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from app.models.attachment_blob import AttachmentBlob
+from app.models.message import Message
+from app.models.storage_usage import StorageUsage
+from app.models.user import User
+from app.utils.file_upload import locate_storage_key
+from app.utils.storage import get_storage
+
+
+def adjust_usage(db: Session, user_id, bytes_delta: int, files_delta: int) -> None:
+    """Add to (or, with negative deltas, subtract from) a user's usage. Caller commits."""
+    if not user_id or (bytes_delta == 0 and files_delta == 0):
+        return
+    db.execute(
+        pg_insert(StorageUsage)
+        .values(user_id=user_id, bytes_used=max(bytes_delta, 0), file_count=max(files_delta, 0),
+                updated_at=datetime.utcnow())
+        .on_conflict_do_update(
+            index_elements=[StorageUsage.user_id],
+            set_={
+                "bytes_used": func.greatest(StorageUsage.bytes_used + bytes_delta, 0),
+                "file_count": func.greatest(StorageUsage.file_count + files_delta, 0),
+                "updated_at": datetime.utcnow(),
+            }
+        )
+    )
+
+
+def get_usage(db: Session, user_id) -> dict:
+    usage = db.query(StorageUsage).filter(StorageUsage.user_id == user_id).first()
+    return {
+        "bytes_used": usage.bytes_used if usage else 0,
+        "file_count": usage.file_count if usage else 0,
+        "updated_at": usage.updated_at if usage else None,
+    }
+
+
+def stored_bytes(urls: Iterable[str]) -> Tuple[int, int]:
+    """
+    Total size of the stored files behind urls; missing files count as nothing.
+    Makes a storage request per url, so call it from a threadpool.
+
+    Returns:
+        Tuple of (bytes, files)
+    """
+    storage = get_storage()
+    total = files = 0
+    for url in urls:
+        size = storage.size(locate_storage_key(url))
+        if size is not None:
+            total += size
+            files += 1
+    return total, files
+
+
+def rebuild_usage(db: Session, avatar_urls: Optional[Callable[[str], Iterable[str]]] = None) -> int:
+    """
+    Recompute every user's usage from messages and avatars and commit.
+    Stats avatar files in storage, so call it from a threadpool.
+
+    Args:
+        avatar_urls: Maps an avatar_url to every stored file making it up
+                     (defaults to the url itself)
+
+    Returns:
+        Number of users with non-zero usage
+    """
+    totals = {}
+    attachments = (
+        db.query(Message.sender_id, func.sum(AttachmentBlob.size), func.count(Message.id))
+        .join(AttachmentBlob, AttachmentBlob.url == Message.media_url)
+        .group_by(Message.sender_id)
+    )
+    for sender_id, size, count in attachments:
+        totals[sender_id] = [int(size or 0), int(count)]
+
+    for user_id, avatar_url in db.query(User.id, User.avatar_url).filter(User.avatar_url.like("/uploads/%")):
+        urls = avatar_urls(avatar_url) if avatar_urls else [avatar_url]
+        size, count = stored_bytes(urls)
+        entry = totals.setdefault(user_id, [0, 0])
+        entry[0] += size
+        entry[1] += count
+
+    now = datetime.utcnow()
+    db.query(StorageUsage).delete(synchronize_session=False)
+    db.bulk_insert_mappings(StorageUsage, [
+        {"user_id": user_id, "bytes_used": size, "file_count": count, "updated_at": now}
+        for user_id, (size, count) in totals.items()
+        if size or count
+    ])
+    db.commit()
+    return sum(1 for size, count in totals.values() if size or count)
@@ -0,0 +1,188 @@
+"""
+Background thumbnail and placeholder generation for image attachments.
+
+Decoding and resizing run in a process pool (app.utils.image_variants), so the
+event loop only awaits a future. Variants are put next to the original in storage;
+their URLs are stored on the attachment blob and copied to every message that uses it.
+"""
+import asyncio
+import shutil
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy import update
+from starlette.concurrency import run_in_threadpool
+
+from app.core.config import settings
+from app.db.session import SessionLocal
+from app.models.attachment_blob import AttachmentBlob
+from app.models.message import Message
+from app.utils import image_variants
+from app.utils.file_upload import (
+    UPLOAD_TMP_DIR, get_file_category, guess_content_type, locate_storage_key, storage_key
+)
+from app.utils.logger import get_logger
+from app.utils.storage import get_storage
+
+logger = get_logger(__name__)
+
+# Longest edge in pixels of each generated variant
+THUMBNAIL_SIZES = {
+    "small": 160,
+    "medium": 480,
+    "large": 1280,
+}
+# Image types Pillow can't rasterize
+_SKIPPED_EXTENSIONS = {'.svg'}
+
+_pool: Optional[ProcessPoolExecutor] = None
+# sha256 -> running job, so concurrent uploads of the same image share one job
+_jobs: Dict[str, asyncio.Task] = {}
+
+
+def thumbnails_enabled() -> bool:
+    return image_variants.Image is not None and settings.THUMBNAIL_WORKERS > 0
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=settings.THUMBNAIL_WORKERS)
+    return _pool
+
+
+def shutdown_thumbnail_pool() -> None:
+    """Stop the worker processes; call on application shutdown."""
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+async def run_in_image_pool(func, *args):
+    """
+    Run an image_variants function in the process pool and await its result.
+
+    Raises:
+        BrokenProcessPool: If a worker died (e.g. killed out of memory on a huge image);
+            the pool is replaced, so later calls run in fresh workers
+    """
+    global _pool
+    pool = _get_pool()
+    try:
+        return await asyncio.get_running_loop().run_in_executor(pool, func, *args)
+    except BrokenProcessPool:
+        # A broken pool refuses all further work; the next call starts a new one
+        if _pool is pool:
+            _pool = None
+            pool.shutdown(wait=False, cancel_futures=True)
+        raise
+
+
+def _media_from_result(relative_url: str, result: dict) -> Tuple[dict, str]:
+    """Turn a generate_variants result into (media_variants, placeholder)."""
+    base_url = relative_url.rsplit("/", 1)[0]
+    variants = {
+        name: {"url": f"{base_url}/{info['filename']}", "width": info["width"], "height": info["height"]}
+        for name, info in result["variants"].items()
+    }
+    variants["original"] = {"url": relative_url, "width": result["width"], "height": result["height"]}
+    return variants, result["placeholder"]
+
+
+def _save_media(sha256: str, relative_url: str, variants: dict, placeholder: str) -> None:
+    """Store variants on the blob and on messages created before they were ready."""
+    db = SessionLocal()
+    try:
+        db.execute(
+            update(AttachmentBlob)
+            .where(AttachmentBlob.sha256 == sha256)
+            .values(variants=variants, placeholder=placeholder)
+        )
+        db.execute(
+            update(Message)
+            .where(Message.media_url == relative_url, Message.media_variants.is_(None))
+            .values(media_variants=variants, media_placeholder=placeholder)
+        )
+        db.commit()
+    finally:
+        db.close()
+
+
+def _prepare_job(relative_url: str, work_dir: Path) -> Optional[Path]:
+    """Make the original available as a local file; returns None if it's gone."""
+    storage = get_storage()
+    work_dir.mkdir(parents=True)
+    key = locate_storage_key(relative_url)
+    local_path = storage.local_path(key)
+    if local_path is not None:
+        return local_path if local_path.is_file() else None
+    if not storage.exists(key):
+        return None
+    source = work_dir / Path(key).name
+    storage.fetch_to(key, source)
+    return source
+
+
+def _store_variants(relative_url: str, work_dir: Path, result: dict) -> None:
+    """Put the generated variant files next to the original in storage."""
+    storage = get_storage()
+    base_url = relative_url.rsplit("/", 1)[0]
+    for info in result["variants"].values():
+        key = storage_key(f"{base_url}/{info['filename']}")
+        storage.put_file(work_dir / info["filename"], key, guess_content_type(info["filename"]))
+
+
+async def _run_job(sha256: str, relative_url: str) -> Optional[Tuple[dict, str]]:
+    work_dir = UPLOAD_TMP_DIR / f"thumbnails-{uuid.uuid4()}"
+    try:
+        source = await run_in_threadpool(_prepare_job, relative_url, work_dir)
+        if source is None:
+            return None
+        result = await run_in_image_pool(
+            image_variants.generate_variants, str(source), str(work_dir), Path(relative_url).stem, THUMBNAIL_SIZES
+        )
+        if result is None:
+            return None
+        await run_in_threadpool(_store_variants, relative_url, work_dir, result)
+        variants, placeholder = _media_from_result(relative_url, result)
+        await run_in_threadpool(_save_media, sha256, relative_url, variants, placeholder)
+    except Exception:
+        # The upload itself is already stored; it just has no variants
+        logger.exception("Thumbnail generation failed for %s", relative_url)
+        return None
+    finally:
+        await run_in_threadpool(shutil.rmtree, work_dir, True)
+    return variants, placeholder
+
+
+async def generate_thumbnails(sha256: str, relative_url: str) -> Optional[Tuple[dict, str]]:
+    """
+    Start generating variants for an uploaded image.
+
+    Waits up to THUMBNAIL_WAIT_SECONDS so the upload response can usually include
+    the variants; otherwise the job finishes in the background and its result is
+    stored on the blob and on any messages already sent with it.
+
+    Returns:
+        Tuple of (media_variants, placeholder), or None if not an image, disabled
+        or still running
+    """
+    if not thumbnails_enabled() or get_file_category(relative_url) != 'image':
+        return None
+    if Path(relative_url).suffix.lower() in _SKIPPED_EXTENSIONS:
+        return None
+
+    job = _jobs.get(sha256)
+    if job is None:
+        job = asyncio.ensure_future(_run_job(sha256, relative_url))
+        _jobs[sha256] = job
+        job.add_done_callback(lambda _: _jobs.pop(sha256, None))
+
+    try:
+        return await asyncio.wait_for(asyncio.shield(job), timeout=settings.THUMBNAIL_WAIT_SECONDS)
+    except asyncio.TimeoutError:
+        return None
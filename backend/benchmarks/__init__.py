@@ -0,0 +1,10 @@
+"""
+Benchmarks for the chat backend.
+
+Run from the backend directory so the ``app`` package is importable, e.g.:
+
+    python -m benchmarks.bench_social_graph --contacts 5000
+
+Benchmarks that need a database use DATABASE_URL from the environment/.env,
+the same as the app. Point it at a disposable local Postgres.
+"""
@@ -0,0 +1,114 @@
+"""
+Compare file serving through GET /api/uploads/file/... with the /uploads StaticFiles mount.
+
+Writes a --size-mb test file into uploads/attachments/files (removed afterwards)
+and has --concurrency clients fetch it --requests times per case on a running
+server: full downloads, 1 MB ranges at random offsets (video seeking) and
+conditional requests that should be answered with 304.
+
+    uvicorn main:app --port 8000   # in another shell, from the same backend/ directory
+    python -m benchmarks.bench_file_serving --base-url http://127.0.0.1:8000 --size-mb 50
+"""
+import argparse
+import asyncio
+import os
+import random
+import time
+import uuid
+
+import httpx
+
+from app.utils.file_upload import ATTACHMENT_SUBDIRS
+from benchmarks.common import summarize, print_table
+
+RANGE_SIZE = 1024 * 1024
+
+
+async def fetch(client: httpx.AsyncClient, url: str, headers: dict, expected_status: int) -> tuple:
+    started = time.perf_counter()
+    received = 0
+    async with client.stream("GET", url, headers=headers) as response:
+        if response.status_code != expected_status:
+            raise RuntimeError(f"{url}: expected {expected_status}, got {response.status_code}")
+        async for chunk in response.aiter_raw():
+            received += len(chunk)
+    return (time.perf_counter() - started) * 1000, received
+
+
+async def run_case(client, url, make_headers, expected_status, requests, concurrency):
+    """Fetch url `requests` times with `concurrency` workers; returns (latency summary, MB/s)."""
+    samples = []
+    total_bytes = 0
+    queue = list(range(requests))
+
+    async def worker():
+        nonlocal total_bytes
+        while queue:
+            queue.pop()
+            elapsed, received = await fetch(client, url, make_headers(), expected_status)
+            samples.append(elapsed)
+            total_bytes += received
+
+    started = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    wall = time.perf_counter() - started
+    return summarize(samples), total_bytes / (1024 * 1024) / wall
+
+
+async def run(args):
+    name = f"bench_{uuid.uuid4().hex}.bin"
+    path = ATTACHMENT_SUBDIRS["files"] / name
+    size = args.size_mb * 1024 * 1024
+    with path.open("wb") as target:
+        for _ in range(args.size_mb):
+            target.write(os.urandom(1024 * 1024))
+
+    endpoints = {
+        "static": f"{args.base_url}/uploads/attachments/files/{name}",
+        "get_file": f"{args.base_url}/api/uploads/file/uploads/attachments/files/{name}",
+    }
+    rows = {}
+    throughput = {}
+    try:
+        async with httpx.AsyncClient(timeout=None) as client:
+            for label, url in endpoints.items():
+                probe = await client.head(url)
+                probe.raise_for_status()
+                if probe.headers.get("etag"):
+                    validators = {"If-None-Match": probe.headers["etag"]}
+                else:
+                    validators = {"If-Modified-Since": probe.headers["last-modified"]}
+
+                def random_range():
+                    start = random.randrange(0, max(1, size - RANGE_SIZE))
+                    return {"Range": f"bytes={start}-{start + RANGE_SIZE - 1}"}
+
+                cases = {
+                    "full": (lambda: {}, 200, args.requests),
+                    "range 1MB": (random_range, 206, args.requests * 10),
+                    "conditional": (lambda: dict(validators), 304, args.requests * 10),
+                }
+                for case, (make_headers, status, count) in cases.items():
+                    stats, mb_per_s = await run_case(client, url, make_headers, status, count, args.concurrency)
+                    rows[f"{label} {case}"] = stats
+                    throughput[f"{label} {case}"] = mb_per_s
+    finally:
+        path.unlink(missing_ok=True)
+
+    print_table(f"File serving ({args.size_mb} MB file, {args.concurrency} clients, latency in ms)", rows)
+    print("\nThroughput (MB/s of response bodies):")
+    for case, mb_per_s in throughput.items():
+        print(f"  {case:<34}{mb_per_s:>10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--size-mb", type=int, default=50, help="size of the served file")
+    parser.add_argument("--requests", type=int, default=50, help="full downloads per endpoint (ranged and conditional cases use 10x)")
+    parser.add_argument("--concurrency", type=int, default=8, help="concurrent clients")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,417 @@
+"""
+End-to-end load test: simulated clients against a running server and its Postgres.
+
+Seeds users and conversations into the database from DATABASE_URL, then every
+user logs in through POST /api/auth/login, gets a connect ticket from
+POST /api/auth/ws-ticket (again on every reconnect), opens /api/ws/{user_id}, joins the
+rooms of its conversations and keeps reading. Senders post messages through
+POST /api/messages/ (preceded by typing indicators) at --rate per second each,
+and recipients answer every message with a delivery receipt and some with read
+receipts, as the web client does.
+
+Reports send->receive fan-out latency (from the start of the POST to the message
+arriving on a recipient's socket), messages and deliveries per second, POST and
+login latency, connection counts and the server's CPU and RSS, and saves them
+as JSON (see benchmarks.common.save_results). Seeded rows are removed afterwards.
+
+Scenarios:
+    direct     --pairs 1:1 conversations, both sides sending
+    group      --groups conversations of --group-size members, --senders of them sending
+    reconnect  direct chats while --storm-fraction of clients drop and reconnect
+               at once every --storm-every seconds
+
+    python -m benchmarks.bench_load --launch --scenario direct --pairs 100 --duration 30
+    python -m benchmarks.bench_load --launch --scenario group --group-size 500 --senders 5
+    python -m benchmarks.bench_load --base-url http://127.0.0.1:8000 --server-pid 12345 --scenario reconnect
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import httpx
+import psutil
+import websockets
+from sqlalchemy import delete, insert
+
+from app.core.auth import get_password_hash
+from app.db.session import SessionLocal
+from app.models.conversation import Conversation
+from app.models.message import Message
+from app.models.user import User
+from benchmarks.common import bench_username, print_table, save_results, summarize
+
+PASSWORD = "benchPassw0rd"
+
+SCENARIOS = {
+    "direct": {},
+    "group": {},
+    "reconnect": {"storm_every": 10.0, "storm_fraction": 0.5},
+}
+
+
+class Stats:
+    """Counters and samples shared by every simulated client."""
+
+    def __init__(self):
+        self.sent_at: Dict[str, float] = {}
+        self.recipients: Dict[str, int] = {}
+        self.fanout_ms: List[float] = []
+        self.post_ms: List[float] = []
+        self.login_ms: List[float] = []
+        self.connect_ms: List[float] = []
+        self.reconnect_ms: List[float] = []
+        self.sent = 0
+        self.send_errors = 0
+        self.delivered = 0
+        self.expected_deliveries = 0
+        self.connected = 0
+        self.peak_connected = 0
+        self.connect_errors = 0
+        self.reconnects = 0
+
+    def on_connect(self, elapsed_ms: float, reconnect: bool) -> None:
+        self.connected += 1
+        self.peak_connected = max(self.peak_connected, self.connected)
+        (self.reconnect_ms if reconnect else self.connect_ms).append(elapsed_ms)
+        if reconnect:
+            self.reconnects += 1
+
+
+class SimulatedClient:
+    """One user: a logged-in HTTP identity and a WebSocket that stays joined to its rooms."""
+
+    def __init__(self, user_id: str, email: str, conversations: List[str], args, stats: Stats):
+        self.user_id = user_id
+        self.email = email
+        self.conversations = conversations
+        self.args = args
+        self.stats = stats
+        self.token: Optional[str] = None
+        self.http: Optional[httpx.AsyncClient] = None
+        self.ws = None
+        self.reader: Optional[asyncio.Task] = None
+
+    async def login(self, client: httpx.AsyncClient) -> None:
+        started = time.perf_counter()
+        response = await client.post(
+            f"{self.args.base_url}/api/auth/login", json={"email": self.email, "password": PASSWORD}
+        )
+        response.raise_for_status()
+        self.stats.login_ms.append((time.perf_counter() - started) * 1000)
+        self.token = response.json()["access_token"]
+        self.http = client
+
+    async def connect(self, reconnect: bool = False) -> None:
+        ws_url = self.args.base_url.replace("http", "ws", 1)
+        started = time.perf_counter()
+        try:
+            response = await self.http.post(
+                f"{self.args.base_url}/api/auth/ws-ticket", headers={"Authorization": f"Bearer {self.token}"}
+            )
+            response.raise_for_status()
+            ticket = response.json()["ticket"]
+            self.ws = await websockets.connect(f"{ws_url}/api/ws/{self.user_id}?ticket={ticket}", max_size=None)
+            for conversation_id in self.conversations:
+                await self.ws.send(json.dumps({"type": "join_room", "room_id": conversation_id}))
+            if self.conversations and random.random() < self.args.active_ratio:
+                await self.ws.send(json.dumps({
+                    "type": "set_active_conversation", "conversation_id": self.conversations[0]
+                }))
+        except (OSError, httpx.HTTPError, websockets.WebSocketException):
+            self.stats.connect_errors += 1
+            self.ws = None
+            return
+        self.stats.on_connect((time.perf_counter() - started) * 1000, reconnect)
+        self.reader = asyncio.create_task(self.read())
+
+    async def disconnect(self) -> None:
+        if self.ws is None:
+            return
+        ws, self.ws = self.ws, None
+        self.stats.connected -= 1
+        await ws.close()
+        if self.reader is not None:
+            self.reader.cancel()
+
+    async def read(self) -> None:
+        ws = self.ws
+        try:
+            async for raw in ws:
+                data = json.loads(raw)
+                if data.get("type") != "message":
+                    continue
+                received = time.perf_counter()
+                sent_at = self.stats.sent_at.get(data.get("text"))
+                if sent_at is not None:
+                    self.stats.fanout_ms.append((received - sent_at) * 1000)
+                    self.stats.delivered += 1
+                if self.args.receipts:
+                    await ws.send(json.dumps({"type": "delivery_receipt", "message_id": data["id"]}))
+                    if random.random() < self.args.read_ratio:
+                        await ws.send(json.dumps({"type": "read_receipt", "message_id": data["id"]}))
+        except websockets.ConnectionClosed:
+            pass
+
+    async def send_loop(self, client: httpx.AsyncClient, recipients: Dict[str, int], stop_at: float) -> None:
+        headers = {"Authorization": f"Bearer {self.token}"}
+        while time.monotonic() < stop_at:
+            await asyncio.sleep(random.expovariate(self.args.rate))
+            conversation_id = random.choice(self.conversations)
+            if self.ws is not None and random.random() < self.args.typing_ratio:
+                try:
+                    await self.ws.send(json.dumps({
+                        "type": "typing", "conversation_id": conversation_id, "is_typing": True
+                    }))
+                except websockets.ConnectionClosed:
+                    pass
+            text = f"load {uuid.uuid4().hex} " + "x" * self.args.text_length
+            started = time.perf_counter()
+            self.stats.sent_at[text] = started
+            self.stats.expected_deliveries += recipients[conversation_id]
+            try:
+                response = await client.post(
+                    f"{self.args.base_url}/api/messages/",
+                    headers=headers,
+                    json={"conversation_id": conversation_id, "message_type": "text", "text": text}
+                )
+                response.raise_for_status()
+            except httpx.HTTPError:
+                self.stats.send_errors += 1
+                continue
+            self.stats.post_ms.append((time.perf_counter() - started) * 1000)
+            self.stats.sent += 1
+
+
+def seed(db, args):
+    """Create users and conversations for the scenario; returns (users, conversations, senders)."""
+    password_hash = get_password_hash(PASSWORD)
+    users, conversations, senders = [], [], []
+
+    def new_user() -> dict:
+        username = bench_username("load")
+        user = {"id": uuid.uuid4(), "username": username, "email": f"{username}@bench.example.com",
+                "password_hash": password_hash, "display_name": "Load Test", "discoverable": False}
+        users.append(user)
+        return user
+
+    if args.scenario == "group":
+        for _ in range(args.groups):
+            members = [new_user() for _ in range(args.group_size)]
+            conversations.append({"id": uuid.uuid4(), "type": "group", "title": "Load test group",
+                                  "members": [member["id"] for member in members], "admins": [members[0]["id"]]})
+            senders.extend(members[:args.senders])
+    else:
+        for _ in range(args.pairs):
+            pair = [new_user(), new_user()]
+            conversations.append({"id": uuid.uuid4(), "type": "direct", "members": [user["id"] for user in pair]})
+            senders.extend(pair)
+
+    db.execute(insert(User), users)
+    db.execute(insert(Conversation), conversations)
+    db.commit()
+    return users, conversations, senders
+
+
+def cleanup(db, users, conversations) -> None:
+    conversation_ids = [conversation["id"] for conversation in conversations]
+    db.execute(delete(Message).where(Message.conversation_id.in_(conversation_ids)))
+    db.execute(delete(Conversation).where(Conversation.id.in_(conversation_ids)))
+    db.execute(delete(User).where(User.id.in_([user["id"] for user in users])))
+    db.commit()
+
+
+def launch_server(port: int) -> subprocess.Popen:
+    """Start uvicorn main:app from the backend directory."""
+    backend_dir = Path(__file__).resolve().parent.parent
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=backend_dir, env=os.environ.copy()
+    )
+
+
+async def wait_for_server(client: httpx.AsyncClient, base_url: str, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            response = await client.get(f"{base_url}/api/health")
+            if response.status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"Server at {base_url} did not become healthy within {timeout:.0f}s")
+        await asyncio.sleep(0.25)
+
+
+async def sample_resources(pid: int, samples: List[dict], stop: asyncio.Event) -> None:
+    """Sample the server process's CPU (percent of one core) and RSS once a second."""
+    process = psutil.Process(pid)
+    process.cpu_percent(None)
+    while not stop.is_set():
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=1.0)
+        except asyncio.TimeoutError:
+            pass
+        try:
+            samples.append({"cpu_percent": process.cpu_percent(None), "rss_mb": process.memory_info().rss / 2 ** 20})
+        except psutil.Error:
+            return
+
+
+async def reconnect_storms(clients: List[SimulatedClient], args, stop_at: float) -> None:
+    """Every storm_every seconds, drop storm_fraction of the clients at once and reconnect them."""
+    while time.monotonic() + args.storm_every < stop_at:
+        await asyncio.sleep(args.storm_every)
+        victims = random.sample(clients, max(1, int(len(clients) * args.storm_fraction)))
+        await asyncio.gather(*[client.disconnect() for client in victims])
+        await asyncio.gather(*[client.connect(reconnect=True) for client in victims])
+
+
+async def run(args, users, conversations, senders) -> dict:
+    stats = Stats()
+    members_of: Dict[str, List[str]] = {}
+    for conversation in conversations:
+        for member_id in conversation["members"]:
+            members_of.setdefault(str(member_id), []).append(str(conversation["id"]))
+    recipients = {str(conversation["id"]): len(conversation["members"]) - 1 for conversation in conversations}
+    clients = [SimulatedClient(str(user["id"]), user["email"], members_of[str(user["id"])], args, stats) for user in users]
+    by_id = {client.user_id: client for client in clients}
+
+    limits = httpx.Limits(max_connections=args.http_concurrency, max_keepalive_connections=args.http_concurrency)
+    async with httpx.AsyncClient(timeout=60, limits=limits) as client:
+        await wait_for_server(client, args.base_url)
+
+        gate = asyncio.Semaphore(args.login_concurrency)
+
+        async def login_and_connect(simulated: SimulatedClient):
+            async with gate:
+                await simulated.login(client)
+                await simulated.connect()
+
+        setup_started = time.perf_counter()
+        await asyncio.gather(*[login_and_connect(simulated) for simulated in clients])
+        setup_seconds = time.perf_counter() - setup_started
+
+        resource_samples: List[dict] = []
+        stop = asyncio.Event()
+        sampler = asyncio.create_task(sample_resources(args.server_pid, resource_samples, stop)) if args.server_pid else None
+
+        stop_at = time.monotonic() + args.duration
+        started = time.perf_counter()
+        tasks = [by_id[str(sender["id"])].send_loop(client, recipients, stop_at) for sender in senders]
+        if args.storm_every:
+            tasks.append(reconnect_storms(clients, args, stop_at))
+        await asyncio.gather(*tasks)
+        # Let in-flight broadcasts arrive
+        await asyncio.sleep(args.drain)
+        elapsed = time.perf_counter() - started
+
+        stop.set()
+        if sampler:
+            await sampler
+        await asyncio.gather(*[simulated.disconnect() for simulated in clients])
+
+    results = {
+        "fanout_latency": summarize(stats.fanout_ms),
+        "post_latency": summarize(stats.post_ms),
+        "login_latency": summarize(stats.login_ms),
+        "connect_latency": summarize(stats.connect_ms),
+        "reconnect_latency": summarize(stats.reconnect_ms),
+        "messages_sent": stats.sent,
+        "send_errors": stats.send_errors,
+        "messages_per_second": round(stats.sent / elapsed, 2),
+        "deliveries": stats.delivered,
+        "deliveries_per_second": round(stats.delivered / elapsed, 2),
+        "delivery_ratio": round(stats.delivered / stats.expected_deliveries, 4) if stats.expected_deliveries else None,
+        "connections": len(clients),
+        "peak_connected": stats.peak_connected,
+        "connect_errors": stats.connect_errors,
+        "reconnects": stats.reconnects,
+        "setup_seconds": round(setup_seconds, 2),
+    }
+    if resource_samples:
+        cpu = [sample["cpu_percent"] for sample in resource_samples]
+        rss = [sample["rss_mb"] for sample in resource_samples]
+        results["server_cpu_percent"] = {"mean": round(sum(cpu) / len(cpu), 1), "max": round(max(cpu), 1)}
+        results["server_rss_mb"] = {"mean": round(sum(rss) / len(rss), 1), "max": round(max(rss), 1)}
+    return results
+
+
+def print_results(args, results: dict) -> None:
+    print_table(f"Load test: {args.scenario} (latency in ms)", {
+        "send -> receive (fan-out)": results["fanout_latency"],
+        "POST /api/messages/": results["post_latency"],
+        "login": results["login_latency"],
+        "WebSocket connect + join": results["connect_latency"],
+        "reconnect + join": results["reconnect_latency"],
+    })
+    print(f"\nmessages/s {results['messages_per_second']}  deliveries/s {results['deliveries_per_second']}  "
+          f"delivery ratio {results['delivery_ratio']}  send errors {results['send_errors']}")
+    print(f"connections {results['connections']} (peak {results['peak_connected']}, "
+          f"errors {results['connect_errors']}, reconnects {results['reconnects']})")
+    if "server_cpu_percent" in results:
+        print(f"server CPU {results['server_cpu_percent']['mean']}% mean / {results['server_cpu_percent']['max']}% max, "
+              f"RSS {results['server_rss_mb']['mean']} MB mean / {results['server_rss_mb']['max']} MB max")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenario", choices=sorted(SCENARIOS), default="direct")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--launch", action="store_true", help="start uvicorn main:app on --base-url's port for the run")
+    parser.add_argument("--server-pid", type=int, default=None, help="sample CPU/RSS of this server process")
+    parser.add_argument("--pairs", type=int, default=50, help="direct/reconnect: 1:1 conversations")
+    parser.add_argument("--groups", type=int, default=1, help="group: number of group conversations")
+    parser.add_argument("--group-size", type=int, default=500, help="group: members per group")
+    parser.add_argument("--senders", type=int, default=5, help="group: members of each group that send")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds of sending")
+    parser.add_argument("--rate", type=float, default=0.5, help="messages per second per sender (Poisson)")
+    parser.add_argument("--text-length", type=int, default=40, help="padding characters per message")
+    parser.add_argument("--typing-ratio", type=float, default=0.5, help="fraction of sends preceded by a typing event")
+    parser.add_argument("--active-ratio", type=float, default=0.5, help="fraction of clients viewing a conversation")
+    parser.add_argument("--no-receipts", dest="receipts", action="store_false", help="don't send delivery/read receipts")
+    parser.add_argument("--read-ratio", type=float, default=0.3, help="fraction of received messages marked read")
+    parser.add_argument("--storm-every", type=float, default=None, help="seconds between reconnect storms")
+    parser.add_argument("--storm-fraction", type=float, default=None, help="fraction of clients dropped per storm")
+    parser.add_argument("--login-concurrency", type=int, default=20, help="concurrent logins during setup")
+    parser.add_argument("--http-concurrency", type=int, default=100, help="HTTP connection pool size")
+    parser.add_argument("--drain", type=float, default=2.0, help="seconds to wait for in-flight messages at the end")
+    parser.add_argument("--output", type=Path, default=None, help="results JSON (default benchmarks/results/...)")
+    args = parser.parse_args()
+    for name, value in SCENARIOS[args.scenario].items():
+        if getattr(args, name) is None:
+            setattr(args, name, value)
+    args.storm_fraction = args.storm_fraction or 0.5
+
+    server = None
+    if args.launch:
+        server = launch_server(httpx.URL(args.base_url).port or 8000)
+        args.server_pid = server.pid
+
+    db = SessionLocal()
+    users, conversations, senders = seed(db, args)
+    try:
+        results = asyncio.run(run(args, users, conversations, senders))
+    finally:
+        cleanup(db, users, conversations)
+        db.close()
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=10)
+
+    print_results(args, results)
+    config = {key: value for key, value in vars(args).items() if key not in ("output", "server_pid", "launch", "base_url")}
+    path = save_results(f"load-{args.scenario}", config, results, args.output)
+    print(f"\nResults saved to {path}")
+
+
+if __name__ == "__main__":
+    main()
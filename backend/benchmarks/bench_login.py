@@ -0,0 +1,175 @@
+"""
+Login throughput and WebSocket latency during a login storm.
+
+Seeds --users users into the database from DATABASE_URL (one bcrypt hash shared
+by all, at the server's BCRYPT_ROUNDS), connects a probe WebSocket (with a
+connect ticket) and measures the round trip of set_active_conversation, which
+the server answers straight from the event loop. The probe runs first with the
+server idle, then while --concurrency clients log in as fast as they can
+through POST /api/auth/login for --duration seconds.
+
+If bcrypt ran on the event loop, every login would freeze the probe for the
+length of a hash; with hashing in the password pool the probe should stay close
+to its idle latency while logins are limited by PASSWORD_HASH_WORKERS. Logins
+refused with 503 (pool queue full) are counted separately.
+
+Reports logins per second, login latency, the 503 count and probe round trips,
+and saves them as JSON (see benchmarks.common.save_results). Seeded users are
+removed afterwards.
+
+    uvicorn main:app --port 8000   # in another shell, same DATABASE_URL
+    python -m benchmarks.bench_login --users 200 --concurrency 50 --duration 20
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+from pathlib import Path
+from typing import List
+
+import httpx
+import websockets
+from sqlalchemy import delete, insert
+
+from app.core.auth import get_password_hash
+from app.db.session import SessionLocal
+from app.models.user import User
+from benchmarks.common import bench_username, print_table, save_results, summarize
+
+PASSWORD = "benchPassw0rd"
+
+
+def seed(db, count: int) -> List[dict]:
+    password_hash = get_password_hash(PASSWORD)
+    users = []
+    for _ in range(count):
+        username = bench_username("login")
+        users.append({"id": uuid.uuid4(), "username": username, "email": f"{username}@bench.example.com",
+                      "password_hash": password_hash, "display_name": "Login Test", "discoverable": False})
+    db.execute(insert(User), users)
+    db.commit()
+    return users
+
+
+def cleanup(db, users: List[dict]) -> None:
+    db.execute(delete(User).where(User.id.in_([user["id"] for user in users])))
+    db.commit()
+
+
+async def probe(ws, interval: float, stop: asyncio.Event) -> List[float]:
+    """Round trips (ms) of a message the server answers without touching the database."""
+    samples = []
+    conversation_id = str(uuid.uuid4())
+    while not stop.is_set():
+        started = time.perf_counter()
+        await ws.send(json.dumps({"type": "set_active_conversation", "conversation_id": conversation_id}))
+        while json.loads(await ws.recv()).get("type") != "active_conversation_set":
+            pass
+        samples.append((time.perf_counter() - started) * 1000)
+        await asyncio.sleep(interval)
+    return samples
+
+
+async def login_worker(client: httpx.AsyncClient, base_url: str, users: List[dict], stop_at: float, results: dict):
+    while time.monotonic() < stop_at:
+        user = random.choice(users)
+        started = time.perf_counter()
+        try:
+            response = await client.post(
+                f"{base_url}/api/auth/login", json={"email": user["email"], "password": PASSWORD}
+            )
+        except httpx.HTTPError:
+            results["errors"] += 1
+            continue
+        elapsed = (time.perf_counter() - started) * 1000
+        if response.status_code == 200:
+            results["login_ms"].append(elapsed)
+        elif response.status_code == 503:
+            results["rejected"] += 1
+            await asyncio.sleep(float(response.headers.get("Retry-After", "1")))
+        else:
+            results["errors"] += 1
+
+
+async def open_probe_socket(client: httpx.AsyncClient, base_url: str, user: dict):
+    """Log in as user and open its WebSocket with a connect ticket."""
+    response = await client.post(f"{base_url}/api/auth/login", json={"email": user["email"], "password": PASSWORD})
+    response.raise_for_status()
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+    response = await client.post(f"{base_url}/api/auth/ws-ticket", headers=headers)
+    response.raise_for_status()
+    ws_url = base_url.replace("http", "ws", 1)
+    return await websockets.connect(f"{ws_url}/api/ws/{user['id']}?ticket={response.json()['ticket']}")
+
+
+async def run(args, users: List[dict]) -> dict:
+    results = {"login_ms": [], "rejected": 0, "errors": 0}
+    limits = httpx.Limits(max_connections=args.concurrency + 5)
+    async with httpx.AsyncClient(timeout=60, limits=limits) as client:
+        ws = await open_probe_socket(client, args.base_url, users[0])
+        try:
+            stop = asyncio.Event()
+            idle_probe = asyncio.create_task(probe(ws, args.probe_interval, stop))
+            await asyncio.sleep(args.idle_seconds)
+            stop.set()
+            idle_samples = await idle_probe
+
+            stop = asyncio.Event()
+            busy_probe = asyncio.create_task(probe(ws, args.probe_interval, stop))
+            started = time.monotonic()
+            stop_at = started + args.duration
+            await asyncio.gather(*[
+                login_worker(client, args.base_url, users, stop_at, results) for _ in range(args.concurrency)
+            ])
+            elapsed = time.monotonic() - started
+            stop.set()
+            busy_samples = await busy_probe
+        finally:
+            await ws.close()
+
+    return {
+        "logins": len(results["login_ms"]),
+        "logins_per_second": round(len(results["login_ms"]) / elapsed, 2),
+        "rejected_503": results["rejected"],
+        "errors": results["errors"],
+        "login": summarize(results["login_ms"]),
+        "ws_round_trip_idle": summarize(idle_samples),
+        "ws_round_trip_during_logins": summarize(busy_samples),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--users", type=int, default=100, help="seeded users to log in as")
+    parser.add_argument("--concurrency", type=int, default=50, help="clients logging in at once")
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds of logins")
+    parser.add_argument("--probe-interval", type=float, default=0.01, help="seconds between WebSocket probes")
+    parser.add_argument("--idle-seconds", type=float, default=3.0, help="baseline probing before logins start")
+    parser.add_argument("--output", type=Path, default=None, help="results JSON (default benchmarks/results/...)")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    users = seed(db, args.users)
+    try:
+        results = asyncio.run(run(args, users))
+    finally:
+        cleanup(db, users)
+        db.close()
+
+    print(f"\n{results['logins']} logins, {results['logins_per_second']}/s, "
+          f"{results['rejected_503']} refused with 503, {results['errors']} errors")
+    print_table("Login latency (ms)", {"POST /api/auth/login": results["login"]})
+    print_table("WebSocket round trip (ms) - reflects server event-loop lag", {
+        "idle": results["ws_round_trip_idle"],
+        f"during {args.concurrency} concurrent logins": results["ws_round_trip_during_logins"],
+    })
+    config = {key: value for key, value in vars(args).items() if key not in ("output", "base_url")}
+    path = save_results("login", config, results, args.output)
+    print(f"\nResults saved to {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+Benchmark get_friends and create_friend_request for a user with many contacts.
+
+Seeds a user with --contacts accepted friends (default 5000) into the database
+from DATABASE_URL, then times the route handlers directly with the social-graph
+cache cold (dropped before every call) and warm, counting SQL statements per call.
+Seeded rows are removed afterwards.
+
+    python -m benchmarks.bench_social_graph --contacts 5000 --iterations 200
+"""
+import argparse
+import asyncio
+import time
+import uuid
+from datetime import datetime
+
+from sqlalchemy import event, insert, delete, or_
+
+from app.db.session import SessionLocal, engine
+from app.models.user import User
+from app.models.contact import Contact
+from app.models.friend_request import FriendRequest
+from app.core.social_graph import social_graph_cache
+from app.routes.friends import get_friends, create_friend_request
+from benchmarks.common import summarize, print_table, bench_username
+
+statement_count = 0
+
+
+@event.listens_for(engine, "before_cursor_execute")
+def _count_statements(conn, cursor, statement, parameters, context, executemany):
+    global statement_count
+    statement_count += 1
+
+
+def seed(db, contacts: int, targets: int):
+    """Create the benchmark user, its friends and users to send friend requests to."""
+    now = datetime.utcnow()
+    owner_id = uuid.uuid4()
+    friend_ids = [uuid.uuid4() for _ in range(contacts)]
+    target_ids = [uuid.uuid4() for _ in range(targets)]
+    users = [{"id": owner_id, "username": bench_username("bench_owner"), "display_name": "Bench Owner", "discoverable": True}]
+    users += [{"id": uid, "username": bench_username("bench_friend"), "display_name": "Bench Friend", "discoverable": True} for uid in friend_ids]
+    users += [{"id": uid, "username": bench_username("bench_target"), "display_name": "Bench Target", "discoverable": True} for uid in target_ids]
+    db.execute(insert(User), users)
+    contact_rows = []
+    for friend_id in friend_ids:
+        contact_rows.append({"owner_id": owner_id, "peer_id": friend_id, "status": "accepted", "created_at": now})
+        contact_rows.append({"owner_id": friend_id, "peer_id": owner_id, "status": "accepted", "created_at": now})
+    db.execute(insert(Contact), contact_rows)
+    db.commit()
+    return owner_id, friend_ids, target_ids
+
+
+def cleanup(db, user_ids):
+    db.execute(delete(FriendRequest).where(or_(FriendRequest.sender_id.in_(user_ids), FriendRequest.receiver_id.in_(user_ids))))
+    db.execute(delete(Contact).where(or_(Contact.owner_id.in_(user_ids), Contact.peer_id.in_(user_ids))))
+    db.execute(delete(User).where(User.id.in_(user_ids)))
+    db.commit()
+
+
+def run_case(loop, iterations: int, make_call, before_each=None):
+    """Time an async handler call; returns (latency summary, mean statements per call)."""
+    global statement_count
+    samples = []
+    statements = 0
+    for i in range(iterations):
+        if before_each:
+            before_each()
+        statement_count = 0
+        started = time.perf_counter()
+        loop.run_until_complete(make_call(i))
+        samples.append((time.perf_counter() - started) * 1000)
+        statements += statement_count
+    stats = summarize(samples)
+    stats["statements"] = round(statements / iterations, 1)
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--contacts", type=int, default=5000, help="accepted friends of the benchmark user")
+    parser.add_argument("--iterations", type=int, default=200, help="calls per case")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    loop = asyncio.new_event_loop()
+    owner_id, friend_ids, target_ids = seed(db, args.contacts, args.iterations * 2)
+    try:
+        owner = db.query(User).filter(User.id == owner_id).one()
+        rows = {}
+
+        rows["get_friends (cold)"] = run_case(
+            loop, args.iterations,
+            lambda i: get_friends(db=db, current_user=owner),
+            before_each=social_graph_cache.clear
+        )
+        rows["get_friends (warm)"] = run_case(
+            loop, args.iterations,
+            lambda i: get_friends(db=db, current_user=owner)
+        )
+        rows["create_friend_request (cold)"] = run_case(
+            loop, args.iterations,
+            lambda i: create_friend_request(receiver_id=target_ids[i], db=db, current_user=owner),
+            before_each=social_graph_cache.clear
+        )
+        rows["create_friend_request (warm)"] = run_case(
+            loop, args.iterations,
+            lambda i: create_friend_request(receiver_id=target_ids[args.iterations + i], db=db, current_user=owner)
+        )
+
+        print_table(f"Social graph benchmark ({args.contacts} contacts, latency in ms)", rows)
+        print("\nSQL statements per call:")
+        for name, stats in rows.items():
+            print(f"  {name:<34}{stats['statements']:>6}")
+    finally:
+        cleanup(db, [owner_id] + friend_ids + target_ids)
+        db.close()
+        loop.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Measure event-loop lag on a running server while large files are uploaded.
+
+Probes GET /api/health every --probe-interval seconds, first with the server idle
+and then while --concurrency clients each upload a --size-mb file to
+/api/uploads/upload. Because the server handles the probe on the same event loop
+as the uploads, probe latency during uploads shows how long the loop was blocked.
+
+    uvicorn main:app --port 8000   # in another shell
+    python -m benchmarks.bench_upload_loop_lag --base-url http://127.0.0.1:8000 --size-mb 200 --concurrency 4
+"""
+import argparse
+import asyncio
+import os
+import time
+
+import httpx
+
+from benchmarks.common import summarize, print_table, register_bench_user
+
+
+async def probe(client: httpx.AsyncClient, base_url: str, interval: float, stop: asyncio.Event):
+    samples = []
+    while not stop.is_set():
+        started = time.perf_counter()
+        response = await client.get(f"{base_url}/api/health")
+        response.raise_for_status()
+        samples.append((time.perf_counter() - started) * 1000)
+        await asyncio.sleep(interval)
+    return samples
+
+
+def random_file(size_mb: int, chunk_size: int = 1024 * 1024):
+    """Yield size_mb of random bytes without holding the whole file in memory."""
+    for _ in range(size_mb):
+        yield os.urandom(chunk_size)
+
+
+class StreamedFile:
+    """File-like object producing random bytes for multipart uploads."""
+
+    def __init__(self, size_mb: int):
+        self._chunks = random_file(size_mb)
+        self._buffer = b""
+
+    def read(self, size: int = -1) -> bytes:
+        while size < 0 or len(self._buffer) < size:
+            try:
+                self._buffer += next(self._chunks)
+            except StopIteration:
+                break
+        if size < 0:
+            data, self._buffer = self._buffer, b""
+        else:
+            data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+
+async def upload(client: httpx.AsyncClient, base_url: str, token: str, size_mb: int) -> float:
+    started = time.perf_counter()
+    response = await client.post(
+        f"{base_url}/api/uploads/upload",
+        headers={"Authorization": f"Bearer {token}"},
+        files={"file": ("bench.bin", StreamedFile(size_mb), "application/octet-stream")},
+        timeout=None
+    )
+    response.raise_for_status()
+    return (time.perf_counter() - started) * 1000
+
+
+async def run(args):
+    async with httpx.AsyncClient(timeout=30) as client:
+        user = await register_bench_user(client, args.base_url)
+
+        stop = asyncio.Event()
+        idle_probe = asyncio.create_task(probe(client, args.base_url, args.probe_interval, stop))
+        await asyncio.sleep(args.idle_seconds)
+        stop.set()
+        idle_samples = await idle_probe
+
+        stop = asyncio.Event()
+        busy_probe = asyncio.create_task(probe(client, args.base_url, args.probe_interval, stop))
+        upload_times = await asyncio.gather(*[
+            upload(client, args.base_url, user["token"], args.size_mb) for _ in range(args.concurrency)
+        ])
+        stop.set()
+        busy_samples = await busy_probe
+
+    print_table("Health probe latency (ms) - reflects server event-loop lag", {
+        "idle": summarize(idle_samples),
+        f"during {args.concurrency} x {args.size_mb} MB uploads": summarize(busy_samples),
+    })
+    print_table("Upload duration (ms)", {"upload": summarize(upload_times)})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--size-mb", type=int, default=100, help="size of each uploaded file")
+    parser.add_argument("--concurrency", type=int, default=4, help="concurrent uploads")
+    parser.add_argument("--probe-interval", type=float, default=0.01, help="seconds between health probes")
+    parser.add_argument("--idle-seconds", type=float, default=3.0, help="baseline probing before uploads start")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
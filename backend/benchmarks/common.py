@@ -0,0 +1,104 @@
+"""Helpers shared by the benchmark scripts."""
+import json
+import platform
+import statistics
+import subprocess
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+RESULTS_DIR = Path(__file__).parent / "results"
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    """Nearest-rank percentile of a list of samples."""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def summarize(samples_ms: List[float]) -> Dict[str, float]:
+    """Summarize latency samples (milliseconds)."""
+    return {
+        "count": len(samples_ms),
+        "mean_ms": round(statistics.fmean(samples_ms), 3) if samples_ms else 0.0,
+        "p50_ms": round(percentile(samples_ms, 50), 3),
+        "p95_ms": round(percentile(samples_ms, 95), 3),
+        "p99_ms": round(percentile(samples_ms, 99), 3),
+        "max_ms": round(max(samples_ms), 3) if samples_ms else 0.0,
+    }
+
+
+def time_call(func: Callable, *args, **kwargs) -> float:
+    """Run func once and return elapsed milliseconds."""
+    started = time.perf_counter()
+    func(*args, **kwargs)
+    return (time.perf_counter() - started) * 1000
+
+
+def print_table(title: str, rows: Dict[str, Dict[str, float]]) -> None:
+    """Print benchmark summaries as an aligned table."""
+    print(f"\n{title}")
+    print(f"{'case':<36}{'count':>8}{'mean':>10}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}")
+    for name, stats in rows.items():
+        print(
+            f"{name:<36}{stats['count']:>8}{stats['mean_ms']:>10.3f}{stats['p50_ms']:>10.3f}"
+            f"{stats['p95_ms']:>10.3f}{stats['p99_ms']:>10.3f}{stats['max_ms']:>10.3f}"
+        )
+
+
+def bench_username(prefix: str) -> str:
+    """Unique username for seeded benchmark users."""
+    return f"{prefix}_{uuid.uuid4().hex[:12]}"
+
+
+async def register_bench_user(client, base_url: str) -> dict:
+    """Register a throwaway user through the API; returns its id, email, password and access token."""
+    username = bench_username("bench")
+    email = f"{username}@bench.example.com"
+    password = "benchPassw0rd"
+    response = await client.post(
+        f"{base_url}/api/auth/register",
+        json={"email": email, "username": username, "password": password}
+    )
+    response.raise_for_status()
+    token = response.json()["access_token"]
+    me = await client.get(f"{base_url}/api/auth/me", headers={"Authorization": f"Bearer {token}"})
+    me.raise_for_status()
+    return {"id": me.json()["id"], "email": email, "password": password, "token": token}
+
+
+def git_revision() -> str:
+    """Short hash of the checked-out commit, with -dirty for uncommitted changes ("" outside git)."""
+    try:
+        return subprocess.run(
+            ["git", "describe", "--always", "--dirty"], capture_output=True, text=True, check=True,
+            cwd=Path(__file__).parent
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def save_results(benchmark: str, config: Dict[str, Any], results: Dict[str, Any], path: Path = None) -> Path:
+    """
+    Write a benchmark run as JSON for regression tracking: what ran (benchmark, config),
+    on what (revision, host) and the results. Defaults to results/<benchmark>-<timestamp>.json.
+    """
+    started = datetime.utcnow()
+    if path is None:
+        RESULTS_DIR.mkdir(exist_ok=True)
+        path = RESULTS_DIR / f"{benchmark}-{started:%Y%m%dT%H%M%S}.json"
+    document = {
+        "benchmark": benchmark,
+        "recorded_at": started.isoformat(),
+        "revision": git_revision(),
+        "host": {"python": platform.python_version(), "machine": platform.machine(), "system": platform.system()},
+        "config": config,
+        "results": results,
+    }
+    path.write_text(json.dumps(document, indent=2, default=str) + "\n")
+    return path
@@ -2,7 +2,18 @@ from sqlalchemy import inspect, text
 from app.db.session import engine, Base
 
 # ✅ Import all models before create_all
-from app.models import user, contact, conversation, message, friend_request, call, invite, blocked_user, notification
+from app.models import user, contact, conversation, message, friend_request, call, invite, blocked_user, notification, phone_book_entry, attachment_blob, storage_usage, revoked_token, used_connect_ticket
+
+def create_extensions():
+    print("Enabling database extensions...")
+    try:
+        with engine.connect() as conn:
+            # pg_trgm backs the trigram indexes used by user search
+            conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+            conn.commit()
+        print("✅ Extensions enabled.")
+    except Exception as e:
+        print("❌ Error enabling extensions:", e)
 
 def create_missing_tables():
     print("Creating missing tables...")
@@ -34,8 +45,39 @@ def add_missing_columns():
                 except Exception as e:
                     print(f"❌ Error creating {table_name}: {e}")
 
+def create_missing_indexes():
+    # create_all() skips indexes on tables that already exist
+    for table_name, model_table in Base.metadata.tables.items():
+        for index in model_table.indexes:
+            try:
+                index.create(bind=engine, checkfirst=True)
+            except Exception as e:
+                print(f"⚠️ Error creating index {index.name} on {table_name}: {e}")
+
+def backfill_phone_hashes():
+    from app.db.session import SessionLocal
+    from app.models.user import User
+    from app.utils.phone import normalize_phone, hash_phone
+    db = SessionLocal()
+    try:
+        users = db.query(User).filter(User.phone.isnot(None), User.phone_hash.is_(None)).all()
+        for db_user in users:
+            normalized = normalize_phone(db_user.phone)
+            db_user.phone_hash = hash_phone(normalized) if normalized else None
+        db.commit()
+        if users:
+            print(f"Backfilled phone hashes for {len(users)} users")
+    except Exception as e:
+        print(f"⚠️ Error backfilling phone hashes: {e}")
+        db.rollback()
+    finally:
+        db.close()
+
 if __name__ == "__main__":
     print("🔧 Syncing database...")
+    create_extensions()
     create_missing_tables()
     add_missing_columns()
+    create_missing_indexes()
+    backfill_phone_hashes()
     print("✅ Database sync complete.")
@@ -1,23 +1,39 @@
 from fastapi import FastAPI, Depends, Request, status, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import RedirectResponse
 from fastapi.exceptions import RequestValidationError
 from fastapi.security import HTTPBearer
-from fastapi.staticfiles import StaticFiles
 from fastapi.encoders import jsonable_encoder
-from app.routes import auth, users, friends, messages, websocket, upload, conversations
+from app.routes import auth, users, friends, messages, websocket, upload, conversations, internal
 from app.db.session import engine, Base
 from app.core.auth import get_current_user
 from app.models.user import User
-from app.utils.file_upload import initialize_directories
-from app.utils.logger import safe_print
+from app.utils.file_upload import initialize_directories, locate_storage_key
+from starlette.concurrency import run_in_threadpool
+from app.utils.thumbnails import shutdown_thumbnail_pool
+from app.core.security import shutdown_password_pool
+from app.core.tokens import load_revocations, run_revocation_sync
+from app.utils.orphan_sweeper import run_orphan_sweeper
+from app.utils.file_serving import ShardedStaticFiles
+from app.utils.storage import get_storage
+from app.core.config import settings
+from app.core.responses import UnicodeJSONResponse
+from app.core.metrics import http_request_duration
+from app.core.invalidation import start_invalidation_listener, stop_invalidation_listener
+from app.core.loop_monitor import start_loop_monitor, stop_loop_monitor
+from app.core.profiler import start_continuous_sampler, stop_continuous_sampler
+from app.core.sql_trace import finish_trace, install_sql_tracing, start_trace
+from app.utils.logger import RouteSampler, get_logger, setup_logging, shutdown_logging
 from dotenv import load_dotenv
 from pathlib import Path
-import json
-import traceback
+import asyncio
+import logging
+import time
 import sys
 
 load_dotenv()
+setup_logging()
+logger = get_logger(__name__)
 
 # Configure UTF-8 encoding for Windows console
 if sys.platform == 'win32':
@@ -29,17 +45,6 @@ if sys.platform == 'win32':
     except:
         pass
 
-# Custom JSON encoder that preserves Unicode characters (emojis)
-class UnicodeJSONResponse(JSONResponse):
-    def render(self, content) -> bytes:
-        return json.dumps(
-            content,
-            ensure_ascii=False,
-            allow_nan=False,
-            indent=None,
-            separators=(",", ":"),
-        ).encode("utf-8")
-
 # Create uploads directory if it doesn't exist
 UPLOADS_DIR = Path(__file__).parent / "uploads"
 UPLOADS_DIR.mkdir(exist_ok=True)
@@ -66,33 +71,61 @@ app = FastAPI(
 )
 
 # Mount static files directory for uploads with CORS headers
-app.mount("/uploads", StaticFiles(directory=str(UPLOADS_DIR)), name="uploads")
+if settings.STORAGE_BACKEND == "local":
+    app.mount("/uploads", ShardedStaticFiles(directory=str(UPLOADS_DIR)), name="uploads")
+else:
+    # Media lives in object storage; keep /uploads/<key> URLs working by redirecting
+    @app.get("/uploads/{key:path}", include_in_schema=False)
+    async def redirect_upload(key: str):
+        located_key = await run_in_threadpool(locate_storage_key, f"/uploads/{key}")
+        return RedirectResponse(get_storage().presign_get(located_key), status_code=307)
+
+# Attribute every query to the request (or WebSocket event) that ran it
+install_sql_tracing(engine)
+
+# Access log: one record per request, sampled per route; errors and slow requests always
+access_logger = get_logger("access")
+request_sampler = RouteSampler(settings.LOG_REQUEST_SAMPLE_RATE, settings.LOG_ROUTE_SAMPLE_RATES)
 
-# Add request logging middleware
 @app.middleware("http")
 async def log_requests(request: Request, call_next):
-    """Log all incoming API requests"""
-    method = request.method
-    url = str(request.url)
-    path = request.url.path
-    query_params = str(request.query_params) if request.query_params else ""
-    
-    # Log request
-    safe_print("\n" + "="*60)
-    safe_print(f"[{method}] {path}")
-    if query_params:
-        safe_print(f"Query Params: {query_params}")
-    safe_print(f"Client: {request.client.host if request.client else 'Unknown'}")
-    safe_print("="*60)
-    
-    # Process request
-    response = await call_next(request)
-    
-    # Log response
-    safe_print(f"[{method}] {path} - Status: {response.status_code}")
-    safe_print("="*60 + "\n")
-    
-    return response
+    """Record each request's latency and queries, and log its route, status and duration"""
+    start = time.perf_counter()
+    status_code = 500
+    sql = start_trace(request.url.path)
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        if settings.SQL_TRACE_HEADERS:
+            response.headers.update(sql.headers())
+        return response
+    finally:
+        duration = time.perf_counter() - start
+        route = request.scope.get("route")
+        # Route template rather than the path, so IDs don't make every URL distinct;
+        # unmatched paths (404s, static files) share one label
+        route_path = getattr(route, "path", None)
+        http_request_duration.observe(duration, request.method, route_path or "unmatched", str(status_code))
+        finish_trace(sql, f"{request.method} {route_path or 'unmatched'}")
+        if access_logger.isEnabledFor(logging.INFO):
+            duration_ms = duration * 1000
+            route_path = route_path or request.url.path
+            slow = duration_ms >= settings.LOG_SLOW_REQUEST_MS
+            if status_code >= 500 or slow or request_sampler.should_log(route_path):
+                level = logging.ERROR if status_code >= 500 else logging.WARNING if slow else logging.INFO
+                access_logger.log(
+                    level, "%s %s %d", request.method, route_path, status_code,
+                    extra={
+                        "method": request.method,
+                        "route": route_path,
+                        "path": request.url.path,
+                        "status": status_code,
+                        "duration_ms": round(duration_ms, 2),
+                        "sql_count": sql.count,
+                        "sql_ms": round(sql.total * 1000, 2),
+                        "client": request.client.host if request.client else None,
+                    }
+                )
 
 # Configure CORS - MUST be added before routes
 app.add_middleware(
@@ -125,11 +158,7 @@ async def http_exception_handler(request: Request, exc: HTTPException):
 @app.exception_handler(Exception)
 async def global_exception_handler(request: Request, exc: Exception):
     """Handle all other exceptions and ensure CORS headers are included"""
-    import traceback
-    try:
-        traceback.print_exc()
-    except UnicodeEncodeError:
-        safe_print("Traceback contains Unicode - check logs")
+    logger.error("Unhandled error in %s %s", request.method, request.url.path, exc_info=exc)
     
     origin = request.headers.get("origin")
     allowed_origins = ["https://messaging-app-phi-three.vercel.app"]
@@ -181,6 +210,36 @@ app.include_router(upload.public_router, prefix="/api/uploads", tags=["Upload"])
 
 app.include_router(websocket.router, prefix="/api", tags=["WebSocket"])
 
+# Internal monitoring endpoints (X-Internal-Token only; refused when INTERNAL_API_TOKEN is unset)
+app.include_router(internal.router, prefix="/api/internal", tags=["Internal"])
+
+@app.on_event("startup")
+async def start_background_tasks():
+    """Load revoked tokens, then start the cache invalidation listener, the orphaned upload sweeper, the revoked token sync, the loop monitor and the always-on profiler"""
+    # Fail startup rather than serve requests without the revoked tokens
+    await run_in_threadpool(load_revocations)
+    start_invalidation_listener()
+    if settings.ORPHAN_SWEEP_INTERVAL > 0:
+        app.state.orphan_sweeper = asyncio.create_task(run_orphan_sweeper())
+    if settings.TOKEN_REVOCATION_SYNC_INTERVAL > 0:
+        app.state.revocation_sync = asyncio.create_task(run_revocation_sync())
+    start_loop_monitor()
+    start_continuous_sampler()
+
+@app.on_event("shutdown")
+async def shutdown_workers():
+    """Stop the sweeper, the token sync, the invalidation listener, the monitors, the thumbnail and password workers and the log writer"""
+    for name in ("orphan_sweeper", "revocation_sync"):
+        task = getattr(app.state, name, None)
+        if task is not None:
+            task.cancel()
+    stop_invalidation_listener()
+    stop_loop_monitor()
+    stop_continuous_sampler()
+    shutdown_thumbnail_pool()
+    shutdown_password_pool()
+    shutdown_logging()
+
 @app.get("/")
 async def root():
     return {"message": "Welcome to the Chatting App API"}
@@ -0,0 +1,155 @@
+"""
+Move uploads in sharded folders (profile_images, attachments/*) from the old flat
+layout to <ab>/<cd>/ subdirectories.
+
+Safe to run while the API is serving: old URLs resolve to whichever location a
+file is at (see locate_storage_key and ShardedStaticFiles), each file is moved on
+its own (an atomic rename on local storage), and batches are separated by a pause
+so the migration doesn't compete with traffic. Every move is appended to a JSONL
+journal; rerunning resumes after the last finished batch, and --revert moves the
+journaled files back.
+
+    python migrate_upload_layout.py --dry-run
+    python migrate_upload_layout.py --batch-size 500 --pause 0.5
+    python migrate_upload_layout.py --revert
+"""
+import argparse
+import json
+import time
+from datetime import datetime
+from pathlib import Path
+
+from app.utils.file_upload import shard_key
+from app.utils.storage import get_storage
+
+DEFAULT_JOURNAL = Path(__file__).parent / "upload_layout_migration.jsonl"
+
+
+def read_journal(path: Path) -> list:
+    if not path.exists():
+        return []
+    entries = []
+    with path.open() as journal:
+        for line in journal:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entries.append(json.loads(line))
+            except json.JSONDecodeError:
+                # A line cut short by a crash; everything before it is intact
+                break
+    return entries
+
+
+def append_journal(journal, event: str, **fields) -> None:
+    journal.write(json.dumps({"event": event, "at": datetime.utcnow().isoformat(), **fields}) + "\n")
+    journal.flush()
+
+
+def migrate(args) -> None:
+    storage = get_storage()
+    entries = read_journal(args.journal)
+    if entries and entries[-1]["event"] == "done" and not args.restart:
+        print(f"Migration already finished ({entries[-1]['moved']} files moved). Use --restart to scan again.")
+        return
+
+    cursor = ""
+    moved_total = 0
+    if not args.restart:
+        for entry in entries:
+            if entry["event"] == "batch":
+                cursor = entry["cursor"]
+            elif entry["event"] == "move":
+                moved_total += 1
+    if cursor:
+        print(f"Resuming after {cursor} ({moved_total} files already moved)")
+
+    batches = 0
+    finished = False
+    with args.journal.open("a") as journal:
+        while True:
+            keys = storage.list_keys(cursor, args.batch_size)
+            if not keys:
+                finished = True
+                break
+            moved = skipped = 0
+            for key, size, _ in keys:
+                new_key = shard_key(key)
+                if new_key == key:
+                    continue
+                if args.dry_run:
+                    moved += 1
+                    continue
+                if storage.exists(new_key):
+                    # Stored again under the new layout since the deploy; the flat copy is redundant
+                    # for content-addressed names, otherwise leave it for a human to look at
+                    if storage.size(new_key) == size:
+                        storage.delete(key)
+                        append_journal(journal, "dedup", source=key, target=new_key, size=size)
+                    else:
+                        append_journal(journal, "conflict", source=key, target=new_key, size=size)
+                        skipped += 1
+                    continue
+                storage.move(key, new_key)
+                append_journal(journal, "move", source=key, target=new_key, size=size)
+                moved += 1
+
+            cursor = keys[-1][0]
+            moved_total += moved
+            batches += 1
+            if not args.dry_run:
+                append_journal(journal, "batch", cursor=cursor, moved=moved, scanned=len(keys))
+            print(f"batch {batches}: scanned {len(keys)}, "
+                  f"{'would move' if args.dry_run else 'moved'} {moved}, conflicts {skipped} "
+                  f"(total {moved_total}) up to {cursor}")
+            if len(keys) < args.batch_size:
+                finished = True
+                break
+            if args.max_batches and batches >= args.max_batches:
+                break
+            time.sleep(args.pause)
+
+        if finished and not args.dry_run:
+            append_journal(journal, "done", moved=moved_total)
+    print(f"{'Dry run: would move' if args.dry_run else 'Moved'} {moved_total} files"
+          f"{'' if finished else ' so far; rerun to continue'}")
+
+
+def revert(args) -> None:
+    storage = get_storage()
+    moves = [entry for entry in read_journal(args.journal) if entry["event"] == "move"]
+    reverted = 0
+    for entry in reversed(moves):
+        if not storage.exists(entry["target"]):
+            continue
+        if not args.dry_run:
+            storage.move(entry["target"], entry["source"])
+        reverted += 1
+        if reverted % args.batch_size == 0:
+            print(f"{reverted} files moved back")
+            time.sleep(args.pause)
+    if not args.dry_run and moves:
+        # Start over next time instead of resuming past the reverted files
+        args.journal.rename(args.journal.with_suffix(f".reverted-{int(time.time())}.jsonl"))
+    print(f"{'Dry run: would move back' if args.dry_run else 'Moved back'} {reverted} files")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=500, help="files listed per batch")
+    parser.add_argument("--pause", type=float, default=0.2, help="seconds to sleep between batches")
+    parser.add_argument("--max-batches", type=int, default=0, help="stop after this many batches (0: run to the end)")
+    parser.add_argument("--journal", type=Path, default=DEFAULT_JOURNAL, help="JSONL progress journal")
+    parser.add_argument("--dry-run", action="store_true", help="only count the files that would move")
+    parser.add_argument("--restart", action="store_true", help="ignore the journal's progress and scan from the start")
+    parser.add_argument("--revert", action="store_true", help="move the journaled files back to the flat layout")
+    args = parser.parse_args()
+    if args.revert:
+        revert(args)
+    else:
+        migrate(args)
+
+
+if __name__ == "__main__":
+    main()
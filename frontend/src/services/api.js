@@ -91,6 +91,12 @@ export const authAPI = {
      */
     refresh: (refreshToken) =>
         api.post('/auth/refresh', { refresh_token: refreshToken }),
+
+    /**
+     * Gets a single-use ticket for opening the WebSocket (valid for a few seconds).
+     */
+    getWsTicket: () =>
+        api.post('/auth/ws-ticket'),
 };
 
 // User API
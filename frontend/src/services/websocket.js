@@ -1,3 +1,5 @@
+import { authAPI } from './api';
+
 class WebSocketService {
     constructor() {
         this.socket = null;
@@ -7,15 +9,18 @@ class WebSocketService {
         this.reconnectDelay = 1000;
     }
 
-    connect(userId) {
+    async connect(userId) {
         if (!userId) {
             console.error('User ID is required to connect to WebSocket');
             return;
         }
 
-        const wsUrl = `${import.meta.env.VITE_WS_URL || 'ws://localhost:8000/api/ws'}/${userId}`;
-
         try {
+            // Every (re)connect needs a fresh one-time ticket
+            const response = await authAPI.getWsTicket();
+            const ticket = encodeURIComponent(response.data.ticket);
+            const wsUrl = `${import.meta.env.VITE_WS_URL || 'ws://localhost:8000/api/ws'}/${userId}?ticket=${ticket}`;
+
             this.socket = new WebSocket(wsUrl);
 
             this.socket.onopen = () => {